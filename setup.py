@@ -1,14 +1,29 @@
 #!/usr/bin/env python
 from setuptools import setup,find_packages
 
+async_deps = [
+    'aiohttp',
+]
+
+fast_deps = [
+    'orjson',
+]
+
+streaming_deps = [
+    'ijson>=3.1',
+]
+
 test_deps = [
     'pytest',
     'pylint',
     "mock",
-]
+] + async_deps + streaming_deps
 
 extras = {
     'test': test_deps,
+    'async': async_deps,
+    'fast': fast_deps,
+    'streaming': streaming_deps,
 }
 
 setup(
@@ -1,28 +1,47 @@
 """Singer.io tap that syncs data from Solarvista."""
 #!/usr/bin/env python3
 import argparse
-import pkg_resources
 import singer
 from singer import utils
 
 from tap_solarvista import catalog
-from tap_solarvista import sync
 
 REQUIRED_CONFIG_KEYS = ["start_date", "clientId", "code", "account"]
 LOGGER = singer.get_logger()
 
+def get_version():
+    """ Returns the installed version of this module """
+    try:
+        from importlib.metadata import version # pylint: disable=import-outside-toplevel
+    except ImportError:
+        # python 3.7
+        import pkg_resources # pylint: disable=import-outside-toplevel
+        return pkg_resources.require("tap_solarvista")[0].version
+    return version("tap_solarvista")
+
+class VersionAction(argparse.Action):
+    """ Print the version, only looked up when requested """
+
+    def __init__(self, option_strings, dest=argparse.SUPPRESS, default=argparse.SUPPRESS,
+                 help=None): # pylint: disable=redefined-builtin
+        super().__init__(option_strings=option_strings, dest=dest, default=default, nargs=0,
+                         help=help)
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        # on stdout, like the argparse version action
+        print(get_version())
+        parser.exit()
+
 @utils.handle_top_exception(LOGGER)
 def main():
     """Main entrypoint into this module, typically tap-solarvista."""
 
-    version = pkg_resources.require("tap_solarvista")[0].version
-
     # Parse our args, before handing off to singer
     parser = argparse.ArgumentParser()
     parser.add_argument(
         '-v', '--version',
         help='Print version',
-        action='version', version=version)
+        action=VersionAction)
 
     parser.add_argument(
         '-c', '--config',
@@ -52,21 +71,23 @@ def main():
     # Parse command line arguments
     args = utils.parse_args(REQUIRED_CONFIG_KEYS)
 
-    selected_datasources = args.config.get('datasources')
-
-    if args.catalog:
-        data_catalog = args.catalog
-    if selected_datasources:
-        data_catalog = catalog.discover(selected_datasources)
-    else:
-        data_catalog = catalog.discover({})
-
     # If discover flag was passed, run discovery mode and dump output to stdout
     if args.discover:
-        data_catalog.dump()
+        catalog.discover(args.config.get('datasources') or {}).dump()
     # Otherwise run in sync mode
     else:
-        sync.sync_all_data(args.config, args.state, data_catalog)
+        # the http and sync modules are only needed to sync
+        from tap_solarvista import sync # pylint: disable=import-outside-toplevel
+        sync.sync_all_data(args.config, args.state, sync_catalog(args))
+
+def sync_catalog(args):
+    """ Returns the catalog to sync, the supplied catalog or else the streams of the
+        configured 'datasources' """
+    if args.catalog:
+        return args.catalog
+    selected_datasources = args.config.get('datasources')
+    # only the selected schemas are loaded
+    return catalog.discover(selected_datasources or {}, selected_only=True)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,81 @@
+""" auth is responsible for the lifecycle of the access tokens used with Solarvista API """
+import time
+import singer
+from tap_solarvista import cache
+from tap_solarvista import context
+
+LOGGER = singer.get_logger()
+DEFAULT_TOKEN_REFRESH_MARGIN = 60 # seconds before expiry a token is refreshed
+
+EXPIRES_AT = {} # access token -> epoch seconds it expires, unknown for personal access tokens
+REFRESH_MARGINS = {} # access token -> seconds before expiry it is refreshed
+
+def token_lock():
+    """ Returns the lock held while the token of the current account is fetched """
+    return context.current().token_lock
+
+def current_token(config):
+    """ Returns the access token in config, None when there is none or it is about to expire
+        so the caller refreshes it ahead of time instead of waiting for a 401 """
+    access_token = config.get('personal_access_token')
+    if access_token is not None and is_expiring(config, access_token):
+        LOGGER.info("Access token expires within %s seconds, refreshing",
+                    refresh_margin(config))
+        invalidate(config, access_token)
+        return None
+    return access_token
+
+def is_expiring(config, access_token):
+    """ Returns True when the token expires within the 'token_refresh_margin' """
+    expires_at = EXPIRES_AT.get(access_token)
+    margin = REFRESH_MARGINS.get(access_token, refresh_margin(config))
+    return expires_at is not None and expires_at - margin <= time.time()
+
+def refresh_margin(config):
+    """ Returns the seconds before expiry a token is refreshed """
+    return float(config.get('token_refresh_margin', DEFAULT_TOKEN_REFRESH_MARGIN))
+
+def invalidate(config, access_token):
+    """ Discard the token, unless another caller has already replaced it """
+    if config.get('personal_access_token') == access_token:
+        config.pop('personal_access_token', None)
+    EXPIRES_AT.pop(access_token, None)
+    REFRESH_MARGINS.pop(access_token, None)
+
+def store_token(config, response_data):
+    """ Keep the token from a token response with its expiry, and in the
+        'token_cache_path' file when configured, returning the access token """
+    access_token = response_data['access_token']
+    config['personal_access_token'] = access_token
+    expires_at = None
+    if response_data.get('expires_in') is not None:
+        expires_in = float(response_data['expires_in'])
+        expires_at = time.time() + expires_in
+        EXPIRES_AT[access_token] = expires_at
+        # a token living no longer than the margin is used for half its life, rather than
+        # refreshed on every request
+        REFRESH_MARGINS[access_token] = min(refresh_margin(config), expires_in / 2)
+    if config.get('token_cache_path') and expires_at is not None:
+        cache.write_json(config['token_cache_path'], {
+            'account': config.get('account'),
+            'clientId': config.get('clientId'),
+            'access_token': access_token,
+            'expires_at': expires_at
+        })
+    return access_token
+
+def cached_token(config):
+    """ Returns the token cached by a previous run in the 'token_cache_path' file,
+        None when not configured, for another account or client, or about to expire """
+    if not config.get('token_cache_path'):
+        return None
+    cached = cache.read_json(config['token_cache_path'])
+    if (not cached or cached.get('account') != config.get('account')
+            or cached.get('clientId') != config.get('clientId')):
+        return None
+    if cached.get('expires_at', 0) - refresh_margin(config) <= time.time():
+        return None
+    LOGGER.info("Using cached access token %s", config['token_cache_path'])
+    config['personal_access_token'] = cached['access_token']
+    EXPIRES_AT[cached['access_token']] = cached['expires_at']
+    return cached['access_token']
@@ -0,0 +1,53 @@
+""" cache is responsible for the local files that persist data between tap runs """
+import json
+import os
+import tempfile
+import time
+import singer
+
+LOGGER = singer.get_logger()
+
+def read_json(path, ttl=None):
+    """ Returns the json data cached at path, None when missing, unreadable or older than ttl """
+    try:
+        if ttl is not None and time.time() - os.path.getmtime(path) > float(ttl):
+            LOGGER.debug("Cache expired %s", path)
+            return None
+        with open(path, encoding='utf8') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+def write_json(path, data):
+    """ Write the json data to path, replacing any previous file atomically """
+    directory = os.path.dirname(os.path.abspath(path))
+    try:
+        os.makedirs(directory, exist_ok=True)
+        with tempfile.NamedTemporaryFile('w', encoding='utf8', dir=directory,
+                                         delete=False) as file:
+            json.dump(data, file)
+        os.replace(file.name, path)
+    except OSError as err:
+        LOGGER.warning("Unable to write cache %s: %s", path, err)
+
+def touch(path):
+    """ Mark the cache file as recently used """
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+def prune(directory, max_entries):
+    """ Remove the least recently used json files beyond max_entries from the directory """
+    try:
+        with os.scandir(directory) as entries:
+            files = [(entry.stat().st_mtime, entry.path) for entry in entries
+                     if entry.is_file() and entry.name.endswith('.json')]
+    except OSError:
+        return
+    files.sort()
+    for _, path in files[:max(0, len(files) - int(max_entries))]:
+        try:
+            os.remove(path)
+        except OSError as err:
+            LOGGER.warning("Unable to remove cache %s: %s", path, err)
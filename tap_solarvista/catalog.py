@@ -1,14 +1,22 @@
 """catalog is responsible for inspecting which streams the target solarvista account supports."""
 #!/usr/bin/env python3
+from singer import metadata
 from singer.catalog import Catalog, CatalogEntry
 from tap_solarvista import schemas
 
-def discover(selected_datasources):
-    """Discover the streams this module can sync."""
-    raw_schemas = schemas.load_schemas()
+# streams that are not synced from a datasource query
+NON_DATASOURCE_STREAMS = ['workitem_stream', 'workitemhistory_stream', 'activity_stream',
+                          'appointment_stream']
+
+def discover(selected_datasources, selected_only=False):
+    """Discover the streams this module can sync, only the selected streams when
+    selected_only so the schemas of the others are not loaded."""
+    stream_ids = schemas.list_stream_ids()
+    if selected_only:
+        stream_ids = [stream_id for stream_id in stream_ids
+                      if schemas.extract_datasource(stream_id) in (selected_datasources or [])]
     streams = []
-    for stream_id, schema in raw_schemas.items():
-        stream_metadata = []
+    for stream_id, schema in schemas.load_schemas(stream_ids).items():
         # populate any metadata and stream's key properties here..
         datasource = schemas.extract_datasource(stream_id)
         # stream id becomes the table name, strip invalid characters for downstream targets
@@ -19,11 +27,10 @@ def discover(selected_datasources):
         if stream_id == 'workitem_stream':
             stream_replication_key = "lastModified"
             stream_replication_method = "INCREMENTAL"
-
-        if selected_datasources and datasource in selected_datasources:
-            stream_metadata = [
-                {'breadcrumb': (), 'metadata': {'selected': True}}
-            ]
+        elif stream_id not in NON_DATASOURCE_STREAMS:
+            # datasource rows carry the time they were last modified
+            stream_replication_key = "lastModified"
+            stream_replication_method = "INCREMENTAL"
 
         key_properties = ['reference']
         if stream_id == 'appointment_stream':
@@ -35,13 +42,25 @@ def discover(selected_datasources):
         if stream_id == 'activity_stream':
             key_properties = ['activityId']
 
+        stream_metadata = metadata.new()
+        if selected_datasources and datasource in selected_datasources:
+            stream_metadata = metadata.write(stream_metadata, (), 'selected', True)
+        # key properties and the replication key are always synced, any other
+        # property can be deselected
+        for property_name in schema.properties or {}:
+            inclusion = 'available'
+            if property_name in key_properties or property_name == stream_replication_key:
+                inclusion = 'automatic'
+            stream_metadata = metadata.write(stream_metadata, ('properties', property_name),
+                                             'inclusion', inclusion)
+
         streams.append(
             CatalogEntry(
                 tap_stream_id=stream_id,
                 stream=stream_name,
                 schema=schema,
                 key_properties=key_properties,
-                metadata=stream_metadata,
+                metadata=metadata.to_list(stream_metadata),
                 replication_key=stream_replication_key,
                 is_view=None,
                 database=None,
@@ -0,0 +1,99 @@
+""" context is responsible for the config, state and run cache of the account being synced,
+each account has its own context when several accounts are synced in one process """
+import contextvars
+import functools
+import threading
+from collections.abc import MutableMapping
+
+
+class AccountContext: # pylint: disable=too-few-public-methods
+    """ The config, state, run cache, rate limiter and token lock of an account """
+
+    def __init__(self, config=None, state=None, parent_state=None, limiter=None):
+        """ Constructor with the state of the account within the parent state written in
+            state messages, the same unless several accounts are synced """
+        self.config = config if config is not None else {}
+        self.state = state if state is not None else {}
+        self.root_state = parent_state if parent_state is not None else self.state
+        self.run_cache = {}
+        self.limiter = limiter
+        # the token of each account is fetched once for its waiting callers
+        self.token_lock = threading.Lock()
+
+
+DEFAULT = AccountContext()
+CURRENT = contextvars.ContextVar('account_context', default=DEFAULT)
+
+
+class ContextMapping(MutableMapping):
+    """ A dict of the current account context, e.g. its config """
+
+    def __init__(self, name):
+        """ Constructor with the name of the context attribute """
+        self.name = name
+
+    def target(self):
+        """ Returns the dict of the current account context """
+        return getattr(CURRENT.get(), self.name)
+
+    def __getitem__(self, key):
+        return self.target()[key]
+
+    def __setitem__(self, key, value):
+        self.target()[key] = value
+
+    def __delitem__(self, key):
+        del self.target()[key]
+
+    def __iter__(self):
+        return iter(self.target())
+
+    def __len__(self):
+        return len(self.target())
+
+    def __repr__(self):
+        return repr(self.target())
+
+
+CONFIG = ContextMapping('config')
+STATE = ContextMapping('state')
+RUN_CACHE = ContextMapping('run_cache')
+
+def current():
+    """ Returns the context of the account being synced """
+    return CURRENT.get()
+
+def is_multi_account():
+    """ Returns True when one of several accounts is being synced """
+    return CURRENT.get() is not DEFAULT
+
+def root_state():
+    """ Returns the state to write in state messages, holding the state of every account """
+    return CURRENT.get().root_state
+
+def run(account_context, function, *args):
+    """ Call the function with the account context """
+    token = CURRENT.set(account_context)
+    try:
+        return function(*args)
+    finally:
+        CURRENT.reset(token)
+
+def bind(function):
+    """ Returns the function called with the current account context on another thread,
+        e.g. by an executor """
+    account_context = CURRENT.get()
+    if account_context is DEFAULT:
+        return function
+
+    @functools.wraps(function)
+    def bound(*args, **kwargs):
+        return run(account_context, functools.partial(function, *args, **kwargs))
+    return bound
+
+def reset():
+    """ Replace the config, state and run cache of the default context """
+    DEFAULT.config = {}
+    DEFAULT.state = {}
+    DEFAULT.run_cache = {}
+    DEFAULT.root_state = DEFAULT.state
@@ -0,0 +1,90 @@
+""" flatten is responsible for flattening nested Solarvista records to a single level """
+import threading
+from tap_solarvista import profiling
+
+MAX_PLAN_KEYS = 1000 # keys memoized per object, beyond this names are computed every time
+
+PLANS = {}
+PLANS_LOCK = threading.Lock()
+
+def lower_first_character(string):
+    """ Lower the first character of a string """
+    if string:
+        return string[:1].lower() + string[1:]
+    return ''
+
+def new_plan():
+    """ Returns an empty plan, mapping each key of an object to its flattened name,
+        the prefix of its children and the plan of its children """
+    return {}
+
+def plan_entry(plan, prefix, key):
+    """ Returns the flattened name, child prefix and child plan of a key, memoizing new keys """
+    entry = plan.get(key)
+    if entry is None:
+        name = prefix + lower_first_character(key)
+        entry = (name, name + '_', new_plan())
+        if len(plan) < MAX_PLAN_KEYS:
+            plan[key] = entry
+    return entry
+
+class StreamPlan(dict):
+    """ The plan of a stream, with the flattened names of the properties not selected """
+
+    def __init__(self, excluded=()):
+        """ Constructor with the flattened names left out of every record """
+        super().__init__()
+        self.excluded = frozenset(excluded)
+
+def compile_plan(property_names, excluded=()):
+    """ Compile a plan from the flattened property names of a schema, so the key paths
+        of known properties are resolved before the first record is flattened """
+    plan = StreamPlan(excluded)
+    for property_name in property_names:
+        node, prefix = plan, ''
+        for key in property_name.split('_'):
+            _, prefix, node = plan_entry(node, prefix, key)
+    return plan
+
+def get_plan(stream_id, schema=None):
+    """ Returns the plan of a stream, compiled from its schema on first use """
+    plan = PLANS.get(stream_id)
+    if plan is None:
+        with PLANS_LOCK:
+            plan = PLANS.get(stream_id)
+            if plan is None:
+                properties = []
+                if schema is not None and schema.properties:
+                    properties = schema.properties.keys()
+                plan = PLANS[stream_id] = compile_plan(properties)
+    return plan
+
+def set_plan(stream_id, schema, excluded=()):
+    """ Compile and keep the plan of a stream, leaving out the excluded properties """
+    properties = []
+    if schema is not None and schema.properties:
+        properties = schema.properties.keys()
+    plan = compile_plan(properties, excluded)
+    with PLANS_LOCK:
+        PLANS[stream_id] = plan
+    return plan
+
+def flatten_json(unformated_json, plan=None):
+    """ Flatten a json object, returning a single level underscore separated json structure """
+    if not isinstance(unformated_json, dict):
+        return {'': unformated_json}
+    out = {}
+    plan = get_plan(None) if plan is None else plan
+    with profiling.phase('flatten'):
+        _flatten(out, unformated_json, plan, '', getattr(plan, 'excluded', None) or None)
+    return out
+
+def _flatten(out, json_structure, plan, prefix, excluded):
+    """ Flatten the object into out, following the plan and memoizing unknown keys,
+        properties in excluded are left out """
+    for key, value in json_structure.items():
+        name, child_prefix, child_plan = plan_entry(plan, prefix, key)
+        if isinstance(value, dict):
+            _flatten(out, value, child_plan, child_prefix, excluded)
+        elif excluded is None or name not in excluded:
+            out[name] = value
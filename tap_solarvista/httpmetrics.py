@@ -0,0 +1,115 @@
+""" httpmetrics is responsible for the latency and throughput metrics of the requests to
+Solarvista API, for each endpoint family """
+import bisect
+import re
+import threading
+from urllib.parse import urlsplit
+import singer
+from singer.metrics import Metric, Point, Tag
+
+LOGGER = singer.get_logger()
+LATENCY_BUCKETS = [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30] # seconds, upper bounds of the histogram
+ENDPOINTS = [
+    ('auth', re.compile(r'/connect/token$')),
+    ('datasource_query', re.compile(r'/datasources/ref/[^/]+/data/query$')),
+    ('workitem_search', re.compile(r'/workItems/search$')),
+    ('workitem_history', re.compile(r'/workItems/id/[^/]+/history$')),
+    ('workitem_detail', re.compile(r'/workItems/id/[^/]+$')),
+    ('activity', re.compile(r'/activities/context/[^/]+$')),
+    ('appointments', re.compile(r'/appointments/search/[^/]+$')),
+]
+
+STATS = {}
+STATS_LOCK = threading.Lock()
+
+def endpoint_family(uri):
+    """ Returns the endpoint family of a uri, 'other' when unknown """
+    path = urlsplit(uri).path
+    for endpoint, pattern in ENDPOINTS:
+        if pattern.search(path):
+            return endpoint
+    return 'other'
+
+def reset():
+    """ Discard the statistics of a previous run """
+    with STATS_LOCK:
+        STATS.clear()
+
+def new_stats():
+    """ Returns the empty statistics of an endpoint """
+    return {
+        'requests': 0,
+        'errors': 0,
+        'retries': 0,
+        'bytes': 0,
+        'latency': 0.0,
+        'latency_max': 0.0,
+        'statuses': {},
+        'buckets': [0] * (len(LATENCY_BUCKETS) + 1),
+    }
+
+def record(uri, status, latency, size=0, retries=0):
+    """ Record a completed request, status None when it failed without a response,
+        latency in seconds including its retries """
+    endpoint = endpoint_family(uri)
+    failed = status is None or status >= 400
+    with STATS_LOCK:
+        stats = STATS.setdefault(endpoint, new_stats())
+        stats['requests'] += 1
+        stats['errors'] += int(failed)
+        stats['retries'] += retries
+        stats['bytes'] += size
+        stats['latency'] += latency
+        stats['latency_max'] = max(stats['latency_max'], latency)
+        stats['statuses'][status] = stats['statuses'].get(status, 0) + 1
+        stats['buckets'][bisect.bisect_left(LATENCY_BUCKETS, latency)] += 1
+    singer.metrics.log(LOGGER, Point('timer', Metric.http_request_duration, latency, {
+        Tag.endpoint: endpoint,
+        Tag.http_status_code: status,
+        Tag.status: 'failed' if failed else 'succeeded',
+        'bytes': size,
+        'retries': retries,
+    }))
+
+def response_size(response, stream=False):
+    """ Returns the bytes of a requests response, from its Content-Length when streamed """
+    if stream:
+        return int(response.headers.get('Content-Length') or 0)
+    return len(response.content or b'')
+
+def percentile(stats, fraction):
+    """ Returns the upper bound of the latency bucket holding the fraction of requests,
+        the max latency when beyond the last bucket """
+    rank = fraction * stats['requests']
+    seen = 0
+    for bound, count in zip(LATENCY_BUCKETS, stats['buckets']):
+        seen += count
+        if seen >= rank:
+            return min(bound, stats['latency_max'])
+    return stats['latency_max']
+
+def log_summary():
+    """ Log the statistics of each endpoint, the slowest in total first """
+    with STATS_LOCK:
+        summary = sorted(STATS.items(), key=lambda item: item[1]['latency'], reverse=True)
+        summary = [(endpoint, dict(stats, buckets=list(stats['buckets'])))
+                   for endpoint, stats in summary]
+    for endpoint, stats in summary:
+        LOGGER.info("HTTP %s: %d requests, %d failed, %d retries, %d bytes, "
+                    "%.3fs total, mean %.3fs, p95 %.3fs, max %.3fs",
+                    endpoint, stats['requests'], stats['errors'], stats['retries'],
+                    stats['bytes'], stats['latency'], stats['latency'] / stats['requests'],
+                    percentile(stats, 0.95), stats['latency_max'])
+        buckets = {f"le_{bound}": count
+                   for bound, count in zip(LATENCY_BUCKETS + ['inf'], stats['buckets'])}
+        singer.metrics.log(LOGGER, Point('histogram', 'http_request_latency',
+                                         stats['requests'], {
+            Tag.endpoint: endpoint,
+            'errors': stats['errors'],
+            'retries': stats['retries'],
+            'bytes': stats['bytes'],
+            'latency_total': round(stats['latency'], 3),
+            'latency_max': round(stats['latency_max'], 3),
+            'statuses': {str(status): count for status, count in stats['statuses'].items()},
+            'buckets': buckets,
+        }))
@@ -0,0 +1,201 @@
+""" profiling is responsible for the optional profiles of a run, written to the configured
+'profile_dir': the wall-clock and CPU time of each phase of each stream, a cProfile of
+each stream and sampled wall-clock stacks in collapsed format """
+import contextvars
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+import singer
+
+LOGGER = singer.get_logger()
+DEFAULT_PROFILE_INTERVAL = 0.01 # seconds between wall-clock stack samples
+
+ENABLED = False
+PROFILE_DIR = None
+STREAM = contextvars.ContextVar('profile_stream', default=None)
+LOCAL = threading.local() # whether a cProfile is active on each thread
+LOCK = threading.Lock()
+TIMES = {} # (stream, phase) -> [calls, wall seconds, cpu seconds]
+PROFILES = {} # stream -> cProfile.Profile of each thread that synced it
+THREAD_STREAMS = {} # thread id -> stream, labelling the sampled stacks
+SAMPLES = {} # collapsed stack -> samples
+SAMPLER = {'thread': None, 'stop': None}
+
+def configure(config):
+    """ Enable profiling when a 'profile_dir' is configured, sampling the stacks of every
+        thread each 'profile_interval' seconds """
+    global ENABLED, PROFILE_DIR # pylint: disable=global-statement
+    stop_sampler()
+    with LOCK:
+        TIMES.clear()
+        PROFILES.clear()
+        THREAD_STREAMS.clear()
+        SAMPLES.clear()
+    PROFILE_DIR = config.get('profile_dir')
+    ENABLED = bool(PROFILE_DIR)
+    if ENABLED:
+        LOGGER.info("Profiling to %s", PROFILE_DIR)
+        interval = float(config.get('profile_interval', DEFAULT_PROFILE_INTERVAL))
+        SAMPLER['stop'] = threading.Event()
+        SAMPLER['thread'] = threading.Thread(target=sample_stacks,
+                                             args=(SAMPLER['stop'], interval),
+                                             name='tap-solarvista-profiler', daemon=True)
+        SAMPLER['thread'].start()
+
+def phase(name):
+    """ Returns a context manager timing a phase of the current stream, doing nothing
+        unless profiling is enabled """
+    if not ENABLED:
+        return nullcontext()
+    return timed(name)
+
+@contextmanager
+def timed(name):
+    """ Add the wall-clock and CPU time of the block to the phase of the current stream """
+    started, cpu_started = time.perf_counter(), time.thread_time()
+    try:
+        yield
+    finally:
+        wall, cpu = time.perf_counter() - started, time.thread_time() - cpu_started
+        key = (STREAM.get() or 'run', name)
+        with LOCK:
+            times = TIMES.setdefault(key, [0, 0.0, 0.0])
+            times[0] += 1
+            times[1] += wall
+            times[2] += cpu
+
+@contextmanager
+def stream(stream_id, cpu_profile=True):
+    """ Attribute the phases to the stream, and when cpu_profile the sampled stacks and a
+        cProfile of this thread, streams sharing a thread only attribute their phases """
+    if not ENABLED:
+        yield
+        return
+    token = STREAM.set(stream_id)
+    thread_id = threading.get_ident()
+    previous = THREAD_STREAMS.get(thread_id)
+    profile = None
+    labelled = cpu_profile and not getattr(LOCAL, 'active', False)
+    if labelled:
+        # one profiler per thread, workers bound to the stream profile their own thread
+        import cProfile # pylint: disable=import-outside-toplevel
+        THREAD_STREAMS[thread_id] = stream_id
+        LOCAL.active = True
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # from python 3.12 one profiler may be active per process, the threads
+            # profiled while another is active are only sampled and timed
+            profile = None
+    try:
+        yield
+    finally:
+        if labelled:
+            LOCAL.active = False
+            THREAD_STREAMS[thread_id] = previous
+        if profile is not None:
+            profile.disable()
+            with LOCK:
+                PROFILES.setdefault(stream_id, []).append(profile)
+        STREAM.reset(token)
+
+def bind(function):
+    """ Returns the function attributing its work to the current stream when called on
+        another thread, e.g. by an executor """
+    stream_id = STREAM.get()
+    if not ENABLED or stream_id is None:
+        return function
+
+    @functools.wraps(function)
+    def bound(*args, **kwargs):
+        with stream(stream_id):
+            return function(*args, **kwargs)
+    return bound
+
+def sample_stacks(stop, interval):
+    """ Sample the stack of every other thread until stopped """
+    own = threading.get_ident()
+    names = {}
+    while not stop.wait(interval):
+        frames = sys._current_frames() # pylint: disable=protected-access
+        stacks = []
+        for thread_id, frame in frames.items():
+            if thread_id == own:
+                continue
+            label = THREAD_STREAMS.get(thread_id)
+            if label is None:
+                if thread_id not in names:
+                    names = {thread.ident: thread.name for thread in threading.enumerate()}
+                label = names.get(thread_id, 'thread')
+            stacks.append(collapse(label, frame))
+        with LOCK:
+            for stack in stacks:
+                SAMPLES[stack] = SAMPLES.get(stack, 0) + 1
+
+def collapse(label, frame):
+    """ Returns the stack of a frame in collapsed format, outermost frame first """
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    names.append(label)
+    return ';'.join(reversed(names)).replace(' ', '_')
+
+def stop_sampler():
+    """ Stop sampling stacks """
+    if SAMPLER['thread'] is not None:
+        SAMPLER['stop'].set()
+        SAMPLER['thread'].join()
+        SAMPLER['thread'] = None
+
+def dump():
+    """ Write the profiles to the 'profile_dir' and log the time of each phase """
+    if not ENABLED:
+        return
+    stop_sampler()
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    with LOCK:
+        times = dict(TIMES)
+        profiles = {stream_id: list(stream_profiles)
+                    for stream_id, stream_profiles in PROFILES.items()}
+        samples = dict(SAMPLES)
+    write_phases(times)
+    write_pstats(profiles)
+    write_samples(samples)
+    LOGGER.info("Profiles written to %s", PROFILE_DIR)
+
+def write_phases(times):
+    """ Log the time of each phase of each stream and write them to phases.json """
+    summary = {}
+    for (stream_id, name), (calls, wall, cpu) in sorted(times.items()):
+        summary.setdefault(stream_id, {})[name] = {
+            'calls': calls,
+            'wall_seconds': round(wall, 6),
+            'cpu_seconds': round(cpu, 6),
+        }
+        # the difference is time waiting, mostly on the network for fetch and auth
+        LOGGER.info("PROFILE %s %s: %d calls, %.3fs wall, %.3fs cpu, %.3fs waiting",
+                    stream_id, name, calls, wall, cpu, max(0.0, wall - cpu))
+    with open(os.path.join(PROFILE_DIR, 'phases.json'), 'w', encoding='utf8') as file:
+        json.dump(summary, file, indent=2)
+
+def write_pstats(profiles):
+    """ Write the cProfiles of each stream, merged, to <stream>.pstats """
+    import pstats # pylint: disable=import-outside-toplevel
+    for stream_id, stream_profiles in profiles.items():
+        stats = pstats.Stats(stream_profiles[0])
+        for profile in stream_profiles[1:]:
+            stats.add(profile)
+        stats.dump_stats(os.path.join(PROFILE_DIR, f"{stream_id}.pstats"))
+
+def write_samples(samples):
+    """ Write the sampled stacks to wallclock.collapsed """
+    with open(os.path.join(PROFILE_DIR, 'wallclock.collapsed'), 'w', encoding='utf8') as file:
+        for stack, count in sorted(samples.items()):
+            file.write(f"{stack} {count}\n")
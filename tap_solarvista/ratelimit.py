@@ -0,0 +1,141 @@
+""" ratelimit is responsible for pacing the requests to Solarvista API, adapting the rate
+to the throttling and latency observed """
+import email.utils
+import threading
+import time
+import singer
+from singer.metrics import Point
+from tap_solarvista import context
+
+LOGGER = singer.get_logger()
+DEFAULT_RATE_LIMIT = 20 # requests per second to start at, 0 disables rate limiting
+DEFAULT_RATE_LIMIT_MIN = 1
+DEFAULT_RATE_LIMIT_MAX = 200
+DEFAULT_TARGET_LATENCY = 10 # seconds, slower responses reduce the rate
+DECREASE_FACTOR = 0.5
+DECREASE_INTERVAL = 1 # seconds, throttled responses to requests already in flight
+                      # only reduce the rate once
+METRIC_INTERVAL = 60 # seconds between rate metrics while the rate increases
+MAX_RETRY_AFTER = 300 # seconds
+
+LIMITER = None
+
+
+class RateLimiter: # pylint: disable=too-many-instance-attributes
+    """ Token bucket shared by every request, its rate increases additively while
+        requests succeed and decreases multiplicatively when they are throttled """
+
+    def __init__(self, rate, min_rate, max_rate, target_latency):
+        """ Constructor with the initial, minimum and maximum requests per second """
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.rate = min(max(rate, min_rate), max_rate)
+        self.target_latency = target_latency
+        self.tokens = max(1.0, self.rate)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.decreased = 0.0
+        self.logged = self.updated
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        """ Take a token, returning the seconds to wait before the request is sent """
+        with self.lock:
+            now = time.monotonic()
+            # refill for the time passed, bursting at most one second of requests
+            self.tokens = min(max(1.0, self.rate),
+                              self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return max(0.0, -self.tokens / self.rate, self.blocked_until - now)
+
+    def completed(self, latency=None):
+        """ Increase the rate after a request completes within the target latency """
+        if latency is not None and latency > self.target_latency:
+            self.throttled()
+            return
+        with self.lock:
+            # about one request per second more for every second at the current rate
+            self.rate = min(self.max_rate, self.rate + 1 / self.rate)
+            if time.monotonic() - self.logged >= METRIC_INTERVAL:
+                self.log_rate()
+
+    def throttled(self, retry_after=None):
+        """ Decrease the rate after a throttled or failed request, pausing every
+            request for the 'Retry-After' seconds when supplied """
+        with self.lock:
+            now = time.monotonic()
+            if retry_after:
+                self.blocked_until = max(self.blocked_until, now + retry_after)
+            if now - self.decreased >= DECREASE_INTERVAL:
+                self.decreased = now
+                self.rate = max(self.min_rate, self.rate * DECREASE_FACTOR)
+                self.tokens = min(self.tokens, 0.0)
+                LOGGER.info("Request rate reduced to %.2f/s", self.rate)
+                self.log_rate()
+
+    def log_rate(self):
+        """ Log the current rate as a singer metric """
+        self.logged = time.monotonic()
+        singer.metrics.log(LOGGER, Point('gauge', 'http_request_rate', round(self.rate, 2), {}))
+
+
+def configure(config):
+    """ Create the rate limiter shared by every request from config, 'rate_limit' 0 disables it """
+    global LIMITER # pylint: disable=global-statement
+    LIMITER = create_limiter(config)
+
+def create_limiter(config):
+    """ Returns a rate limiter from config, None when 'rate_limit' is 0 """
+    rate = float(config.get('rate_limit', DEFAULT_RATE_LIMIT))
+    if rate <= 0:
+        return None
+    return RateLimiter(
+        rate,
+        float(config.get('rate_limit_min', DEFAULT_RATE_LIMIT_MIN)),
+        float(config.get('rate_limit_max', DEFAULT_RATE_LIMIT_MAX)),
+        float(config.get('rate_limit_target_latency', DEFAULT_TARGET_LATENCY)))
+
+def current_limiter():
+    """ Returns the rate limiter of the account being synced, each account of a multi-account
+        sync is paced on its own """
+    if context.is_multi_account():
+        return context.current().limiter
+    return LIMITER
+
+def reserve():
+    """ Returns the seconds to wait before sending a request """
+    limiter = current_limiter()
+    if limiter is not None:
+        return limiter.reserve()
+    return 0.0
+
+def wait():
+    """ Wait until a request may be sent """
+    delay = reserve()
+    if delay > 0:
+        time.sleep(delay)
+
+def completed(latency=None):
+    """ Report a request that completed with the latency in seconds """
+    limiter = current_limiter()
+    if limiter is not None:
+        limiter.completed(latency)
+
+def throttled(retry_after=None):
+    """ Report a throttled or failed request with the 'Retry-After' seconds """
+    limiter = current_limiter()
+    if limiter is not None:
+        limiter.throttled(retry_after)
+
+def parse_retry_after(value):
+    """ Returns the seconds of a 'Retry-After' header in seconds or http date form, else None """
+    if value is None:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return min(float(value), MAX_RETRY_AFTER)
+    retry_date = email.utils.parsedate_tz(value)
+    if retry_date is None:
+        return None
+    return min(max(0.0, email.utils.mktime_tz(retry_date) - time.time()), MAX_RETRY_AFTER)
@@ -5,20 +5,32 @@ import json
 import re
 from singer.schema import Schema
 
+SCHEMA_CACHE = {} # stream id -> parsed json schema, each file is read once per process
+
 def get_abs_path(path):
     """ Returns absolute path to give path """
     return os.path.join(os.path.dirname(os.path.realpath(__file__)), path)
 
 
-def load_schemas():
-    """ Load schemas from schemas folder """
-    schemas = {}
-    for filename in os.listdir(get_abs_path('schemas')):
-        path = get_abs_path('schemas') + '/' + filename
-        file_raw = filename.replace('.json', '')
+def list_stream_ids():
+    """ Returns the stream id of every schema in the schemas folder, without loading them """
+    return sorted(filename[:-len('.json')] for filename in os.listdir(get_abs_path('schemas'))
+                  if filename.endswith('.json'))
+
+def load_schema(stream_id):
+    """ Load the schema of a stream, its file is parsed on first use """
+    raw_schema = SCHEMA_CACHE.get(stream_id)
+    if raw_schema is None:
+        path = get_abs_path('schemas') + '/' + stream_id + '.json'
         with open(path, encoding='utf8') as file:
-            schemas[file_raw] = Schema.from_dict(json.load(file))
-    return schemas
+            raw_schema = SCHEMA_CACHE[stream_id] = json.load(file)
+    return Schema.from_dict(raw_schema)
+
+def load_schemas(stream_ids=None):
+    """ Load schemas from schemas folder, only those of the stream ids when supplied """
+    if stream_ids is None:
+        stream_ids = list_stream_ids()
+    return {stream_id: load_schema(stream_id) for stream_id in stream_ids}
 
 def extract_datasource(stream_id):
     """ Returns the datasource substring of the stream id """
@@ -0,0 +1,94 @@
+""" session is responsible for the pooled http connections to Solarvista API """
+import threading
+import requests
+from urllib3.util import Retry
+from tap_solarvista import ratelimit
+from tap_solarvista.timeout_http_adapter import TimeoutHttpAdapter, DEFAULT_TIMEOUT
+
+DEFAULT_POOL_CONNECTIONS = 10
+DEFAULT_POOL_MAXSIZE = 10
+
+SESSION = None
+SESSION_POOL_MAXSIZE = 0 # connections kept alive per pool by the process wide session
+SESSION_LOCK = threading.Lock()
+RETRIES = threading.local() # attempts retried by the request in flight on each thread
+
+class RateLimitedRetry(Retry):
+    """ Retry reporting every throttled or failed attempt to the rate limiter,
+        and pacing the retries with every other request """
+
+    #pylint: disable=too-many-arguments,too-many-positional-arguments
+    def increment(self, method=None, url=None, response=None, error=None, _pool=None,
+                  _stacktrace=None):
+        if error is not None or (response is not None
+                                 and response.status in (self.status_forcelist or [])):
+            retry_after = None
+            if response is not None:
+                retry_after = ratelimit.parse_retry_after(response.headers.get('Retry-After'))
+            ratelimit.throttled(retry_after)
+        RETRIES.count = retry_count() + 1
+        return super().increment(method, url, response, error, _pool, _stacktrace)
+
+    def sleep(self, response=None):
+        super().sleep(response)
+        ratelimit.wait()
+
+
+def reset_retries():
+    """ Reset the retries counted for the next request on this thread """
+    RETRIES.count = 0
+
+def retry_count():
+    """ Returns the attempts retried by the last request on this thread """
+    return getattr(RETRIES, 'count', 0)
+
+
+def create_session(config):
+    """ Create a session with a connection pooling, retrying and timeout http adapter """
+    retries = RateLimitedRetry(total=6, backoff_factor=1,
+                               status_forcelist=[429, 500, 502, 503, 504],
+                               allowed_methods=None, raise_on_status=False)
+    adapter = TimeoutHttpAdapter(
+        timeout=float(config.get('request_timeout', DEFAULT_TIMEOUT)),
+        pool_connections=int(config.get('pool_connections', DEFAULT_POOL_CONNECTIONS)),
+        pool_maxsize=pool_maxsize(config),
+        max_retries=retries)
+    http = requests.Session()
+    http.mount("https://", adapter)
+    http.mount("http://", adapter)
+    if str(config.get('keep_alive', True)).lower() == 'false':
+        http.headers['Connection'] = 'close'
+    return http
+
+def pool_maxsize(config):
+    """ Returns the connections kept alive per pool, at least one for each concurrent request """
+    return int(config.get('pool_maxsize', max(DEFAULT_POOL_MAXSIZE,
+                                              int(config.get('max_concurrency', 1)))))
+
+def get_session(config):
+    """ Return the process wide session, creating it on first use """
+    global SESSION, SESSION_POOL_MAXSIZE # pylint: disable=global-statement
+    if SESSION is None:
+        with SESSION_LOCK:
+            if SESSION is None:
+                SESSION = create_session(config)
+                SESSION_POOL_MAXSIZE = pool_maxsize(config)
+    return SESSION
+
+def resize_session(config):
+    """ Return the process wide session, recreated when config needs a larger pool,
+        only while no request is in flight """
+    global SESSION # pylint: disable=global-statement
+    with SESSION_LOCK:
+        if SESSION is not None and pool_maxsize(config) > SESSION_POOL_MAXSIZE:
+            SESSION.close()
+            SESSION = None
+    return get_session(config)
+
+def close_session():
+    """ Close the process wide session and release its pooled connections """
+    global SESSION # pylint: disable=global-statement
+    with SESSION_LOCK:
+        if SESSION is not None:
+            SESSION.close()
+            SESSION = None
@@ -0,0 +1,74 @@
+""" streaming is responsible for incrementally parsing large Solarvista response pages """
+from collections.abc import Mapping
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+
+class StreamedPage(Mapping):
+    """ A response page whose 'rows' are parsed from the body one item at a time.
+        'continuationToken' is only known once the rows have been consumed """
+
+    def __init__(self, response, items_key='rows', row_transform=None):
+        """ Constructor with the open streamed response and the key of the items array """
+        self.response = response
+        self.items_key = items_key
+        self.row_transform = row_transform
+        self.values = {'continuationToken': None}
+
+    def with_rows(self, row_transform):
+        """ Returns the page with each parsed item transformed to a row """
+        self.row_transform = row_transform
+        return self
+
+    def rows(self):
+        """ Generate the rows of the page, closing the response once the body is read """
+        items_prefix = self.items_key + '.item'
+        try:
+            builder = None
+            self.response.raw.decode_content = True
+            for prefix, event, value in ijson.parse(self.response.raw, use_float=True):
+                if builder is not None:
+                    builder.event(event, value)
+                    if prefix == items_prefix and event in ('end_map', 'end_array'):
+                        yield self.transform(builder.value)
+                        builder = None
+                elif prefix == items_prefix:
+                    if event in ('start_map', 'start_array'):
+                        builder = ijson.ObjectBuilder()
+                        builder.event(event, value)
+                    else:
+                        yield self.transform(value)
+                elif prefix == 'continuationToken':
+                    self.values['continuationToken'] = value
+        finally:
+            self.response.close()
+
+    def transform(self, item):
+        """ Transform a parsed item to a row """
+        if self.row_transform is not None:
+            return self.row_transform(item)
+        return item
+
+    def __getitem__(self, key):
+        if key == 'rows':
+            return self.rows()
+        return self.values[key]
+
+    def __iter__(self):
+        return iter(['rows', *self.values])
+
+    def __len__(self):
+        return len(self.values) + 1
+
+
+def materialize(response_data):
+    """ Read every row of a streamed page, returning a page that can be iterated again """
+    if isinstance(response_data, StreamedPage):
+        rows = list(response_data['rows'])
+        return {
+            'continuationToken': response_data['continuationToken'],
+            'rows': rows
+        }
+    return response_data
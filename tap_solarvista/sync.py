@@ -1,118 +1,529 @@
+# pylint: disable=too-many-lines
 """sync is responsible for http requests to target solarvista account"""
 #!/usr/bin/env python3
+import hashlib
 import json
-from datetime import datetime
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from datetime import datetime, timedelta
+import dateutil.parser
 from dateutil.relativedelta import relativedelta
 import requests
-from urllib3.util import Retry
 import singer
-from singer import utils
-from tap_solarvista.timeout_http_adapter import TimeoutHttpAdapter
+from singer import metadata, utils
+from tap_solarvista import auth
+from tap_solarvista import cache
+from tap_solarvista import catalog as tap_catalog
+from tap_solarvista import context
+from tap_solarvista import flatten
+from tap_solarvista import httpmetrics
+from tap_solarvista import profiling
+from tap_solarvista import ratelimit
+from tap_solarvista import session
+from tap_solarvista import streaming
+from tap_solarvista import writer
+from tap_solarvista.flatten import flatten_json
 
 LOGGER = singer.get_logger()
-CONFIG = {}
-STATE = {}
+# the config, state and run cache of the account being synced
+CONFIG = context.CONFIG
+STATE = context.STATE
+RUN_CACHE = context.RUN_CACHE
+DEFAULT_MAX_CONCURRENCY = 1
+DEFAULT_PARALLEL_STREAMS = 1
+DEFAULT_PARALLEL_ACCOUNTS = 4
+ACCOUNTS = 'accounts' # STATE key of the state of each account of a multi-account sync
+# files cached for an account, kept apart for each account of a multi-account sync
+ACCOUNT_CACHE_PATHS = ['token_cache_path', 'users_cache_path', 'workitem_index_path',
+                       'workitem_detail_cache_dir']
+WRITE_LOCK = threading.RLock()
+USERS_LOCK = threading.Lock()
+DEFAULT_USERS_CACHE_TTL = 3600 # seconds
+DATASOURCES_LOCK = threading.Lock()
+# datasource -> the other streams reading every row, its pages are shared when one is selected
+DATASOURCE_READERS = {'users': ['appointment_stream']}
+WORKITEM_INDEX_LOCK = threading.Lock()
+DEFAULT_DETAIL_CACHE_SIZE = 10000 # work item details kept in the 'workitem_detail_cache_dir'
+DEFAULT_CONTINUATION_TTL = 3600 # seconds a checkpointed continuation token is resumed within
+CONTINUATIONS = 'continuations' # STATE key of the continuation checkpointed for each stream
+CHILD_STREAMS = ['workitemhistory_stream', 'activity_stream']
+DEFAULT_API_URL = "https://api.solarvista.com"
+DEFAULT_AUTH_URL = "https://auth.solarvista.com"
+
+def api_uri(path):
+    """ Returns the uri of a path of Solarvista API, on the configured 'api_url' """
+    return CONFIG.get('api_url', DEFAULT_API_URL).rstrip('/') + path
+
+def auth_uri():
+    """ Returns the uri access tokens are requested from, on the configured 'auth_url' """
+    return CONFIG.get('auth_url', DEFAULT_AUTH_URL).rstrip('/') + "/connect/token"
 
 def get_start(entity):
     """ Get the start point for incremental sync """
-    if entity not in STATE:
-        STATE[entity] = CONFIG['start_date']
-    # 'force_start_date' config forces the sync to start from the supplied date
-    if CONFIG.get('force_start_date'):
-        STATE[entity] = CONFIG['force_start_date']
+    with WRITE_LOCK:
+        if entity not in STATE:
+            STATE[entity] = CONFIG['start_date']
+        # 'force_start_date' config forces the sync to start from the supplied date
+        if CONFIG.get('force_start_date'):
+            STATE[entity] = CONFIG['force_start_date']
 
-    return STATE[entity]
+        return STATE[entity]
+
+
+def create_executor():
+    """ Create the executor for concurrent child requests, or a null context
+        when 'max_concurrency' is not configured above 1 """
+    max_concurrency = int(CONFIG.get('max_concurrency', DEFAULT_MAX_CONCURRENCY))
+    if max_concurrency > 1:
+        return ThreadPoolExecutor(max_workers=max_concurrency,
+                                  thread_name_prefix='tap-solarvista')
+    return nullcontext()
 
 
-#pylint: disable=too-many-branches
 def sync_all_data(config, state, catalog):
-    """ Sync data from tap source """
+    """ Sync data from tap source, each account concurrently when 'account' is a list """
     CONFIG.update(config)
     LOGGER.info("CONFIG [%s]", CONFIG)
     LOGGER.info("state arg [%s]", state)
     STATE.update(state)
     LOGGER.info("STATE [%s]", STATE)
+    RUN_CACHE.clear()
+
+    writer.configure(CONFIG)
+    ratelimit.configure(CONFIG)
+    httpmetrics.reset()
+    profiling.configure(CONFIG)
+    try:
+        # Write all schema messages for selected streams in catalog
+        multi_account = has_account_list()
+        for stream in catalog.get_selected_streams(state):
+            excluded = excluded_properties(stream)
+            flatten.set_plan(stream.tap_stream_id, stream.schema, excluded)
+            schema = selected_schema(stream, excluded)
+            key_properties = stream.key_properties
+            if multi_account:
+                # records of every account share the stream, each is keyed by its account
+                schema.setdefault('properties', {})['account'] = {'type': ['string']}
+                key_properties = list(key_properties or []) + ['account']
+            writer.write_schema(
+                stream_name=stream.tap_stream_id,
+                schema=schema,
+                key_properties=key_properties,
+            )
+
+        if multi_account:
+            sync_accounts(catalog, state)
+        else:
+            sync_account(catalog, state)
+    finally:
+        writer.flush_state()
+        writer.flush()
+        httpmetrics.log_summary()
+        profiling.dump()
+
+
+def sync_account(catalog, state):
+    """ Sync the selected streams of the account being synced """
+    RUN_CACHE['shared_datasources'] = shared_datasources(catalog)
+    # Sync all selected streams in catalog, child streams will sync on each work item
+    selected_streams = [stream for stream in catalog.get_selected_streams(state)
+                        if stream.tap_stream_id not in CHILD_STREAMS]
+    # appointments sync last, reusing the users when the users stream is selected
+    selected_streams.sort(key=lambda stream: stream.tap_stream_id == 'appointment_stream')
+    parallel_streams = int(CONFIG.get('parallel_streams', DEFAULT_PARALLEL_STREAMS))
+    if CONFIG.get('sync_engine') == 'asyncio':
+        # imported here so aiohttp is only required when the asyncio engine is selected
+        from tap_solarvista import sync_async # pylint: disable=import-outside-toplevel
+        sync_async.sync_all_streams(catalog, selected_streams)
+    elif parallel_streams > 1:
+        sync_streams_parallel(catalog, selected_streams, parallel_streams)
+    else:
+        for stream in selected_streams:
+            sync_stream(catalog, stream)
+
 
-    # Write all schema messages for selected streams in catalog
-    for stream in catalog.get_selected_streams(state):
-        singer.write_schema(
-            stream_name=stream.tap_stream_id,
-            schema=stream.schema.to_dict(),
-            key_properties=stream.key_properties,
-        )
-
-    # Sync all selected streams in catalog
-    selected_streams = catalog.get_selected_streams(state)
-    for stream in selected_streams:
-        # workitemhistory will sync on each work item
-        if stream.tap_stream_id == 'workitemhistory_stream':
+def has_account_list():
+    """ Returns True when 'account' is a list of the accounts to sync """
+    return isinstance(CONFIG.get('account'), list)
+
+
+def sync_accounts(catalog, state):
+    """ Sync each account of the 'account' list concurrently, each with its own config,
+        token, rate limit and run cache, and its state under 'accounts' in the state """
+    with WRITE_LOCK:
+        account_states = STATE.setdefault(ACCOUNTS, {})
+    account_contexts = []
+    for entry in CONFIG['account']:
+        config = account_config(CONFIG, entry)
+        account_contexts.append(context.AccountContext(
+            config, account_states.setdefault(config['account'], {}), context.root_state(),
+            ratelimit.create_limiter(config)))
+    parallel_accounts = int(CONFIG.get('parallel_accounts', DEFAULT_PARALLEL_ACCOUNTS))
+    # the accounts share one connection pool, sized for the requests of every account in flight
+    # and resized before any account starts
+    max_concurrency = int(CONFIG.get('max_concurrency', DEFAULT_MAX_CONCURRENCY))
+    session.resize_session(dict(CONFIG, max_concurrency=max_concurrency * parallel_accounts))
+    with ThreadPoolExecutor(max_workers=parallel_accounts,
+                            thread_name_prefix='tap-solarvista-account') as executor:
+        futures = [executor.submit(context.run, account_context, sync_account_of,
+                                   catalog, state)
+                   for account_context in account_contexts]
+        for future in futures:
+            # re-raise the first account failure
+            future.result()
+
+
+def sync_account_of(catalog, state):
+    """ Sync the account of the current context, on its own thread """
+    LOGGER.info("Syncing account:%s", CONFIG['account'])
+    sync_account(catalog, state)
+
+
+def account_config(config, entry):
+    """ Returns the config of an entry of the 'account' list, the name of an account or an
+        object of the 'account' and the config it overrides, e.g. its 'clientId' and 'code' """
+    overrides = entry if isinstance(entry, dict) else {'account': entry}
+    if isinstance(overrides.get('account', []), (list, dict)):
+        raise ValueError("Each object of the 'account' list needs the name of its 'account', "
+                         f"found keys {sorted(overrides)}")
+    account = dict(config, **overrides)
+    for key in ACCOUNT_CACHE_PATHS:
+        if config.get(key) and key not in overrides:
+            directory, name = os.path.split(os.path.normpath(config[key]))
+            account[key] = os.path.join(directory, f"{account['account']}-{name}")
+    return account
+
+
+def excluded_properties(stream):
+    """ Returns the properties deselected by the field metadata of the catalog,
+        the key properties and replication key are always synced """
+    excluded = []
+    for breadcrumb, field_metadata in metadata.to_map(stream.metadata).items():
+        if len(breadcrumb) != 2 or breadcrumb[0] != 'properties':
             continue
-        if stream.tap_stream_id == 'activity_stream':
+        property_name = breadcrumb[1]
+        if (property_name in (stream.key_properties or [])
+                or property_name == stream.replication_key
+                or field_metadata.get('inclusion') == 'automatic'):
             continue
-        LOGGER.info("Syncing stream:%s", stream.tap_stream_id)
+        if (field_metadata.get('selected') is False
+                or field_metadata.get('inclusion') == 'unsupported'):
+            excluded.append(property_name)
+    if excluded:
+        LOGGER.info("Stream %s excludes properties %s", stream.tap_stream_id, excluded)
+    return excluded
+
+def selected_schema(stream, excluded):
+    """ Returns the schema of a stream without the excluded properties """
+    schema = stream.schema.to_dict()
+    if excluded and 'properties' in schema:
+        schema['properties'] = {name: value for name, value in schema['properties'].items()
+                                if name not in excluded}
+    return schema
+
+
+def sync_streams_parallel(catalog, selected_streams, parallel_streams):
+    """ Sync the selected streams concurrently, each stream pages on its own thread """
+    with ThreadPoolExecutor(max_workers=parallel_streams,
+                            thread_name_prefix='tap-solarvista-stream') as executor:
+        futures = [executor.submit(context.bind(sync_stream), catalog, stream)
+                   for stream in selected_streams]
+        for future in futures:
+            # re-raise the first stream failure
+            future.result()
+
+
+def sync_stream(catalog, stream):
+    """ Sync every page of a stream """
+    LOGGER.info("Syncing stream:%s", stream.tap_stream_id)
+    with profiling.stream(stream.tap_stream_id):
+        with create_executor() as executor, \
+                singer.metrics.record_counter(stream.tap_stream_id) as counter:
+            for predefined_filter in stream_filters(stream):
+                if not sync_pages(catalog, stream, counter, executor, predefined_filter):
+                    # keep the checkpoint for the next run
+                    return
+        complete_stream(stream)
+
+
+#pylint: disable=too-many-arguments,too-many-positional-arguments
+def sync_pages(catalog, stream, counter, executor, predefined_filter):
+    """ Sync every page of a stream, or of a predefined work-item filter,
+        returning False when a page could not be fetched """
+    state_entity = filter_state_entity(stream, predefined_filter)
+    continuation = resume_continuation(stream)
+    resumed = continuation is not None
+    while True:
+        if is_workitem_search(stream):
+            response_data = sync_workitems_by_filter(stream, stream.replication_key,
+                                                     continuation, predefined_filter)
+        elif stream.tap_stream_id == 'appointment_stream':
+            if is_appointment_windowed():
+                sync_appointment_windows(stream, counter, executor)
+                return True
+            response_data = sync_appointment(stream, continuation)
+        else:
+            response_data = sync_datasource(stream, continuation)
+            if is_continuation_rejected(stream, response_data, resumed):
+                continuation, resumed = None, False
+                continue
+            resumed = False
+        if is_stream_incomplete(stream, response_data, continuation):
+            return False
         continuation = None
-        with singer.metrics.record_counter(stream.tap_stream_id) as counter:
-            while True:
-                if (stream.tap_stream_id == 'workitem_stream'
-                        and CONFIG.get('workitem_detail_enabled') is None):
-                    response_data = sync_workitems_by_filter(stream,
-                                            stream.replication_key, continuation)
-                elif stream.tap_stream_id == 'appointment_stream':
-                    response_data = sync_appointment(stream, continuation)
-                else:
-                    response_data = sync_datasource(stream, continuation)
-                continuation = None
-                if response_data is not None:
-                    continuation = process_response_data(catalog, stream, counter, response_data)
-                if continuation is None:
-                    break
-
-
-def process_response_data(catalog, stream, counter, response_data):
-    """ Process and write the response data with 'rowData' and 'continuationToken' """
-    tap_data = []
-    continuation = None
-    if response_data is not None:
-        if ('continuationToken' in response_data
-                and response_data['continuationToken'] is not None
-                and len(response_data['continuationToken']) > 0):
-            continuation = response_data['continuationToken']
-        for row in response_data['rows']:
-            if stream.tap_stream_id == 'workitem_stream':
-                item = row['rowData']
-                merged = {}
-                merged.update(item)
-                if CONFIG.get('workitem_detail_enabled') is not None:
-                    merged.update(fetch_workitemdetail(item['workItemId']))
-                last_modified = None
-                if 'lastModified' in item:
-                    last_modified = item['lastModified']
-                sync_workitemhistory(catalog, item['workItemId'], last_modified)
-                sync_activity(catalog, item['workItemId'])
-                tap_data.append(
-                    flatten_json(merged)
-                )
-            else:
-                item = row['rowData']
-                merged = {}
-                merged.update(item)
-                if 'lastModified' in row:
-                    merged.update({ 'lastModified': row['lastModified'] })
-                tap_data.append(
-                    flatten_json(merged)
-                )
-            counter.increment()
-
-    write_data(stream, tap_data)
+        if response_data is not None:
+            continuation = process_response_data(catalog, stream, counter,
+                                                 response_data, executor, state_entity)
+        if continuation is None:
+            return True
+
+
+def is_workitem_search(stream):
+    """ Returns True when the stream is synced with the work-item search """
+    return (stream.tap_stream_id == 'workitem_stream'
+            and CONFIG.get('workitem_detail_enabled') is None)
+
+
+def stream_filters(stream):
+    """ Returns the names of the 'workitem_filters' to search work-items with one at a time,
+        or a single None to sync the stream unfiltered """
+    if is_workitem_search(stream) and CONFIG.get('workitem_filters'):
+        return list(CONFIG['workitem_filters'])
+    return [None]
+
+
+def filter_state_entity(stream, predefined_filter):
+    """ Returns the STATE key of the bookmark of the stream, one for each predefined filter """
+    if predefined_filter:
+        return stream.tap_stream_id + "_" + predefined_filter
+    return stream.tap_stream_id
+
+
+def complete_stream(stream):
+    """ Called once every page of a stream has been written """
+    with WRITE_LOCK:
+        discarded = discard_continuation(stream)
+        if is_datasource_incremental(stream):
+            max_bookmark = RUN_CACHE.get('bookmarks', {}).pop(stream.tap_stream_id, None)
+            utils.update_state(STATE, stream.tap_stream_id, max_bookmark)
+        if discarded or is_datasource_incremental(stream):
+            writer.write_state(context.root_state())
+        # a state throttled by 'state_interval' or 'state_records' is written at stream end
+        writer.flush_state()
+    if stream.tap_stream_id == 'users_stream':
+        user_ids = RUN_CACHE.pop('users_stream_ids', [])
+        if stream.tap_stream_id in RUN_CACHE.get('resumed', ()):
+            # resumed part way through, the ids of the pages before the checkpoint are missing
+            LOGGER.info("Users resumed from a checkpoint, their ids are not reused")
+        else:
+            # appointments reuse the users synced this run
+            with USERS_LOCK:
+                store_user_ids(user_ids)
+    if stream.tap_stream_id == 'workitem_stream':
+        store_workitem_index()
+        if CONFIG.get('workitem_detail_cache_dir'):
+            cache.prune(CONFIG['workitem_detail_cache_dir'],
+                        CONFIG.get('workitem_detail_cache_size', DEFAULT_DETAIL_CACHE_SIZE))
+
+
+#pylint: disable=too-many-arguments,too-many-positional-arguments
+def process_response_data(catalog, stream, counter, response_data, executor=None,
+                          state_entity=None):
+    """ Process and write the response data with 'rowData' and 'continuationToken',
+        fanning out the work item child requests to the executor when supplied """
+    children = None
+    if response_data is not None and stream.tap_stream_id == 'workitem_stream':
+        # every work item of the page is needed to fan out the child requests
+        response_data = streaming.materialize(response_data)
+        items = [workitem_of(row) for row in response_data['rows']]
+        if executor is not None:
+            children = list(executor.map(context.bind(profiling.bind(
+                lambda item: fetch_workitem_children(catalog, item))), items))
+        else:
+            children = [fetch_workitem_children(catalog, item) for item in items]
+    return write_response_data(catalog, stream, counter, response_data, children,
+                               state_entity)
+
+
+#pylint: disable=too-many-arguments,too-many-positional-arguments
+def write_response_data(catalog, stream, counter, response_data, children=None,
+                        state_entity=None):
+    """ Write the response data and the already fetched work item children,
+        bookmarking the state_entity when supplied, returning the 'continuationToken' """
+    if response_data is None:
+        write_data(stream, [], state_entity=state_entity)
+        return None
+    if stream.tap_stream_id == 'workitem_stream':
+        write_workitem_children(catalog, children)
+        tap_data = iter_workitem_tap_data(stream, counter, response_data, children)
+    else:
+        tap_data = iter_tap_data(stream, counter, response_data)
+    # rows are flattened and written one at a time, a streamed page is read as it is written
+    if is_datasource_incremental(stream):
+        # datasource rows are not ordered by lastModified, so the bookmark is only
+        # moved once every page of the stream has been written
+        max_bookmark = write_data(stream, tap_data, write_state=False, is_sorted=False)
+        write_state = False
+        with WRITE_LOCK:
+            bookmarks = RUN_CACHE.setdefault('bookmarks', {})
+            if max_bookmark is not None and (
+                    bookmarks.get(stream.tap_stream_id) is None
+                    or parse_bookmark(max_bookmark) > parse_bookmark(
+                        bookmarks[stream.tap_stream_id])):
+                bookmarks[stream.tap_stream_id] = max_bookmark
+    else:
+        write_data(stream, tap_data, write_state=False, state_entity=state_entity)
+        write_state = True
+    continuation = response_continuation(response_data)
+    with WRITE_LOCK:
+        if continuation is not None and is_checkpointed(stream):
+            # every row of the page is written, an interrupted run resumes from the next page
+            checkpoint_continuation(stream, continuation)
+            write_state = True
+        if write_state:
+            writer.write_state(context.root_state())
     return continuation
 
 
+def iter_workitem_tap_data(stream, counter, response_data, children):
+    """ Generate the flattened work items merged with their detail """
+    plan = flatten.get_plan(stream.tap_stream_id, stream.schema)
+    for row, (detail, _, _) in zip(response_data['rows'], children):
+        merged = {}
+        merged.update(row['rowData'])
+        if detail is not None:
+            merged.update(detail)
+        counter.increment()
+        yield flatten_json(merged, plan)
+
+
+def iter_tap_data(stream, counter, response_data):
+    """ Generate the flattened rows of a page """
+    plan = flatten.get_plan(stream.tap_stream_id, stream.schema)
+    user_ids = None
+    if stream.tap_stream_id == 'users_stream':
+        user_ids = RUN_CACHE.setdefault('users_stream_ids', [])
+    bookmark = None
+    if is_datasource_incremental(stream):
+        bookmark = datasource_bookmark(stream)
+        if bookmark is not None:
+            bookmark = parse_bookmark(bookmark)
+    for row in response_data['rows']:
+        item = row['rowData']
+        if user_ids is not None:
+            user_ids.append(item['userId'])
+        if (bookmark is not None and row.get('lastModified')
+                and parse_bookmark(row['lastModified']) <= bookmark):
+            # unchanged since the last sync, skipped when the server did not filter it out
+            continue
+        merged = {}
+        merged.update(item)
+        if 'lastModified' in row:
+            merged.update({ 'lastModified': row['lastModified'] })
+        counter.increment()
+        yield flatten_json(merged, plan)
+
+
+def is_checkpointed(stream):
+    """ Returns True when the continuation of each page of the stream is checkpointed,
+        only datasource queries as work-item searches resume from their bookmark and
+        appointment searches change with the time they are made """
+    return (float(CONFIG.get('continuation_ttl', DEFAULT_CONTINUATION_TTL)) > 0
+            and stream.tap_stream_id != 'appointment_stream'
+            and not (stream.tap_stream_id == 'workitem_stream'
+                     and CONFIG.get('workitem_detail_enabled') is None))
+
+def checkpoint_continuation(stream, continuation):
+    """ Keep the continuation of the next page in STATE, with the page index
+        and the lastModified bookmark still pending for the stream """
+    with WRITE_LOCK:
+        # copied, the checkpoints may be shared with the state the tap was started with
+        checkpoints = dict(STATE.get(CONTINUATIONS, {}))
+        previous = checkpoints.get(stream.tap_stream_id) or {}
+        checkpoint = {
+            'continuationToken': continuation,
+            'page': previous.get('page', 0) + 1,
+            'checkpointedAt': utils.strftime(utils.now())
+        }
+        pending_bookmark = RUN_CACHE.get('bookmarks', {}).get(stream.tap_stream_id)
+        if pending_bookmark is not None:
+            checkpoint['bookmark'] = pending_bookmark
+        checkpoints[stream.tap_stream_id] = checkpoint
+        STATE[CONTINUATIONS] = checkpoints
+
+def resume_continuation(stream):
+    """ Returns the continuation checkpointed by an interrupted run, None when there
+        is none or it is older than 'continuation_ttl' seconds """
+    with WRITE_LOCK:
+        checkpoint = STATE.get(CONTINUATIONS, {}).get(stream.tap_stream_id)
+        if checkpoint is None or not is_checkpointed(stream):
+            return None
+        age = utils.now() - utils.strptime_to_utc(checkpoint['checkpointedAt'])
+        if age.total_seconds() > float(CONFIG.get('continuation_ttl',
+                                                  DEFAULT_CONTINUATION_TTL)):
+            LOGGER.info("Continuation of %s has expired, restarting", stream.tap_stream_id)
+            discard_continuation(stream)
+            return None
+        LOGGER.info("Resuming %s after page %s", stream.tap_stream_id, checkpoint['page'])
+        if checkpoint.get('bookmark') is not None:
+            RUN_CACHE.setdefault('bookmarks', {})[stream.tap_stream_id] = checkpoint['bookmark']
+        # the stream is not read from its first page
+        RUN_CACHE.setdefault('resumed', set()).add(stream.tap_stream_id)
+        return checkpoint['continuationToken']
+
+def discard_continuation(stream):
+    """ Remove the continuation checkpointed for the stream, True when there was one """
+    with WRITE_LOCK:
+        checkpoints = dict(STATE.get(CONTINUATIONS, {}))
+        discarded = checkpoints.pop(stream.tap_stream_id, None) is not None
+        if checkpoints:
+            STATE[CONTINUATIONS] = checkpoints
+        else:
+            STATE.pop(CONTINUATIONS, None)
+        return discarded
+
+def is_continuation_rejected(stream, response_data, resumed):
+    """ Returns True when the continuation resumed from a checkpoint is rejected,
+        discarding it so the stream restarts from the first page """
+    if response_data is None and resumed:
+        LOGGER.warning("Continuation of %s is no longer valid, restarting",
+                       stream.tap_stream_id)
+        discard_continuation(stream)
+        RUN_CACHE.get('resumed', set()).discard(stream.tap_stream_id)
+        return True
+    return False
+
+def is_stream_incomplete(stream, response_data, continuation):
+    """ Returns True when the next page of the stream could not be fetched """
+    if response_data is None and continuation is not None:
+        LOGGER.error("Unable to fetch the next page of %s", stream.tap_stream_id)
+        return True
+    return False
+
+def response_continuation(response_data):
+    """ Returns the 'continuationToken' of the response, None on the last page """
+    if ('continuationToken' in response_data
+            and response_data['continuationToken'] is not None
+            and len(response_data['continuationToken']) > 0):
+        return response_data['continuationToken']
+    return None
+
+
 def sync_workitems_by_filter(stream, bookmark_property, continue_from, predefined_filter=None):
     """ Sync work-item data from tap source with continuation """
-    state_entity = stream.tap_stream_id
-    if predefined_filter:
-        state_entity = state_entity + "_" + predefined_filter
-    start = get_start(state_entity)
+    uri, body = workitems_search_request(stream, bookmark_property, continue_from,
+                                         predefined_filter)
+    response_data = fetch("POST", uri, body, 'items')
+    return transform_search_to_look_like_rowdata(response_data)
+
+
+def workitems_search_request(stream, bookmark_property, continue_from, predefined_filter=None):
+    """ Returns the uri and body to search a page of work-items, filtered by the filter
+        groups of the predefined filter named in 'workitem_filters' when supplied """
+    start = get_start(filter_state_entity(stream, predefined_filter))
     query = {
       'lastModifiedAfter': start,
       'orderBy': bookmark_property,
@@ -120,39 +531,48 @@ def sync_workitems_by_filter(stream, bookmark_property, continue_from, predefine
     }
     if continue_from is not None:
         query['continuationToken'] = continue_from
-    ## add tests and full support for predefined_filter, e.g. isCompleted
-    #{
-    #    'comparison': "equals",
-    #    'fieldName': "isCompleted",
-    #    'value': True
-    #}
     if predefined_filter:
         LOGGER.info("Syncing work-items with filter %s", predefined_filter)
-        query['filterGroups'] = [{ 'filters': predefined_filter }]
+        query['filterGroups'] = filter_groups(CONFIG['workitem_filters'][predefined_filter])
     LOGGER.info("Syncing work-items since %s", start)
-    uri = f"https://api.solarvista.com/workflow/v4/{CONFIG.get('account')}/workItems/search"
-    body = json.dumps(query)
-    response_data = fetch("POST", uri, body)
-    return transform_search_to_look_like_rowdata(response_data)
+    uri = api_uri(f"/workflow/v4/{CONFIG.get('account')}/workItems/search")
+    return uri, json.dumps(query)
+
+
+def filter_groups(predefined_filter):
+    """ Returns the search filter groups of a predefined filter, either a list of filters
+        that must all match, e.g.
+        [{'comparison': "equals", 'fieldName': "isCompleted", 'value': True}],
+        or a dict with the 'filterGroups' to search with """
+    if isinstance(predefined_filter, dict):
+        return predefined_filter['filterGroups']
+    return [{ 'filters': predefined_filter }]
 
 
 def transform_search_to_look_like_rowdata(response_data):
     """ transform the search results, so we can reuse the sync loop """
     if response_data is None:
         return None
+    if isinstance(response_data, streaming.StreamedPage):
+        return response_data.with_rows(search_item_to_rowdata)
     new_data = {}
     if response_data.get('continuationToken'):
         new_data['continuationToken'] = response_data['continuationToken']
     rows = []
     if response_data['items']:
         for item in response_data['items']:
-            if item.get("fieldValues"):
-                item["properties"] = item.pop("fieldValues")
-            rows.append({ "rowData": item})
+            rows.append(search_item_to_rowdata(item))
     new_data['rows'] = rows
     return new_data
 
 
+def search_item_to_rowdata(item):
+    """ transform a search result item to row data """
+    if item.get("fieldValues"):
+        item["properties"] = item.pop("fieldValues")
+    return { "rowData": item}
+
+
 def transform_activity_to_look_like_rowdata(response_data):
     """ transform the activity results, so we can reuse the sync loop """
     if response_data is None:
@@ -171,6 +591,8 @@ def transform_appointments_to_look_like_rowdata(response_data):
     """ transform the appointments results, so we can reuse the sync loop """
     if response_data is None:
         return None
+    if isinstance(response_data, streaming.StreamedPage):
+        return response_data.with_rows(lambda item: { "rowData": item})
     new_data = {}
     if response_data.get('continuationToken'):
         new_data['continuationToken'] = response_data['continuationToken']
@@ -185,115 +607,453 @@ def sync_datasource(stream, continue_from):
     """ Sync data from tap source with continuation """
     LOGGER.debug("sync_datasource %s", stream.stream_alias)
     if stream.stream_alias is not None:
-        body = json.dumps({})
-        uri = (f"https://api.solarvista.com/datagateway/v3/{CONFIG.get('account')}"
-        f"/datasources/ref/{stream.stream_alias}/data/query")
-        if continue_from is not None:
-            body = json.dumps({
-                "continuationToken": continue_from
-            })
-        return fetch("POST", uri, body)
+        modified_after = datasource_modified_after(stream)
+        if modified_after is None and is_datasource_shared(stream.stream_alias):
+            # another stream reads every row, both are served the pages fetched once
+            return datasource_pages(stream.stream_alias).get(continue_from)
+        uri, body = datasource_request(stream.stream_alias, continue_from, modified_after)
+        return fetch("POST", uri, body, 'rows')
     return None
 
+def shared_datasources(catalog):
+    """ Returns the datasources read by another selected stream """
+    return {datasource for datasource, readers in DATASOURCE_READERS.items()
+            if any(is_stream_selected(catalog, reader) for reader in readers)}
+
+def is_datasource_shared(datasource):
+    """ Returns True when the pages of the datasource are kept for its other readers """
+    return datasource in RUN_CACHE.get('shared_datasources', ())
+
+def datasource_pages(datasource):
+    """ Returns the pages of a datasource by the continuation requesting them,
+        paged at most once per run however many streams read it """
+    with DATASOURCES_LOCK:
+        lock = RUN_CACHE.setdefault('datasource_locks', {}).setdefault(datasource,
+                                                                       threading.Lock())
+    # a concurrent reader waits for the pages rather than requesting them again
+    with lock:
+        pages = cached_datasource_pages(datasource)
+        if pages is None:
+            pages, complete = fetch_datasource_pages(datasource)
+            store_datasource_pages(datasource, pages, complete)
+        return pages
+
+def fetch_datasource_pages(datasource):
+    """ Fetch every page of a datasource, up to a page that could not be fetched,
+        returning the pages and True when the last page was reached """
+    pages = {}
+    continuation = None
+    while True:
+        uri, body = datasource_request(datasource, continuation)
+        response_data = fetch("POST", uri, body)
+        if response_data is None:
+            LOGGER.error("Unable to fetch every page of datasource %s", datasource)
+            return pages, False
+        pages[continuation] = response_data
+        continuation = response_continuation(response_data)
+        if continuation is None:
+            return pages, True
+
+def cached_datasource_pages(datasource):
+    """ Returns the pages of the datasource already fetched this run """
+    with DATASOURCES_LOCK:
+        return RUN_CACHE.get('datasources', {}).get(datasource)
+
+def store_datasource_pages(datasource, pages, complete=True):
+    """ Keep the pages of the datasource for the rest of the run,
+        noting when paging stopped before the last page """
+    with DATASOURCES_LOCK:
+        RUN_CACHE.setdefault('datasources', {})[datasource] = pages
+        if not complete:
+            RUN_CACHE.setdefault('incomplete_datasources', set()).add(datasource)
+
+def is_datasource_complete(datasource):
+    """ Returns True unless paging the datasource stopped before the last page """
+    with DATASOURCES_LOCK:
+        return datasource not in RUN_CACHE.get('incomplete_datasources', ())
+
+def datasource_rows(pages):
+    """ Generate the rows of the datasource pages in order """
+    page = pages.get(None)
+    while page is not None:
+        yield from page['rows']
+        continuation = response_continuation(page)
+        page = pages.get(continuation) if continuation is not None else None
+
+def datasource_request(datasource, continue_from, modified_after=None):
+    """ Returns the uri and body to query a page of a datasource,
+        filtered to the rows modified after modified_after when supplied """
+    query = {}
+    uri = api_uri(f"/datagateway/v3/{CONFIG.get('account')}"
+                  f"/datasources/ref/{datasource}/data/query")
+    if modified_after is not None:
+        query['filterGroups'] = [{
+            'filters': [{
+                'comparison': "greaterThan",
+                'fieldName': "lastModified",
+                'value': modified_after
+            }]
+        }]
+    if continue_from is not None:
+        query['continuationToken'] = continue_from
+    return uri, json.dumps(query)
+
+def is_datasource_incremental(stream):
+    """ Returns True when a datasource stream is replicated incrementally on lastModified """
+    return (stream.tap_stream_id not in tap_catalog.NON_DATASOURCE_STREAMS
+            and stream.replication_method == 'INCREMENTAL'
+            and stream.replication_key == 'lastModified')
+
+def datasource_bookmark(stream):
+    """ Returns the lastModified bookmark of a datasource stream, None before its first sync
+        so every row is synced, 'start_date' only applies to work-items """
+    if CONFIG.get('force_start_date'):
+        return CONFIG['force_start_date']
+    return STATE.get(stream.tap_stream_id)
+
+def datasource_modified_after(stream):
+    """ Returns the bookmark to filter the datasource query by when
+        'datasource_filter_enabled' is configured, otherwise rows are skipped as they are read """
+    if (str(CONFIG.get('datasource_filter_enabled', False)).lower() == 'true'
+            and is_datasource_incremental(stream)
+            # appointments need the id of every user, not only those modified
+            and stream.tap_stream_id != 'users_stream'):
+        return datasource_bookmark(stream)
+    return None
+
+def parse_bookmark(value):
+    """ Parse a bookmark to a comparable utc datetime """
+    return utils.strptime_to_utc(value)
+
 def sync_appointment(stream, continue_from):
     """ Sync appointments from tap source with continuation """
-    # first get all the users, aiming to make a single request for appointments
-    # although there will be multiple request to users if appointments has a continue token
-    users = []
-    user_continue_from = None
+    # the users are fetched once per run, aiming to make a single request for appointments
+    users = get_user_ids()
+
+    if users and stream.stream_alias is not None:
+        uri, body = appointments_request(users, continue_from)
+        response_data = fetch("POST", uri, body, 'appointments')
+        return transform_appointments_to_look_like_rowdata(response_data)
+    return None
+
+def get_user_ids():
+    """ Returns the ids of all users, fetched at most once per run """
+    with USERS_LOCK:
+        users = cached_user_ids()
+    if users is None:
+        # not held while paging, the users of each account are paged concurrently
+        users = fetch_user_ids()
+        if is_datasource_complete('users'):
+            with USERS_LOCK:
+                store_user_ids(users)
+    return users
+
+def fetch_user_ids():
+    """ Returns the ids of all users, from the users datasource shared with the users stream """
+    return [row['rowData']['userId'] for row in datasource_rows(datasource_pages('users'))]
+
+def cached_user_ids():
+    """ Returns the user ids already fetched this run, or cached on disk
+        within 'users_cache_ttl' seconds when a 'users_cache_path' is configured """
+    if RUN_CACHE.get('userIds') is None and CONFIG.get('users_cache_path'):
+        cached = cache.read_json(CONFIG['users_cache_path'],
+                                 CONFIG.get('users_cache_ttl', DEFAULT_USERS_CACHE_TTL))
+        if cached and cached.get('account') == CONFIG.get('account'):
+            LOGGER.info("Using cached users %s", CONFIG['users_cache_path'])
+            RUN_CACHE['userIds'] = cached['userIds']
+    return RUN_CACHE.get('userIds')
+
+def store_user_ids(users):
+    """ Keep the user ids for the rest of the run, and on disk when configured,
+        none are kept so they are fetched again when no user was found """
+    if not users:
+        return
+    RUN_CACHE['userIds'] = users
+    if CONFIG.get('users_cache_path'):
+        cache.write_json(CONFIG['users_cache_path'], {
+            'account': CONFIG.get('account'),
+            'userIds': users
+        })
+
+def appointments_request(users, continue_from, window_from=None, window_to=None):
+    """ Returns the uri and body to search a page of appointments for the users,
+        from one year past to one year future unless a window is supplied """
+    uri = api_uri(f"/calendar/v2/{CONFIG.get('account')}/appointments/search/users")
+    if window_from is None:
+        window_from = datetime.now() - relativedelta(years=1)
+    if window_to is None:
+        window_to = datetime.now() + relativedelta(years=1)
+    query = {
+        "from": window_from.isoformat(),
+        "includeUnassigned": True,
+        "to": window_to.isoformat(),
+        "userIds": users
+    }
+    if continue_from is not None:
+        query['continuationToken'] = continue_from
+    return uri, json.dumps(query)
+
+def is_appointment_windowed():
+    """ Returns True when 'appointment_window_days' splits the appointment search """
+    return bool(CONFIG.get('appointment_window_days'))
+
+def appointment_windows(stream):
+    """ Returns the (from, to) time slices of 'appointment_window_days' to search, starting
+        at the window bookmark, else one year past, and ending one year future """
+    now = datetime.now()
+    window_from = now - relativedelta(years=1)
+    bookmark = STATE.get(stream.tap_stream_id)
+    if bookmark:
+        bookmark = dateutil.parser.isoparse(bookmark)
+        if bookmark.tzinfo is not None:
+            bookmark = bookmark.astimezone().replace(tzinfo=None)
+        window_from = max(window_from, bookmark)
+    window_to = now + relativedelta(years=1)
+    window_size = timedelta(days=float(CONFIG['appointment_window_days']))
+    windows = []
+    while window_from < window_to:
+        windows.append((window_from, min(window_from + window_size, window_to)))
+        window_from += window_size
+    return windows
+
+def user_chunks(users):
+    """ Split the user ids into chunks of 'appointment_user_chunk_size' """
+    chunk_size = int(CONFIG.get('appointment_user_chunk_size') or len(users) or 1)
+    return [users[i:i + chunk_size] for i in range(0, len(users), chunk_size)]
+
+def sync_appointment_windows(stream, counter, executor=None):
+    """ Sync appointments one time slice at a time, searching the user chunks of each
+        slice concurrently when an executor is supplied """
+    users = get_user_ids()
+    if not users:
+        return
+    seen = set()
+    for window_from, window_to in appointment_windows(stream):
+        LOGGER.info("Syncing appointments from %s to %s", window_from, window_to)
+        chunks = user_chunks(users)
+        if executor is not None:
+            results = list(executor.map(context.bind(profiling.bind(
+                lambda chunk, f=window_from, t=window_to: fetch_appointments(chunk, f, t))),
+                chunks))
+        else:
+            results = [fetch_appointments(chunk, window_from, window_to) for chunk in chunks]
+        write_appointment_window(stream, counter, window_to, results, seen)
+
+def fetch_appointments(users, window_from, window_to):
+    """ Fetch every page of appointments for the users within the window """
+    appointments = []
+    continuation = None
     while True:
-        body = json.dumps({})
-        uri = (f"https://api.solarvista.com/datagateway/v3/{CONFIG.get('account')}"
-        f"/datasources/ref/{'users'}/data/query")
-        if user_continue_from is not None:
-            body = json.dumps({
-                "continuationToken": user_continue_from
-            })
+        uri, body = appointments_request(users, continuation, window_from, window_to)
         response_data = fetch("POST", uri, body)
-        user_continue_from = None
+        continuation = None
         if response_data is not None:
-            if ('continuationToken' in response_data
-                    and response_data['continuationToken'] is not None
-                    and len(response_data['continuationToken']) > 0):
-                user_continue_from = response_data['continuationToken']
-            for row in response_data['rows']:
-                item = row['rowData']
-                users.append(item['userId'])
-        if user_continue_from is None:
+            continuation = response_continuation(response_data)
+            appointments.extend(response_data.get('appointments') or [])
+        if continuation is None:
             break
+    return appointments
 
-    if users and stream.stream_alias is not None:
-        body = json.dumps({})
-        uri = (f"https://api.solarvista.com/calendar/v2/{CONFIG.get('account')}"
-        f"/appointments/search/{'users'}")
-        one_year_past = datetime.now() - relativedelta(years=1)
-        one_year_future = datetime.now() + relativedelta(years=1)
-        query = {
-            "from": one_year_past.isoformat(),
-            "includeUnassigned": True,
-            "to": one_year_future.isoformat(),
-            "userIds": users
-        }
-        if continue_from is not None:
-            query['continuationToken'] = continue_from
-        body = json.dumps(query)
-        response_data = fetch("POST", uri, body)
-        return transform_appointments_to_look_like_rowdata(response_data)
+def write_appointment_window(stream, counter, window_to, results, seen):
+    """ Merge the appointments of each user chunk, write those not yet seen this run
+        and bookmark the end of the window, never beyond now """
+    rows = []
+    for appointments in results:
+        for appointment in appointments:
+            # unassigned appointments are in every chunk, and long ones in several windows
+            appointment_id = appointment.get('appointmentId')
+            if appointment_id is None or appointment_id not in seen:
+                seen.add(appointment_id)
+                rows.append({ "rowData": appointment})
+    write_data(stream, iter_tap_data(stream, counter, {'rows': rows}), False)
+    with WRITE_LOCK:
+        STATE[stream.tap_stream_id] = min(window_to, datetime.now()).isoformat()
+        writer.write_state(context.root_state())
+
+def is_stream_selected(catalog, stream_id):
+    """ Returns True when the stream is in the catalog and selected """
+    stream = catalog.get_stream(stream_id)
+    return stream is not None and stream.is_selected()
+
+def get_workitem_index():
+    """ Returns the lastModified each work item's children were last synced at by child
+        stream, loaded from the 'workitem_index_path' file on first use in a run """
+    if 'workitem_index' not in RUN_CACHE:
+        index = {}
+        cached = cache.read_json(CONFIG['workitem_index_path'])
+        if cached and cached.get('account') == CONFIG.get('account'):
+            index = cached['streams']
+        RUN_CACHE['workitem_index'] = index
+    return RUN_CACHE['workitem_index']
+
+def should_fetch_child(catalog, stream_id, workitem_id, last_modified):
+    """ Returns True when the child stream is selected and the work item has changed
+        since its children were synced """
+    return (workitem_id is not None and is_stream_selected(catalog, stream_id)
+            and not is_child_unchanged(stream_id, workitem_id, last_modified))
+
+def is_child_unchanged(stream_id, workitem_id, last_modified):
+    """ Returns True when the children of the work item were synced at the same
+        lastModified, only when a 'workitem_index_path' is configured """
+    if not CONFIG.get('workitem_index_path') or last_modified is None:
+        return False
+    with WORKITEM_INDEX_LOCK:
+        return get_workitem_index().get(stream_id, {}).get(workitem_id) == last_modified
+
+def index_child(stream_id, workitem_id, last_modified):
+    """ Keep the lastModified the children of the work item were fetched at,
+        saved when the work item stream completes """
+    if CONFIG.get('workitem_index_path') and last_modified is not None:
+        with WORKITEM_INDEX_LOCK:
+            get_workitem_index().setdefault(stream_id, {})[workitem_id] = last_modified
+
+def store_workitem_index():
+    """ Save the work item index once every page of work items has been written """
+    if CONFIG.get('workitem_index_path') and 'workitem_index' in RUN_CACHE:
+        with WORKITEM_INDEX_LOCK:
+            cache.write_json(CONFIG['workitem_index_path'], {
+                'account': CONFIG.get('account'),
+                'streams': RUN_CACHE['workitem_index']
+            })
+
+def fetch_workitemhistory(catalog, workitem_id, last_modified):
+    """ Fetch the work item history rows, None when the history stream is not selected
+        or the work item is unchanged since its history was synced """
+    if should_fetch_child(catalog, 'workitemhistory_stream', workitem_id, last_modified):
+        response_data = fetch("GET", workitemhistory_uri(workitem_id), None)
+        if response_data is not None:
+            index_child('workitemhistory_stream', workitem_id, last_modified)
+        return workitemhistory_tap_data(workitem_id, response_data, last_modified)
     return None
 
-def sync_workitemhistory(catalog, workitem_id, last_modified):
-    """ Sync data from work item history """
-    if workitem_id is not None:
-        workitem_history_stream = catalog.get_stream('workitemhistory_stream')
-        if workitem_history_stream and workitem_history_stream.is_selected():
-            with singer.metrics.record_counter(workitem_history_stream.tap_stream_id) as counter:
-                uri = (f"https://api.solarvista.com/workflow/v4/{CONFIG.get('account')}"
-                f"/workItems/id/{workitem_id}/history")
-                history_rows = transform_workitemhistory_to_rowdata(fetch("GET", uri, None))
-                if not history_rows:
-                    LOGGER.error("No history for work item %s", workitem_id)
-                if history_rows and history_rows.get('rows'):
-                    tap_data = []
-                    for history_row in history_rows['rows']:
-                        history_item = history_row['rowData']
-                        history_item['lastModified'] = last_modified
-                        if 'stage_transition_receivedAt' in history_item:
-                            history_item['lastModified'] = \
-                                history_item['stage_transition_receivedAt']
-                        if 'stage_transition_transitionedAt' in history_item:
-                            history_item['lastModified'] = \
-                                history_item['stage_transition_transitionedAt']
-                        tap_data.append(history_item)
-                        counter.increment()
-                    write_data(workitem_history_stream, tap_data, False)
-
-def sync_activity(catalog, workitem_id):
-    """ Sync data from activity """
-    if workitem_id is not None:
-        activity_stream = catalog.get_stream('activity_stream')
-        if activity_stream and activity_stream.is_selected():
-            with singer.metrics.record_counter(activity_stream.tap_stream_id) as counter:
-                uri = (f"https://api.solarvista.com/activity/v2/{CONFIG.get('account')}"
-                    f"/activities/context/{workitem_id}")
-            activity_rows = transform_activity_to_look_like_rowdata(fetch("GET", uri, None))
-            if activity_rows is not None:
-                if activity_rows.get('rows'):
-                    tap_data = []
-                    for activity_row in activity_rows['rows']:
-                        activity_item = activity_row['rowData']
-                        tap_data.append(flatten_json(activity_item))
-                        counter.increment()
-                    write_data(activity_stream, tap_data, False)
-
-def fetch_workitemdetail(workitem_id):
-    """ Fetch workitem detail """
+def workitemhistory_uri(workitem_id):
+    """ Returns the uri of the work item history """
+    return api_uri(f"/workflow/v4/{CONFIG.get('account')}"
+                   f"/workItems/id/{workitem_id}/history")
+
+def workitemhistory_tap_data(workitem_id, response_data, last_modified):
+    """ Transform the work item history response to tap data """
+    history_rows = transform_workitemhistory_to_rowdata(response_data)
+    if not history_rows:
+        LOGGER.error("No history for work item %s", workitem_id)
+    if history_rows and history_rows.get('rows'):
+        tap_data = []
+        for history_row in history_rows['rows']:
+            history_item = history_row['rowData']
+            history_item['lastModified'] = last_modified
+            if 'stage_transition_receivedAt' in history_item:
+                history_item['lastModified'] = \
+                    history_item['stage_transition_receivedAt']
+            if 'stage_transition_transitionedAt' in history_item:
+                history_item['lastModified'] = \
+                    history_item['stage_transition_transitionedAt']
+            tap_data.append(history_item)
+        return tap_data
+    return None
+
+def fetch_activity(catalog, workitem_id, last_modified=None):
+    """ Fetch the activity rows, None when the activity stream is not selected
+        or the work item is unchanged since its activity was synced """
+    if should_fetch_child(catalog, 'activity_stream', workitem_id, last_modified):
+        response_data = fetch("GET", activity_uri(workitem_id), None)
+        if response_data is not None:
+            index_child('activity_stream', workitem_id, last_modified)
+        return activity_tap_data(response_data)
+    return None
+
+def activity_uri(workitem_id):
+    """ Returns the uri of the activities of a work item """
+    return api_uri(f"/activity/v2/{CONFIG.get('account')}"
+                   f"/activities/context/{workitem_id}")
+
+def activity_tap_data(response_data):
+    """ Transform the activity response to tap data """
+    activity_rows = transform_activity_to_look_like_rowdata(response_data)
+    if activity_rows is not None:
+        if activity_rows.get('rows'):
+            tap_data = []
+            plan = flatten.get_plan('activity_stream')
+            for activity_row in activity_rows['rows']:
+                activity_item = activity_row['rowData']
+                tap_data.append(flatten_json(activity_item, plan))
+            return tap_data
+    return None
+
+def workitem_of(row):
+    """ Returns the work item of a row, with the lastModified of a datasource row """
+    item = row['rowData']
+    if 'lastModified' not in item and row.get('lastModified'):
+        item = dict(item, lastModified=row['lastModified'])
+    return item
+
+def fetch_workitem_children(catalog, item):
+    """ Fetch the detail, history and activity of a work item, safe to call from a worker """
+    detail = None
+    if CONFIG.get('workitem_detail_enabled') is not None:
+        detail = fetch_workitemdetail(item['workItemId'], item.get('lastModified'))
+    history_data = fetch_workitemhistory(catalog, item['workItemId'], item.get('lastModified'))
+    activity_data = fetch_activity(catalog, item['workItemId'], item.get('lastModified'))
+    return detail, history_data, activity_data
+
+def write_workitem_children(catalog, children):
+    """ Write the history and activity rows of a page of work items, in work item order """
+    written = False
+    with WRITE_LOCK:
+        for stream_id, index in (('workitemhistory_stream', 1), ('activity_stream', 2)):
+            child_stream = catalog.get_stream(stream_id)
+            child_data = [row for child in children if child[index] for row in child[index]]
+            if child_data:
+                with singer.metrics.record_counter(child_stream.tap_stream_id) as counter:
+                    write_data(child_stream, child_data, False)
+                    counter.increment(len(child_data))
+                written = True
+        if written:
+            # children of the page are complete, checkpoint before the work items
+            writer.write_state(context.root_state())
+
+def fetch_workitemdetail(workitem_id, last_modified=None):
+    """ Fetch workitem detail, from the detail cache when unchanged since it was cached """
     if workitem_id is not None:
-        uri = (f"https://api.solarvista.com/workflow/v4/{CONFIG.get('account')}"
-            f"/workItems/id/{workitem_id}")
-        response_data = fetch("GET", uri, None)
+        response_data = cached_workitemdetail(workitem_id, last_modified)
+        if response_data is None:
+            response_data = fetch("GET", workitemdetail_uri(workitem_id), None)
+            store_workitemdetail(workitem_id, last_modified, response_data)
         return response_data
     return None
 
+def workitemdetail_cache_path(workitem_id):
+    """ Returns the file the detail of a work item is cached in """
+    key = f"{CONFIG.get('account')}/{workitem_id}".encode('utf-8')
+    return os.path.join(CONFIG['workitem_detail_cache_dir'],
+                        hashlib.sha256(key).hexdigest() + '.json')
+
+def cached_workitemdetail(workitem_id, last_modified):
+    """ Returns the work item detail cached at the same lastModified, None when the
+        'workitem_detail_cache_dir' is not configured or the work item has changed """
+    if not CONFIG.get('workitem_detail_cache_dir') or last_modified is None:
+        return None
+    path = workitemdetail_cache_path(workitem_id)
+    cached = cache.read_json(path)
+    if cached and cached.get('lastModified') == last_modified:
+        cache.touch(path)
+        return cached['detail']
+    return None
+
+def store_workitemdetail(workitem_id, last_modified, detail):
+    """ Cache the work item detail at its lastModified, when a 'workitem_detail_cache_dir'
+        is configured, the least recently used are pruned once the work items are synced """
+    if CONFIG.get('workitem_detail_cache_dir') and last_modified is not None \
+            and detail is not None:
+        cache.write_json(workitemdetail_cache_path(workitem_id), {
+            'lastModified': last_modified,
+            'detail': detail
+        })
+
+def workitemdetail_uri(workitem_id):
+    """ Returns the uri of the work item detail """
+    return api_uri(f"/workflow/v4/{CONFIG.get('account')}"
+                   f"/workItems/id/{workitem_id}")
+
 def transform_workitemhistory_to_rowdata(response_data):
     """ transform the work item history response to row data """
     if response_data is None:
@@ -304,124 +1064,160 @@ def transform_workitemhistory_to_rowdata(response_data):
             workitem_data[k] = value
 
     new_data = {}
+    history_plan = flatten.get_plan('workitemhistory_stream')
+    excluded = getattr(history_plan, 'excluded', ())
+    if excluded:
+        # the work item fields are copied as they are, deselected fields are left out too
+        workitem_data = {k: value for k, value in workitem_data.items() if k not in excluded}
     for k, value in response_data.items():
         if k == 'stages':
             rows = []
             for i, stage in enumerate(value):
                 row_data = {}
-                row_data['workItemHistoryId'] = workitem_data['workItemId'] + "_" + str(i)
+                row_data['workItemHistoryId'] = response_data['workItemId'] + "_" + str(i)
                 row_data.update(workitem_data)
                 stage_data= {}
                 stage_data['stage'] = stage
-                row_data.update(flatten_json(stage_data))
+                row_data.update(flatten_json(stage_data, history_plan))
                 rows.append({ "rowData": row_data})
             new_data['rows'] = rows
     return new_data
 
-def fetch(method, uri, body):
-    """ Fetch from Solarvista API """
+def fetch(method, uri, body, items_key=None):
+    """ Fetch from Solarvista API, when 'streaming_json' is enabled a response with
+        an items_key array is returned as a page parsed as its rows are consumed """
     LOGGER.debug("FETCH %s", uri)
     headers = {
         "Accept": "application/json",
         "Content-Type": "application/json",
         "Authorization": "Bearer " + get_access_token()
     }
-    response = _fetch(method, headers, uri, body, 1)
+    stream = items_key is not None and is_streaming_enabled()
+    response = _fetch(method, headers, uri, body, 1, stream)
     if response is not None:
         if response.status_code == 200:
-            response_data = response.json()
+            if stream:
+                return streaming.StreamedPage(response, items_key)
+            with profiling.phase('decode'):
+                response_data = response.json()
             return response_data
     return None
 
-def _fetch(method, headers, uri, body, refresh_auth):
+def is_streaming_enabled():
+    """ Returns True when 'streaming_json' is configured and ijson is installed """
+    if str(CONFIG.get('streaming_json', False)).lower() != 'true':
+        return False
+    if streaming.ijson is None:
+        LOGGER.warning("streaming_json requires ijson, install tap-solarvista[streaming]")
+        return False
+    return True
+
+#pylint: disable=too-many-arguments,too-many-positional-arguments
+def _fetch(method, headers, uri, body, refresh_auth, stream=False):
     """ Internal fetch to allow access token to be refreshed """
-    retries = Retry(total=6, backoff_factor=1, status_forcelist=[429, 500, 502, 503, 504])
-    http = requests.Session()
-    http.mount("https://", TimeoutHttpAdapter(max_retries=retries))
+    http = session.get_session(CONFIG)
     response = None
-    if method == "GET":
-        LOGGER.debug("GET %s", uri)
-        with requests.get(uri, headers=headers) as res:
-            LOGGER.debug("[%s] GET %s", str(res.status_code), uri)
-            response = res
-    elif method == "POST":
-        LOGGER.debug("POST %s %s", uri, body)
-        with requests.post(uri,
-                           data=body,
-                           headers=headers) as res:
-            LOGGER.debug("[%s] POST %s", str(res.status_code), uri)
-            response = res
+    ratelimit.wait()
+    started = time.monotonic()
+    session.reset_retries()
+    try:
+        with profiling.phase('auth' if uri == auth_uri() else 'fetch'):
+            if method == "GET":
+                LOGGER.debug("GET %s", uri)
+                response = http.get(uri, headers=headers, stream=stream)
+                LOGGER.debug("[%s] GET %s", str(response.status_code), uri)
+            elif method == "POST":
+                LOGGER.debug("POST %s %s", uri, body)
+                response = http.post(uri,
+                                     data=body,
+                                     headers=headers,
+                                     stream=stream)
+                LOGGER.debug("[%s] POST %s", str(response.status_code), uri)
+    except requests.exceptions.RequestException:
+        httpmetrics.record(uri, None, time.monotonic() - started,
+                           retries=session.retry_count())
+        raise
+    if response is not None:
+        httpmetrics.record(uri, response.status_code, time.monotonic() - started,
+                           httpmetrics.response_size(response, stream),
+                           session.retry_count())
+    if response is not None and response.status_code < 400:
+        # throttled and failed attempts are reported as they are retried
+        ratelimit.completed(response.elapsed.total_seconds())
+    if response is not None and not (stream and response.status_code == 200):
+        # the body has been read, return the connection to the pool
+        response.close()
     if response is not None and refresh_auth and response.status_code == 401:
         LOGGER.error("[%s] token expired %s", str(response.status_code), uri)
-        CONFIG.pop('personal_access_token', None)
+        # only the first caller to see the expired token discards it
+        auth.invalidate(CONFIG, headers['Authorization'][len("Bearer "):])
         headers['Authorization'] = "Bearer " + get_access_token()
-        response = _fetch(method, headers, uri, body, 0)
+        response = _fetch(method, headers, uri, body, 0, stream)
     return response
 
 
 def get_access_token():
-    """ Fetch access token from Solarvista API """
-    if CONFIG.get("personal_access_token") is not None:
-        return CONFIG.get("personal_access_token")
+    """ Fetch access token from Solarvista API, refreshed ahead of its expiry
+        and fetched once for all waiting callers """
+    access_token = auth.current_token(CONFIG)
+    if access_token is not None:
+        return access_token
+    with auth.token_lock():
+        access_token = auth.current_token(CONFIG) or auth.cached_token(CONFIG)
+        if access_token is not None:
+            return access_token
+        headers, body = access_token_request()
+        response = _fetch("POST", headers, auth_uri(), body, 0)
+        response.raise_for_status()
+        if response is not None:
+            if response.status_code == 200:
+                return auth.store_token(CONFIG, response.json())
+    return None
+
+def access_token_request():
+    """ Returns the headers and body to request an access token """
     headers = {
         "Accept": "application/json",
         "Content-Type": "application/x-www-form-urlencoded"
     }
     body = (f"client_id=pat&grant_type=password&username={CONFIG.get('clientId')}"
         f"&password={CONFIG.get('code')}")
-    response = _fetch("POST", headers, "https://auth.solarvista.com/connect/token", body, 0)
-    response.raise_for_status()
-    if response is not None:
-        if response.status_code == 200:
-            response_data = response.json()
-            access_token = response_data['access_token']
-            CONFIG['personal_access_token'] = access_token
-            return access_token
-    return None
-
-def lower_first_character(string):
-    """ Lower the first character of a string """
-    if string:
-        return string[:1].lower() + string[1:]
-    return ''
+    return headers, body
 
-def flatten_json(unformated_json):
-    """ Flatten a json object, returning a single level underscore separated json structure """
-    out = {}
-
-    def flatten(json_structure, name=''):
-        if isinstance(json_structure, dict):
-            for element in json_structure:
-                flatten(json_structure[element], name + lower_first_character(element) + '_')
-        else:
-            out[name[:-1]] = json_structure
-
-    flatten(unformated_json)
-    return out
-
-def write_data(stream, tap_data, write_state = True):
-    """ Write the fetched data to singer records and update state """
+def write_data(stream, tap_data, write_state = True, is_sorted = True, state_entity = None):
+    """ Write the fetched data to singer records and update state, when the data is not
+        sorted ascending on the bookmark the max bookmark is returned for the caller to save """
     bookmark_column = stream.replication_key
-    state_key = stream.tap_stream_id
-    is_sorted = True  # indicate whether data is sorted ascending on bookmark value
+    state_key = state_entity or stream.tap_stream_id
     max_bookmark = None
+    max_value = None
     for row in tap_data:
-        # write one or more rows to the stream:
-        singer.write_records(stream.tap_stream_id, [row])
-        if bookmark_column:
-            if row.get(bookmark_column):
-                if is_sorted:
-                    # update bookmark to latest value
-                    utils.update_state(STATE, state_key, row[bookmark_column])
-                else:
-                    # if data unsorted, save max value until end of writes
-                    max_bookmark = max(max_bookmark, row[bookmark_column])
-            else:
-                LOGGER.error("[%s] bookmark value not found in column [%s]",
-                             stream.tap_stream_id, bookmark_column)
-
-    if bookmark_column and not is_sorted:
-        utils.update_state(STATE, state_key, max_bookmark)
+        # streams may sync in parallel, each record and its bookmark are written together
+        with WRITE_LOCK:
+            if context.is_multi_account():
+                row['account'] = CONFIG['account']
+            # write one or more rows to the stream:
+            writer.write_record(stream.tap_stream_id, row)
+            if bookmark_column:
+                if row.get(bookmark_column):
+                    if is_sorted:
+                        # update bookmark to latest value
+                        utils.update_state(STATE, state_key, row[bookmark_column])
+                    else:
+                        # if data unsorted, keep max value until end of writes
+                        value = parse_bookmark(row[bookmark_column])
+                        if max_value is None or value > max_value:
+                            max_bookmark, max_value = row[bookmark_column], value
+                elif not is_datasource_incremental(stream):
+                    LOGGER.error("[%s] bookmark value not found in column [%s]",
+                                 stream.tap_stream_id, bookmark_column)
+                elif stream.tap_stream_id not in RUN_CACHE.setdefault('bookmarks_missing', set()):
+                    # datasource rows may never have been modified, logged once per stream
+                    RUN_CACHE['bookmarks_missing'].add(stream.tap_stream_id)
+                    LOGGER.warning("[%s] rows without a value in column [%s] do not move "
+                                   "the bookmark", stream.tap_stream_id, bookmark_column)
+
     if write_state:
-        LOGGER.info("Writing state [%s]", STATE)
-        singer.write_state(STATE)
+        with WRITE_LOCK:
+            writer.write_state(context.root_state())
+    return max_bookmark
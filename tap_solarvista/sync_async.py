@@ -0,0 +1,314 @@
+""" sync_async is responsible for the asyncio sync engine, where every selected stream
+and work item child request shares one aiohttp connection pool """
+import asyncio
+import time
+import singer
+from tap_solarvista import auth
+from tap_solarvista import httpmetrics
+from tap_solarvista import profiling
+from tap_solarvista import ratelimit
+from tap_solarvista import sync # pylint: disable=cyclic-import
+from tap_solarvista.timeout_http_adapter import DEFAULT_TIMEOUT
+
+try:
+    import aiohttp
+except ImportError as err:
+    raise ImportError("sync_engine 'asyncio' requires aiohttp, "
+                      "install with 'pip install tap-solarvista[async]'") from err
+
+LOGGER = singer.get_logger()
+DEFAULT_MAX_CONCURRENCY = 50
+RETRY_STATUSES = [429, 500, 502, 503, 504]
+RETRY_TOTAL = 6
+RETRY_BACKOFF_FACTOR = 1
+
+
+class AsyncClient:
+    """ Async http client with a shared connection pool and a limit on requests in flight """
+
+    def __init__(self, config):
+        """ Constructor with the pool size, timeout and concurrency from config """
+        max_concurrency = int(config.get('max_concurrency', DEFAULT_MAX_CONCURRENCY))
+        connector = aiohttp.TCPConnector(
+            limit=int(config.get('pool_maxsize', max_concurrency)),
+            force_close=str(config.get('keep_alive', True)).lower() == 'false')
+        self.http = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(
+                total=float(config.get('request_timeout', DEFAULT_TIMEOUT))))
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.token_lock = asyncio.Lock()
+        self.datasource_locks = {}
+
+    async def close(self):
+        """ Close the session and release its pooled connections """
+        await self.http.close()
+
+    async def fetch(self, method, uri, body, refresh_auth=True):
+        """ Fetch from Solarvista API """
+        LOGGER.debug("FETCH %s", uri)
+        access_token = await self.get_access_token()
+        headers = {
+            "Accept": "application/json",
+            "Content-Type": "application/json",
+            "Authorization": "Bearer " + access_token
+        }
+        status, response_data = await self._fetch(method, headers, uri, body)
+        if refresh_auth and status == 401:
+            LOGGER.error("[%s] token expired %s", str(status), uri)
+            # only the first caller to see the expired token discards it
+            auth.invalidate(sync.CONFIG, access_token)
+            return await self.fetch(method, uri, body, False)
+        if status == 200:
+            return response_data
+        return None
+
+    async def _fetch(self, method, headers, uri, body):
+        """ Internal fetch retrying throttled and failed requests with exponential backoff,
+            or after the 'Retry-After' seconds when longer """
+        first_started = time.monotonic()
+        for attempt in range(RETRY_TOTAL + 1):
+            retry_after = None
+            await asyncio.sleep(ratelimit.reserve())
+            async with self.semaphore:
+                try:
+                    started = time.monotonic()
+                    async with self.http.request(method, uri, headers=headers,
+                                                 data=body) as res:
+                        LOGGER.debug("[%s] %s %s", str(res.status), method, uri)
+                        if res.status in RETRY_STATUSES:
+                            retry_after = ratelimit.parse_retry_after(
+                                res.headers.get('Retry-After'))
+                            ratelimit.throttled(retry_after)
+                        elif res.status < 400:
+                            ratelimit.completed(time.monotonic() - started)
+                        if res.status not in RETRY_STATUSES or attempt == RETRY_TOTAL:
+                            content = await res.read()
+                            httpmetrics.record(uri, res.status, time.monotonic() - first_started,
+                                               len(content), attempt)
+                            if res.status == 200:
+                                return res.status, await res.json(content_type=None)
+                            return res.status, None
+                except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                    ratelimit.throttled()
+                    if attempt == RETRY_TOTAL:
+                        httpmetrics.record(uri, None, time.monotonic() - first_started,
+                                           retries=attempt)
+                        raise
+            await asyncio.sleep(max(RETRY_BACKOFF_FACTOR * (2 ** attempt), retry_after or 0))
+        return None, None
+
+    async def get_access_token(self):
+        """ Fetch access token from Solarvista API, refreshed ahead of its expiry
+            and fetched once for all waiting callers """
+        access_token = auth.current_token(sync.CONFIG)
+        if access_token is not None:
+            return access_token
+        async with self.token_lock:
+            access_token = auth.current_token(sync.CONFIG) or auth.cached_token(sync.CONFIG)
+            if access_token is None:
+                headers, body = sync.access_token_request()
+                status, response_data = await self._fetch("POST", headers, sync.auth_uri(), body)
+                if status != 200:
+                    raise aiohttp.ClientError(f"[{status}] unable to fetch access token")
+                access_token = auth.store_token(sync.CONFIG, response_data)
+        return access_token
+
+
+def sync_all_streams(catalog, selected_streams):
+    """ Sync the selected streams concurrently on one event loop """
+    with profiling.stream('asyncio'):
+        asyncio.run(sync_streams(catalog, selected_streams))
+
+
+async def sync_streams(catalog, selected_streams):
+    """ Sync the selected streams concurrently, sharing one client """
+    client = AsyncClient(sync.CONFIG)
+    try:
+        await asyncio.gather(*[sync_stream(client, catalog, stream)
+                               for stream in selected_streams])
+    finally:
+        await client.close()
+
+
+async def sync_stream(client, catalog, stream):
+    """ Sync every page of a stream """
+    LOGGER.info("Syncing stream:%s", stream.tap_stream_id)
+    # the streams share the event loop thread, only their phases are attributed to them
+    with profiling.stream(stream.tap_stream_id, cpu_profile=False):
+        with singer.metrics.record_counter(stream.tap_stream_id) as counter:
+            for predefined_filter in sync.stream_filters(stream):
+                if not await sync_pages(client, catalog, stream, counter, predefined_filter):
+                    # keep the checkpoint for the next run
+                    return
+        sync.complete_stream(stream)
+
+
+async def sync_pages(client, catalog, stream, counter, predefined_filter):
+    """ Sync every page of a stream, or of a predefined work-item filter,
+        returning False when a page could not be fetched """
+    state_entity = sync.filter_state_entity(stream, predefined_filter)
+    continuation = sync.resume_continuation(stream)
+    resumed = continuation is not None
+    while True:
+        if sync.is_workitem_search(stream):
+            response_data = await sync_workitems_by_filter(client, stream, continuation,
+                                                           predefined_filter)
+        elif stream.tap_stream_id == 'appointment_stream':
+            if sync.is_appointment_windowed():
+                await sync_appointment_windows(client, stream, counter)
+                return True
+            response_data = await sync_appointment(client, stream, continuation)
+        else:
+            response_data = await sync_datasource(client, stream, continuation)
+            if sync.is_continuation_rejected(stream, response_data, resumed):
+                continuation, resumed = None, False
+                continue
+            resumed = False
+        if sync.is_stream_incomplete(stream, response_data, continuation):
+            return False
+        continuation = None
+        if response_data is not None:
+            children = None
+            if stream.tap_stream_id == 'workitem_stream':
+                children = await asyncio.gather(
+                    *[fetch_workitem_children(client, catalog, sync.workitem_of(row))
+                      for row in response_data['rows']])
+            continuation = sync.write_response_data(catalog, stream, counter,
+                                                    response_data, children, state_entity)
+        if continuation is None:
+            return True
+
+
+async def sync_workitems_by_filter(client, stream, continue_from, predefined_filter=None):
+    """ Sync work-item data from tap source with continuation """
+    uri, body = sync.workitems_search_request(stream, stream.replication_key, continue_from,
+                                              predefined_filter)
+    response_data = await client.fetch("POST", uri, body)
+    return sync.transform_search_to_look_like_rowdata(response_data)
+
+
+async def sync_datasource(client, stream, continue_from):
+    """ Sync data from tap source with continuation """
+    if stream.stream_alias is not None:
+        modified_after = sync.datasource_modified_after(stream)
+        if modified_after is None and sync.is_datasource_shared(stream.stream_alias):
+            # another stream reads every row, both are served the pages fetched once
+            return (await datasource_pages(client, stream.stream_alias)).get(continue_from)
+        uri, body = sync.datasource_request(stream.stream_alias, continue_from, modified_after)
+        return await client.fetch("POST", uri, body)
+    return None
+
+
+async def datasource_pages(client, datasource):
+    """ Returns the pages of a datasource by the continuation requesting them,
+        paged at most once per run however many streams read it """
+    async with client.datasource_locks.setdefault(datasource, asyncio.Lock()):
+        pages = sync.cached_datasource_pages(datasource)
+        if pages is None:
+            pages, complete = await fetch_datasource_pages(client, datasource)
+            sync.store_datasource_pages(datasource, pages, complete)
+    return pages
+
+
+async def fetch_datasource_pages(client, datasource):
+    """ Fetch every page of a datasource, up to a page that could not be fetched,
+        returning the pages and True when the last page was reached """
+    pages = {}
+    continuation = None
+    while True:
+        uri, body = sync.datasource_request(datasource, continuation)
+        response_data = await client.fetch("POST", uri, body)
+        if response_data is None:
+            LOGGER.error("Unable to fetch every page of datasource %s", datasource)
+            return pages, False
+        pages[continuation] = response_data
+        continuation = sync.response_continuation(response_data)
+        if continuation is None:
+            return pages, True
+
+
+async def sync_appointment(client, stream, continue_from):
+    """ Sync appointments for all users from tap source with continuation """
+    users = await get_user_ids(client)
+    if users and stream.stream_alias is not None:
+        uri, body = sync.appointments_request(users, continue_from)
+        response_data = await client.fetch("POST", uri, body)
+        return sync.transform_appointments_to_look_like_rowdata(response_data)
+    return None
+
+
+async def sync_appointment_windows(client, stream, counter):
+    """ Sync appointments one time slice at a time, searching the user chunks concurrently """
+    users = await get_user_ids(client)
+    if not users:
+        return
+    seen = set()
+    for window_from, window_to in sync.appointment_windows(stream):
+        LOGGER.info("Syncing appointments from %s to %s", window_from, window_to)
+        results = await asyncio.gather(
+            *[fetch_appointments(client, chunk, window_from, window_to)
+              for chunk in sync.user_chunks(users)])
+        sync.write_appointment_window(stream, counter, window_to, results, seen)
+
+
+async def fetch_appointments(client, users, window_from, window_to):
+    """ Fetch every page of appointments for the users within the window """
+    appointments = []
+    continuation = None
+    while True:
+        uri, body = sync.appointments_request(users, continuation, window_from, window_to)
+        response_data = await client.fetch("POST", uri, body)
+        continuation = None
+        if response_data is not None:
+            continuation = sync.response_continuation(response_data)
+            appointments.extend(response_data.get('appointments') or [])
+        if continuation is None:
+            break
+    return appointments
+
+
+async def get_user_ids(client):
+    """ Returns the ids of all users, fetched at most once per run """
+    users = sync.cached_user_ids()
+    if users is None:
+        pages = await datasource_pages(client, 'users')
+        users = [row['rowData']['userId'] for row in sync.datasource_rows(pages)]
+        if sync.is_datasource_complete('users'):
+            sync.store_user_ids(users)
+    return users
+
+
+async def fetch_workitem_children(client, catalog, item):
+    """ Fetch the detail, history and activity of a work item concurrently """
+    workitem_id = item['workItemId']
+    last_modified = item.get('lastModified')
+
+    async def fetch_detail():
+        if sync.CONFIG.get('workitem_detail_enabled') is not None:
+            detail = sync.cached_workitemdetail(workitem_id, last_modified)
+            if detail is None:
+                detail = await client.fetch("GET", sync.workitemdetail_uri(workitem_id), None)
+                sync.store_workitemdetail(workitem_id, last_modified, detail)
+            return detail
+        return None
+
+    async def fetch_history():
+        if sync.should_fetch_child(catalog, 'workitemhistory_stream', workitem_id,
+                                   last_modified):
+            response_data = await client.fetch("GET", sync.workitemhistory_uri(workitem_id),
+                                               None)
+            if response_data is not None:
+                sync.index_child('workitemhistory_stream', workitem_id, last_modified)
+            return sync.workitemhistory_tap_data(workitem_id, response_data, last_modified)
+        return None
+
+    async def fetch_activity():
+        if sync.should_fetch_child(catalog, 'activity_stream', workitem_id, last_modified):
+            response_data = await client.fetch("GET", sync.activity_uri(workitem_id), None)
+            if response_data is not None:
+                sync.index_child('activity_stream', workitem_id, last_modified)
+            return sync.activity_tap_data(response_data)
+        return None
+
+    return tuple(await asyncio.gather(fetch_detail(), fetch_history(), fetch_activity()))
@@ -0,0 +1,196 @@
+""" benchmark is responsible for measuring the throughput of the tap against the local
+    fake_server stand-in for Solarvista API, run with
+    python -m tap_solarvista.tests.benchmark --help """
+import argparse
+import json
+import os
+import sys
+import tempfile
+import subprocess
+import time
+from tap_solarvista.tests.fake_server import DEFAULT_LATENCY, DEFAULT_PAGE_SIZE, \
+    DEFAULT_VOLUMES, FakeSolarvista
+
+# scenario -> datasources selected, each scenario runs the tap in its own process
+SCENARIOS = {
+    'work-item': ['work-item', 'work-item-history', 'activity'],
+    'customer': ['customer'],
+    'users': ['users'],
+    'appointment': ['appointment'],
+}
+IMPORT_SCENARIO = 'import' # seconds a fresh interpreter takes to import the tap
+IMPORT_RUNS = 5
+DEFAULT_TOLERANCE = 0.2 # records/sec below, or import seconds above, the baseline by more
+                        # than this fraction regress
+USAGE_ENV = 'TAP_SOLARVISTA_BENCHMARK_USAGE' # file the tap process writes its usage to
+# the tap reports its own usage, that of the children is the largest of any child so far
+TAP_COMMAND = [sys.executable, '-c', f"""
+import os, resource, tap_solarvista
+try:
+    tap_solarvista.main()
+finally:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    with open(os.environ['{USAGE_ENV}'], 'w', encoding='utf8') as file:
+        file.write(f'{{usage.ru_utime + usage.ru_stime}} {{usage.ru_maxrss}}')
+"""]
+
+
+def tap_config(server, scenario, extra_config=None):
+    """ Returns the tap config syncing the datasources of a scenario from the server """
+    config = {
+        'account': 'bench-account',
+        'clientId': 'bench-client',
+        'code': 'bench-code',
+        'start_date': "2020-01-01T00:00:00+00:00",
+        'api_url': server.url,
+        'auth_url': server.url,
+        'datasources': SCENARIOS[scenario],
+    }
+    config.update(extra_config or {})
+    return config
+
+def count_records(output):
+    """ Returns the records of each stream in the singer output file """
+    records = {}
+    with open(output, encoding='utf8') as file:
+        for line in file:
+            if line.startswith('{"type":"RECORD"') or line.startswith('{"type": "RECORD"'):
+                stream = json.loads(line)['stream']
+                records[stream] = records.get(stream, 0) + 1
+    return records
+
+def run_tap(config_path, output_path, log_path):
+    """ Run the tap in a child process, returning its seconds, CPU seconds and peak
+        resident memory """
+    usage_path = os.path.join(os.path.dirname(output_path), 'usage.txt')
+    started = time.monotonic()
+    with open(output_path, 'w', encoding='utf8') as output, \
+            open(log_path, 'w', encoding='utf8') as log:
+        process = subprocess.run(TAP_COMMAND + ['-c', config_path], stdout=output, stderr=log,
+                                 env=dict(os.environ, **{USAGE_ENV: usage_path}), check=False)
+    elapsed = time.monotonic() - started
+    if process.returncode != 0:
+        with open(log_path, encoding='utf8') as log:
+            raise RuntimeError(f"Tap exited with {process.returncode}\n" + log.read()[-2000:])
+    with open(usage_path, encoding='utf8') as file:
+        cpu_seconds, maxrss = file.read().split()
+    return elapsed, float(cpu_seconds), int(maxrss)
+
+def run_scenario(server, scenario, extra_config=None):
+    """ Run the tap for a scenario, returning its measurements """
+    with tempfile.TemporaryDirectory() as directory:
+        config_path = os.path.join(directory, 'config.json')
+        with open(config_path, 'w', encoding='utf8') as file:
+            json.dump(tap_config(server, scenario, extra_config), file)
+        server.reset_requests()
+        elapsed, cpu_seconds, maxrss = run_tap(config_path, os.path.join(directory, 'output.jsonl'),
+                                 os.path.join(directory, 'tap.log'))
+        records = count_records(os.path.join(directory, 'output.jsonl'))
+    requests = server.reset_requests()
+    return {
+        'scenario': scenario,
+        'seconds': round(elapsed, 3),
+        'records': records,
+        'records_per_second': round(sum(records.values()) / elapsed, 1),
+        'requests': requests,
+        'requests_per_second': round(requests / elapsed, 1),
+        # kilobytes on linux, bytes on macOS
+        'peak_rss_mb': round(maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1),
+        'cpu_seconds': round(cpu_seconds, 3),
+    }
+
+def run_import(statement="import tap_solarvista", runs=IMPORT_RUNS):
+    """ Time the statement in fresh interpreters, returning the median seconds """
+    code = f"import time; started = time.perf_counter(); {statement}; " \
+           "print(time.perf_counter() - started)"
+    seconds = sorted(float(subprocess.check_output([sys.executable, '-c', code]))
+                     for _ in range(runs))
+    return {'scenario': IMPORT_SCENARIO, 'import_seconds': round(seconds[len(seconds) // 2], 4)}
+
+def imported_modules(statement):
+    """ Returns the modules a fresh interpreter has imported after the statement """
+    code = f"{statement}; import sys; print(' '.join(sys.modules))"
+    return set(subprocess.check_output([sys.executable, '-c', code]).decode().split())
+
+def check_regressions(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """ Returns a message for each scenario whose records/sec fell below, or import
+        seconds rose above, the baseline by more than the tolerance """
+    regressions = []
+    previous = {result['scenario']: result for result in baseline}
+    for result in results:
+        expected = previous.get(result['scenario'])
+        if not expected:
+            continue
+        if 'import_seconds' in result:
+            if result['import_seconds'] > expected['import_seconds'] * (1 + tolerance):
+                regressions.append(f"{result['scenario']}: {result['import_seconds']} "
+                                   f"seconds, baseline {expected['import_seconds']}")
+        elif result['records_per_second'] < expected['records_per_second'] * (1 - tolerance):
+            regressions.append(f"{result['scenario']}: {result['records_per_second']} "
+                               f"records/sec, baseline {expected['records_per_second']}")
+    return regressions
+
+def print_results(results):
+    """ Print a table of the measurements of each scenario """
+    columns = ['scenario', 'records', 'records/s', 'requests', 'requests/s', 'peak RSS MB',
+               'CPU s']
+    print(''.join(f"{column:>14}" for column in columns))
+    for result in results:
+        if 'import_seconds' in result:
+            print(f"{result['scenario']:>14}{result['import_seconds']:>14} seconds")
+            continue
+        values = [result['scenario'], sum(result['records'].values()),
+                  result['records_per_second'], result['requests'],
+                  result['requests_per_second'], result['peak_rss_mb'], result['cpu_seconds']]
+        print(''.join(f"{value:>14}" for value in values))
+
+def parse_args(argv=None):
+    """ Parse the benchmark arguments """
+    parser = argparse.ArgumentParser(description="Benchmark tap-solarvista offline")
+    parser.add_argument('--scenario', action='append',
+                        choices=sorted(SCENARIOS) + [IMPORT_SCENARIO],
+                        help="Scenario to run, repeat for several, default all")
+    for volume, default in DEFAULT_VOLUMES.items():
+        parser.add_argument(f'--{volume}', type=int, default=default,
+                            help=f"Volume of {volume} generated, default {default}")
+    parser.add_argument('--page-size', type=int, default=DEFAULT_PAGE_SIZE)
+    parser.add_argument('--latency', type=float, default=DEFAULT_LATENCY,
+                        help="Mean seconds each response is delayed")
+    parser.add_argument('--config', help="Json file of tap config to benchmark with, e.g. "
+                                         "max_concurrency, sync_engine or "
+                                         "workitem_detail_enabled")
+    parser.add_argument('--output', help="Json file to write the results to")
+    parser.add_argument('--baseline', help="Json results of a previous run, "
+                                           "exits 1 when records/sec or import time regress")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE)
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    """ Run the benchmark scenarios, returning the exit code """
+    args = parse_args(argv)
+    extra_config = None
+    if args.config:
+        with open(args.config, encoding='utf8') as file:
+            extra_config = json.load(file)
+    volumes = {volume: getattr(args, volume) for volume in DEFAULT_VOLUMES}
+    scenarios = args.scenario or list(SCENARIOS) + [IMPORT_SCENARIO]
+    with FakeSolarvista(volumes, args.page_size, args.latency) as server:
+        results = [run_scenario(server, scenario, extra_config)
+                   for scenario in scenarios if scenario != IMPORT_SCENARIO]
+    if IMPORT_SCENARIO in scenarios:
+        results.append(run_import())
+    print_results(results)
+    if args.output:
+        with open(args.output, 'w', encoding='utf8') as file:
+            json.dump(results, file, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding='utf8') as file:
+            regressions = check_regressions(results, json.load(file), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
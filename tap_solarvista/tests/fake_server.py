@@ -0,0 +1,201 @@
+""" fake_server is a local stand-in for Solarvista API, generating configurable volumes
+    of work items, history stages, activities, users, appointments and datasource rows """
+import json
+import random
+import re
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_VOLUMES = {
+    'workitems': 1000,
+    'stages': 5, # history stages per work item
+    'activities': 3, # activities per work item
+    'users': 200,
+    'appointments': 5, # appointments per user
+    'rows': 5000, # rows per datasource
+}
+DEFAULT_PAGE_SIZE = 500
+DEFAULT_LATENCY = 0.05 # seconds, each response is delayed between half and one and a half times
+EPOCH = datetime(2021, 1, 1, tzinfo=timezone.utc)
+
+ROUTES = [
+    ('POST', re.compile(r'^/connect/token$'), 'token'),
+    ('POST', re.compile(r'^/datagateway/v3/[^/]+/datasources/ref/([^/]+)/data/query$'),
+     'datasource'),
+    ('POST', re.compile(r'^/workflow/v4/[^/]+/workItems/search$'), 'workitems'),
+    ('GET', re.compile(r'^/workflow/v4/[^/]+/workItems/id/([^/]+)/history$'), 'history'),
+    ('GET', re.compile(r'^/workflow/v4/[^/]+/workItems/id/([^/]+)$'), 'detail'),
+    ('GET', re.compile(r'^/activity/v2/[^/]+/activities/context/([^/]+)$'), 'activities'),
+    ('POST', re.compile(r'^/calendar/v2/[^/]+/appointments/search/users$'), 'appointments'),
+]
+
+
+def modified_at(index):
+    """ Returns the lastModified of the generated item at index, a minute apart """
+    return (EPOCH + timedelta(minutes=index)).isoformat()
+
+def parse_query(body):
+    """ Returns the json query of a request body, empty for form encoded token requests """
+    try:
+        return json.loads(body) if body else {}
+    except ValueError:
+        return {}
+
+def page(items, continuation, page_size):
+    """ Returns the items of the page at the continuation token and the next token """
+    start = int(continuation or 0)
+    end = start + page_size
+    return items[start:end], (str(end) if end < len(items) else None)
+
+
+class FakeSolarvista:
+    """ A threaded http server answering Solarvista API requests with generated data """
+
+    def __init__(self, volumes=None, page_size=DEFAULT_PAGE_SIZE, latency=DEFAULT_LATENCY):
+        """ Constructor with the volumes to generate, rows per page and seconds of latency """
+        self.volumes = dict(DEFAULT_VOLUMES, **(volumes or {}))
+        self.page_size = page_size
+        self.latency = latency
+        self.requests = 0
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self.handler())
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        """ Returns the base url the server listens on """
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def start(self):
+        """ Start serving requests on a background thread """
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """ Stop serving requests """
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def reset_requests(self):
+        """ Returns the requests served since the last reset """
+        with self.lock:
+            requests, self.requests = self.requests, 0
+        return requests
+
+    def handler(self):
+        """ Returns the request handler class bound to this server """
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            """ Route each request to the fake server """
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self): # pylint: disable=invalid-name
+                """ Handle a GET request """
+                self.respond('GET', None)
+
+            def do_POST(self): # pylint: disable=invalid-name
+                """ Handle a POST request """
+                length = int(self.headers.get('Content-Length') or 0)
+                self.respond('POST', self.rfile.read(length))
+
+            def respond(self, method, body):
+                """ Write the json response of the route matching the request """
+                status, payload = fake.route(method, self.path, body)
+                data = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args): # pylint: disable=arguments-differ
+                """ Requests are counted rather than logged """
+
+        return Handler
+
+    def route(self, method, path, body):
+        """ Returns the status and payload of a request, after the configured latency """
+        with self.lock:
+            self.requests += 1
+        if self.latency:
+            time.sleep(self.latency * random.uniform(0.5, 1.5))
+        for route_method, pattern, name in ROUTES:
+            match = pattern.match(path.split('?')[0])
+            if route_method == method and match:
+                return 200, getattr(self, name)(parse_query(body), *match.groups())
+        return 404, {'error': f"{method} {path} not found"}
+
+    def token(self, _query):
+        """ Returns an access token """
+        return {'access_token': "fake-token", 'expires_in': 3600, 'token_type': "Bearer"}
+
+    def datasource(self, query, datasource):
+        """ Returns a page of datasource rows, users are the users appointments belong to
+            and work items those searched """
+        if datasource == 'users':
+            count = self.volumes['users']
+            rows = [{'rowData': {'userId': f"user-{i}", 'displayName': f"User {i}",
+                                 'lastModified': modified_at(i)}} for i in range(count)]
+        elif datasource == 'work-item':
+            rows = [{'rowData': item} for item in self.workitem_items()]
+        else:
+            rows = [{'rowData': {'reference': f"{datasource}-{i}", 'name': f"Name {i}",
+                                 'status': "Active", 'address': {'postalCode': "AB1 2CD"},
+                                 'lastModified': modified_at(i)}}
+                    for i in range(self.volumes['rows'])]
+        rows, continuation = page(rows, query.get('continuationToken'), self.page_size)
+        return {'rows': rows, 'continuationToken': continuation}
+
+    def workitem_items(self):
+        """ Returns every work item """
+        return [{'workItemId': f"workitem-{i}", 'reference': f"WI{i:06d}",
+                 'lastModified': modified_at(i), 'isCompleted': i % 2 == 0,
+                 'currentStage': {'stageType': "Working"}}
+                for i in range(self.volumes['workitems'])]
+
+    def workitems(self, query):
+        """ Returns a page of work items modified after 'lastModifiedAfter' """
+        items = self.workitem_items()
+        after = query.get('lastModifiedAfter')
+        if after:
+            items = [item for item in items if item['lastModified'] > after]
+        items, continuation = page(items, query.get('continuationToken'), self.page_size)
+        return {'items': items, 'continuationToken': continuation}
+
+    def detail(self, _query, workitem_id):
+        """ Returns the detail of a work item """
+        return {'workItemId': workitem_id, 'description': f"Detail of {workitem_id}",
+                'properties': {'site': {'id': "site-1"}, 'charge': 233}}
+
+    def history(self, _query, workitem_id):
+        """ Returns the history stages of a work item """
+        return {'workItemId': workitem_id, 'stages': [
+            {'stageType': "Working", 'transition': {
+                'transitionedAt': modified_at(stage), 'receivedAt': modified_at(stage)}}
+            for stage in range(self.volumes['stages'])]}
+
+    def activities(self, _query, workitem_id):
+        """ Returns the activities of a work item """
+        return [{'activityId': f"{workitem_id}-activity-{i}", 'createdOn': modified_at(i),
+                 'fieldValues': {'note': f"Activity {i}"}}
+                for i in range(self.volumes['activities'])]
+
+    def appointments(self, query):
+        """ Returns a page of the appointments of the users searched """
+        appointments = [{'appointmentId': f"{user_id}-appointment-{i}", 'userId': user_id,
+                         'start': modified_at(i), 'end': modified_at(i + 60)}
+                        for user_id in query.get('userIds') or []
+                        for i in range(self.volumes['appointments'])]
+        appointments, continuation = page(appointments, query.get('continuationToken'),
+                                          self.page_size)
+        return {'appointments': appointments, 'continuationToken': continuation}
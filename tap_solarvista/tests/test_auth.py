@@ -0,0 +1,76 @@
+""" Test auth package """
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from tap_solarvista import auth
+from tap_solarvista import context
+
+class TestAuth(unittest.TestCase):
+    """ Test class for auth package """
+
+    def setUp(self):
+        """ Setup the test objects and helpers """
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+        self.config = {'account': 'mock-account-id', 'clientId': 'mock-client-id'}
+
+    def test_auth_personal_access_token(self):
+        """ Test a configured token without an expiry is used until it is rejected """
+        self.config['personal_access_token'] = "mock-pat"
+        self.assertEqual(auth.current_token(self.config), "mock-pat")
+        auth.invalidate(self.config, "mock-other-token")
+        self.assertEqual(auth.current_token(self.config), "mock-pat")
+        auth.invalidate(self.config, "mock-pat")
+        self.assertIsNone(auth.current_token(self.config))
+
+    def test_auth_refresh_before_expiry(self):
+        """ Test a token is refreshed once it expires within the refresh margin """
+        auth.store_token(self.config, {'access_token': "mock-token-1", 'expires_in': 3600})
+        self.assertEqual(auth.current_token(self.config), "mock-token-1")
+        auth.EXPIRES_AT["mock-token-1"] = time.time() + 30
+        self.assertIsNone(auth.current_token(self.config))
+        self.assertNotIn('personal_access_token', self.config)
+
+    def test_auth_short_lived_token(self):
+        """ Test a token expiring within the refresh margin is used for half its life """
+        auth.store_token(self.config, {'access_token': "mock-token-1", 'expires_in': 30})
+        self.assertEqual(auth.current_token(self.config), "mock-token-1")
+        self.assertEqual(auth.current_token(self.config), "mock-token-1")
+        auth.EXPIRES_AT["mock-token-1"] = time.time() + 10
+        self.assertIsNone(auth.current_token(self.config))
+        self.assertNotIn("mock-token-1", auth.REFRESH_MARGINS)
+
+    def test_auth_token_cache(self):
+        """ Test a token cached by a previous run is reused by the same account and client """
+        self.config['token_cache_path'] = os.path.join(self.cache_dir, 'token.json')
+        self.assertIsNone(auth.cached_token(self.config))
+        auth.store_token(dict(self.config),
+                         {'access_token': "mock-token-1", 'expires_in': 3600})
+
+        self.assertEqual(auth.cached_token(dict(self.config, clientId='mock-other')), None)
+        self.assertEqual(auth.cached_token(self.config), "mock-token-1")
+        self.assertEqual(self.config['personal_access_token'], "mock-token-1")
+
+    def test_auth_token_cache_expired(self):
+        """ Test a cached token about to expire is not reused """
+        self.config['token_cache_path'] = os.path.join(self.cache_dir, 'token.json')
+        auth.store_token(dict(self.config), {'access_token': "mock-token-1", 'expires_in': 30})
+        self.assertIsNone(auth.cached_token(self.config))
+        self.config['token_refresh_margin'] = 0
+        self.assertEqual(auth.cached_token(self.config), "mock-token-1")
+        self.assertGreater(auth.EXPIRES_AT["mock-token-1"], time.time())
+
+    def test_auth_token_lock(self):
+        """ Test each account fetches its token under its own lock """
+        account_context = context.AccountContext({'account': 'mock-account-2'})
+        with auth.token_lock():
+            account_lock = context.run(account_context, auth.token_lock)
+            self.assertTrue(account_lock.acquire(blocking=False))
+            account_lock.release()
+        self.assertIs(auth.token_lock(), context.DEFAULT.token_lock)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+""" Test benchmark package """
+import unittest
+from tap_solarvista.tests import benchmark
+from tap_solarvista.tests.fake_server import FakeSolarvista
+
+class TestBenchmark(unittest.TestCase):
+    """ Test class for benchmark package """
+
+    def test_benchmark_scenario(self):
+        """ Test a scenario syncs every generated row from the fake server """
+        with FakeSolarvista({'rows': 10}, page_size=4, latency=0) as server:
+            result = benchmark.run_scenario(server, 'customer')
+        self.assertEqual(result['records'], {'customer_stream': 10})
+        # one token request and three pages
+        self.assertEqual(result['requests'], 4)
+        self.assertGreater(result['records_per_second'], 0)
+        self.assertGreater(result['peak_rss_mb'], 0)
+
+    def test_benchmark_import(self):
+        """ Test importing the tap, or discovering, leaves the sync and http modules unloaded """
+        for statement in ["import tap_solarvista",
+                          "import tap_solarvista; tap_solarvista.catalog.discover({})"]:
+            modules = benchmark.imported_modules(statement)
+            self.assertIn('tap_solarvista.catalog', modules)
+            for lazy_module in ['pkg_resources', 'tap_solarvista.sync',
+                                'tap_solarvista.session', 'cProfile']:
+                self.assertNotIn(lazy_module, modules, statement)
+        self.assertGreater(benchmark.run_import(runs=1)['import_seconds'], 0)
+
+    def test_benchmark_regressions(self):
+        """ Test only scenarios slower than the baseline beyond the tolerance regress """
+        baseline = [{'scenario': 'customer', 'records_per_second': 100.0},
+                    {'scenario': 'users', 'records_per_second': 100.0}]
+        results = [{'scenario': 'customer', 'records_per_second': 85.0},
+                   {'scenario': 'users', 'records_per_second': 75.0},
+                   {'scenario': 'appointment', 'records_per_second': 1.0},
+                   {'scenario': 'import', 'import_seconds': 0.3}]
+        baseline.append({'scenario': 'import', 'import_seconds': 0.2})
+        self.assertEqual(benchmark.check_regressions(results, baseline, 0.2),
+                         ["users: 75.0 records/sec, baseline 100.0",
+                          "import: 0.3 seconds, baseline 0.2"])
+
+
+if __name__ == '__main__':
+    unittest.main()
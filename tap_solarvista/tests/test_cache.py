@@ -0,0 +1,54 @@
+""" Test cache package """
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from tap_solarvista import cache
+
+class TestCache(unittest.TestCase):
+    """ Test class for cache package """
+
+    def setUp(self):
+        """ Setup the test objects and helpers """
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+
+    def test_cache_round_trip(self):
+        """ Test cached json is read back, creating missing directories """
+        path = os.path.join(self.cache_dir, 'nested', 'cache.json')
+        self.assertIsNone(cache.read_json(path))
+        cache.write_json(path, {'userIds': ['mock-user-id']})
+        self.assertEqual(cache.read_json(path), {'userIds': ['mock-user-id']})
+        self.assertEqual(os.listdir(os.path.dirname(path)), ['cache.json'])
+
+    def test_cache_ttl(self):
+        """ Test cached json older than the ttl is ignored """
+        path = os.path.join(self.cache_dir, 'cache.json')
+        cache.write_json(path, {'userIds': []})
+        an_hour_ago = time.time() - 3600
+        os.utime(path, (an_hour_ago, an_hour_ago))
+        self.assertIsNone(cache.read_json(path, 60))
+        self.assertEqual(cache.read_json(path, 7200), {'userIds': []})
+
+    def test_cache_unreadable(self):
+        """ Test a corrupt cache file is ignored """
+        path = os.path.join(self.cache_dir, 'cache.json')
+        with open(path, 'w', encoding='utf8') as file:
+            file.write('{"truncated":')
+        self.assertIsNone(cache.read_json(path))
+
+    def test_cache_prune(self):
+        """ Test the least recently used files beyond the max entries are removed """
+        for i in range(4):
+            cache.write_json(os.path.join(self.cache_dir, f'{i}.json'), {})
+            used = time.time() - 3600 + i
+            os.utime(os.path.join(self.cache_dir, f'{i}.json'), (used, used))
+        cache.touch(os.path.join(self.cache_dir, '0.json'))
+        cache.prune(self.cache_dir, 2)
+        self.assertEqual(sorted(os.listdir(self.cache_dir)), ['0.json', '3.json'])
+        cache.prune(os.path.join(self.cache_dir, 'missing'), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,8 @@
 """ Test catalog package """
+import argparse
 import unittest
 import singer
+import tap_solarvista
 from tap_solarvista import catalog
 
 LOGGER = singer.get_logger()
@@ -80,5 +82,33 @@ class TestCatalog(unittest.TestCase):
         key_props = [s.key_properties[0] for s in selected_streams]
         self.assertEqual(sorted(key_props), ['userId'])
 
+    def test_catalog_field_metadata(self):
+        """ Test the properties of a stream can be deselected, except its keys """
+        site_stream = self.catalog.get_stream('site_stream')
+        mdata = singer.metadata.to_map(site_stream.metadata)
+        self.assertTrue(singer.metadata.get(mdata, (), 'selected'))
+        self.assertEqual(singer.metadata.get(mdata, ('properties', 'reference'), 'inclusion'),
+                         'automatic')
+        self.assertEqual(singer.metadata.get(mdata, ('properties', 'lastModified'),
+                                             'inclusion'), 'automatic')
+        self.assertEqual(singer.metadata.get(mdata, ('properties', 'nickname'), 'inclusion'),
+                         'available')
+
+    def test_catalog_selected_only(self):
+        """ Test only the selected streams are discovered when selected_only """
+        local_catalog = catalog.discover(['customer', 'work-item'], selected_only=True)
+        self.assertEqual([s.tap_stream_id for s in local_catalog.streams],
+                         ['customer_stream', 'workitem_stream'])
+        self.assertTrue(all(s.is_selected() for s in local_catalog.streams))
+
+    def test_catalog_supplied(self):
+        """ Test a supplied catalog is synced instead of the configured datasources """
+        args = argparse.Namespace(catalog=self.catalog, config={'datasources': ['users']})
+        self.assertIs(tap_solarvista.sync_catalog(args), self.catalog)
+        args.catalog = None
+        self.assertEqual([s.tap_stream_id for s in tap_solarvista.sync_catalog(args).streams],
+                         ['users_stream'])
+
+
 if __name__ == '__main__':
     unittest.main()
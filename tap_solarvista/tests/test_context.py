@@ -0,0 +1,40 @@
+""" Test context package """
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from tap_solarvista import context
+
+class TestContext(unittest.TestCase):
+    """ Test class for context package """
+
+    def setUp(self):
+        """ Setup the test objects and helpers """
+        context.reset()
+
+    def test_context_mapping(self):
+        """ Test the mappings resolve to the context of the account being synced """
+        context.CONFIG['account'] = 'default-account'
+        account_context = context.AccountContext({'account': 'mock-account'}, {},
+                                                 context.root_state())
+        self.assertFalse(context.is_multi_account())
+        self.assertEqual(context.run(account_context, lambda: dict(context.CONFIG)),
+                         {'account': 'mock-account'})
+        self.assertEqual(context.CONFIG, {'account': 'default-account'})
+        self.assertIs(context.run(account_context, context.root_state), context.DEFAULT.state)
+
+    def test_context_bind(self):
+        """ Test functions bound to an account context keep it on executor threads """
+        account_context = context.AccountContext({'account': 'mock-account'})
+
+        def accounts_on_executor():
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                bound = list(executor.map(context.bind(lambda _: context.CONFIG.get('account')),
+                                          range(2)))
+                unbound = executor.submit(lambda: context.CONFIG.get('account')).result()
+            return bound, unbound, context.is_multi_account()
+
+        self.assertEqual(context.run(account_context, accounts_on_executor),
+                         (['mock-account', 'mock-account'], None, True))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+""" Test flatten package """
+import json
+import unittest
+from tap_solarvista import flatten
+
+def reference_flatten_json(unformated_json):
+    """ The original recursive flatten, the compiled flatten must match it exactly """
+    out = {}
+
+    def flatten_structure(json_structure, name=''):
+        if isinstance(json_structure, dict):
+            for element in json_structure:
+                flatten_structure(json_structure[element],
+                                  name + flatten.lower_first_character(element) + '_')
+        else:
+            out[name[:-1]] = json_structure
+
+    flatten_structure(unformated_json)
+    return out
+
+MOCK_RECORDS = [
+    {
+        "WorkItemId": "mock-workitem-id",
+        "currentStage": {"StageType": "Working", "lastTransitionTime": None},
+        "tags": ["Revisit", {"Nested": "not flattened"}],
+        "properties": {
+            "site": {"id": "GB-54778-S7"},
+            "Site": {"Id": "duplicate key after lowering"},
+            "price-inc-tax": False,
+            "empty": {},
+            "deep": {"er": {"still": {"value": 1.5}}},
+        },
+        "": {"": "empty keys"},
+        "properties_site_id": "collides with a flattened name",
+    },
+    {
+        "properties": {"unknown": {"key": "first seen on this record"}},
+        "WorkItemId": "mock-workitem-id-2",
+    },
+]
+
+class TestFlatten(unittest.TestCase):
+    """ Test class for flatten package """
+
+    def assert_flatten_identical(self, plan):
+        """ Assert every mock record flattens exactly as the original recursion """
+        for record in MOCK_RECORDS:
+            expected = reference_flatten_json(record)
+            actual = flatten.flatten_json(record, plan)
+            self.assertEqual(json.dumps(actual), json.dumps(expected))
+
+    def test_flatten_generic(self):
+        """ Test flatten without a stream plan matches the original output byte for byte """
+        self.assert_flatten_identical(None)
+        self.assertEqual(flatten.flatten_json("value"), reference_flatten_json("value"))
+
+    def test_flatten_compiled_plan(self):
+        """ Test flatten with a plan compiled from schema names matches the original """
+        plan = flatten.compile_plan(['workItemId', 'currentStage_stageType',
+                                     'properties_site_id', 'properties_price-inc-tax'])
+        self.assertEqual(plan['properties'][2]['site'][2]['id'][0], 'properties_site_id')
+        self.assert_flatten_identical(plan)
+        # keys unknown to the schema are memoized once seen
+        self.assertIn('unknown', plan['properties'][2])
+        self.assert_flatten_identical(plan)
+
+    def test_flatten_excluded(self):
+        """ Test properties excluded from a plan are left out, known or not """
+        plan = flatten.compile_plan(['workItemId', 'properties_site_id'],
+                                    ['properties_site_id', 'properties_unknown_key'])
+        for record in MOCK_RECORDS:
+            expected = reference_flatten_json(record)
+            expected.pop('properties_site_id', None)
+            expected.pop('properties_unknown_key', None)
+            self.assertEqual(flatten.flatten_json(record, plan), expected)
+
+    def test_flatten_plan_bounded(self):
+        """ Test the memoized keys of an object are bounded """
+        plan = flatten.new_plan()
+        record = {f"Key{i}": i for i in range(flatten.MAX_PLAN_KEYS + 10)}
+        self.assertEqual(flatten.flatten_json(record, plan), reference_flatten_json(record))
+        self.assertEqual(len(plan), flatten.MAX_PLAN_KEYS)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+""" Test httpmetrics package """
+import unittest
+from tap_solarvista import httpmetrics
+from tap_solarvista.tests.utils import SINGER_METRICS
+
+MOCK_API = "https://api.solarvista.com"
+
+class TestHttpMetrics(unittest.TestCase):
+    """ Test class for httpmetrics package """
+
+    def setUp(self):
+        """ Setup the test objects and helpers """
+        del SINGER_METRICS[:]
+        httpmetrics.reset()
+
+    def test_httpmetrics_endpoint_family(self):
+        """ Test each Solarvista uri maps to its endpoint family """
+        uris = {
+            "https://auth.solarvista.com/connect/token": 'auth',
+            f"{MOCK_API}/datagateway/v3/account/datasources/ref/site/data/query":
+                'datasource_query',
+            f"{MOCK_API}/workflow/v4/account/workItems/search": 'workitem_search',
+            f"{MOCK_API}/workflow/v4/account/workItems/id/wi-1/history": 'workitem_history',
+            f"{MOCK_API}/workflow/v4/account/workItems/id/wi-1": 'workitem_detail',
+            f"{MOCK_API}/activity/v2/account/activities/context/wi-1": 'activity',
+            f"{MOCK_API}/calendar/v2/account/appointments/search/users": 'appointments',
+            f"{MOCK_API}/unknown": 'other',
+        }
+        for uri, endpoint in uris.items():
+            self.assertEqual(httpmetrics.endpoint_family(uri), endpoint, uri)
+
+    def test_httpmetrics_summary(self):
+        """ Test the summary aggregates every request of an endpoint in latency buckets """
+        uri = f"{MOCK_API}/workflow/v4/account/workItems/id/wi-1"
+        httpmetrics.record(uri, 200, 0.05, 100)
+        httpmetrics.record(uri, 200, 0.3, 200, retries=2)
+        httpmetrics.record(uri, None, 45.0)
+        self.assertEqual(len(SINGER_METRICS), 3)
+        self.assertEqual(SINGER_METRICS[2].tags['status'], 'failed')
+
+        with self.assertLogs(httpmetrics.LOGGER, 'INFO') as logs:
+            httpmetrics.log_summary()
+        self.assertIn("HTTP workitem_detail: 3 requests, 1 failed, 2 retries, 300 bytes",
+                      logs.output[0])
+        summary = SINGER_METRICS[3]
+        self.assertEqual(summary.value, 3)
+        self.assertEqual(summary.tags['buckets']['le_0.1'], 1)
+        self.assertEqual(summary.tags['buckets']['le_0.5'], 1)
+        self.assertEqual(summary.tags['buckets']['le_inf'], 1)
+        self.assertEqual(summary.tags['statuses'], {'200': 2, 'None': 1})
+        self.assertEqual(httpmetrics.percentile(httpmetrics.STATS['workitem_detail'], 0.5),
+                         0.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
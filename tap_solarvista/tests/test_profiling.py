@@ -0,0 +1,90 @@
+""" Test profiling package """
+import cProfile
+import json
+import os
+import pstats
+import shutil
+import tempfile
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+from tap_solarvista import profiling
+
+class TestProfiling(unittest.TestCase):
+    """ Test class for profiling package """
+
+    def setUp(self):
+        """ Setup the test objects and helpers """
+        self.profile_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.profile_dir)
+        self.addCleanup(profiling.configure, {})
+
+    def test_profiling_disabled(self):
+        """ Test nothing is timed or written unless a 'profile_dir' is configured """
+        profiling.configure({})
+        with profiling.stream('mock_stream'), profiling.phase('fetch'):
+            pass
+        profiling.dump()
+        self.assertEqual(profiling.TIMES, {})
+        self.assertIsNone(profiling.SAMPLER['thread'])
+
+    def test_profiling_streams(self):
+        """ Test phases on executor threads are attributed to the stream that bound them """
+        profiling.configure({'profile_dir': self.profile_dir, 'profile_interval': 0.001})
+
+        def fetch_child(_):
+            with profiling.phase('fetch'):
+                time.sleep(0.01)
+
+        with profiling.stream('mock_stream'), ThreadPoolExecutor(max_workers=2) as executor:
+            list(executor.map(profiling.bind(fetch_child), range(4)))
+            with profiling.phase('write'):
+                sum(range(10000))
+        with profiling.phase('state'):
+            pass
+        profiling.dump()
+
+        with open(os.path.join(self.profile_dir, 'phases.json'), encoding='utf8') as file:
+            phases = json.load(file)
+        self.assertEqual(sorted(phases), ['mock_stream', 'run'])
+        self.assertEqual(phases['mock_stream']['fetch']['calls'], 4)
+        # sleeping waits without using the cpu
+        self.assertGreater(phases['mock_stream']['fetch']['wall_seconds'],
+                           phases['mock_stream']['fetch']['cpu_seconds'])
+        self.assertEqual(phases['mock_stream']['write']['calls'], 1)
+        self.assertEqual(phases['run']['state']['calls'], 1)
+
+        stats = pstats.Stats(os.path.join(self.profile_dir, 'mock_stream.pstats'))
+        self.assertIn('fetch_child', [function for _, _, function in stats.stats])
+        with open(os.path.join(self.profile_dir, 'wallclock.collapsed'),
+                  encoding='utf8') as file:
+            stacks = file.read().splitlines()
+        self.assertTrue(any(stack.startswith('mock_stream;') for stack in stacks))
+
+    def test_profiling_active_profiler(self):
+        """ Test a stream is only timed when another profiler is already active,
+            as from python 3.12 """
+        profiling.configure({'profile_dir': self.profile_dir})
+
+        class ActiveProfile(cProfile.Profile): # pylint: disable=too-few-public-methods
+            """ A profile that cannot be enabled, another profiler being active """
+            def enable(self, *args, **kwargs):
+                raise ValueError("Another profiling tool is already active")
+
+        with patch.object(cProfile, 'Profile', ActiveProfile):
+            with profiling.stream('mock_stream'), profiling.phase('fetch'):
+                pass
+        profiling.dump()
+
+        with open(os.path.join(self.profile_dir, 'phases.json'), encoding='utf8') as file:
+            self.assertEqual(json.load(file)['mock_stream']['fetch']['calls'], 1)
+        self.assertFalse(os.path.exists(os.path.join(self.profile_dir, 'mock_stream.pstats')))
+        self.assertFalse(profiling.LOCAL.active)
+
+
+if __name__ == '__main__':
+    unittest.main()
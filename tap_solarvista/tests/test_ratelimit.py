@@ -0,0 +1,75 @@
+""" Test ratelimit package """
+import email.utils
+import time
+import unittest
+import singer
+from tap_solarvista import ratelimit
+from tap_solarvista.tests.utils import SINGER_METRICS
+
+class TestRateLimit(unittest.TestCase):
+    """ Test class for ratelimit package """
+
+    def setUp(self):
+        """ Setup the test objects and helpers """
+        del SINGER_METRICS[:]
+        self.limiter = ratelimit.RateLimiter(10, 1, 100, 5)
+
+    def test_ratelimit_token_bucket(self):
+        """ Test requests burst up to the rate, then wait for the bucket to refill """
+        delays = [self.limiter.reserve() for _ in range(12)]
+        self.assertEqual(delays[:10], [0.0] * 10)
+        self.assertAlmostEqual(delays[10], 0.1, places=2)
+        self.assertAlmostEqual(delays[11], 0.2, places=2)
+
+    def test_ratelimit_additive_increase(self):
+        """ Test the rate increases while requests complete within the target latency """
+        for _ in range(10):
+            self.limiter.completed(0.5)
+        self.assertAlmostEqual(self.limiter.rate, 11, places=0)
+        self.assertEqual(SINGER_METRICS, [])
+
+    def test_ratelimit_multiplicative_decrease(self):
+        """ Test throttling halves the rate once for the requests in flight, down to the min """
+        self.limiter.throttled()
+        self.limiter.throttled()
+        self.assertEqual(self.limiter.rate, 5)
+        self.limiter.decreased -= ratelimit.DECREASE_INTERVAL
+        self.limiter.completed(30)
+        self.assertEqual(self.limiter.rate, 2.5)
+        for _ in range(5):
+            self.limiter.decreased -= ratelimit.DECREASE_INTERVAL
+            self.limiter.throttled()
+        self.assertEqual(self.limiter.rate, 1)
+
+        self.assertEqual(len(SINGER_METRICS), 7)
+        self.assertIsInstance(SINGER_METRICS[0], singer.metrics.Point)
+        self.assertEqual(SINGER_METRICS[0].metric, 'http_request_rate')
+        self.assertEqual(SINGER_METRICS[0].value, 5)
+
+    def test_ratelimit_retry_after(self):
+        """ Test every request waits for the 'Retry-After' seconds """
+        self.limiter.throttled(30)
+        self.assertAlmostEqual(self.limiter.reserve(), 30, places=1)
+        self.assertAlmostEqual(self.limiter.reserve(), 30, places=1)
+
+    def test_ratelimit_parse_retry_after(self):
+        """ Test 'Retry-After' headers in seconds and http date form """
+        self.assertIsNone(ratelimit.parse_retry_after(None))
+        self.assertIsNone(ratelimit.parse_retry_after("soon"))
+        self.assertEqual(ratelimit.parse_retry_after(" 3 "), 3)
+        self.assertEqual(ratelimit.parse_retry_after("86400"), ratelimit.MAX_RETRY_AFTER)
+        retry_date = email.utils.formatdate(time.time() + 60, usegmt=True)
+        self.assertAlmostEqual(ratelimit.parse_retry_after(retry_date), 60, delta=2)
+
+    def test_ratelimit_disabled(self):
+        """ Test a 'rate_limit' of 0 disables rate limiting """
+        ratelimit.configure({'rate_limit': 0})
+        self.assertIsNone(ratelimit.LIMITER)
+        self.assertEqual(ratelimit.reserve(), 0.0)
+        ratelimit.configure({'rate_limit': 5, 'rate_limit_max': 8})
+        self.assertEqual(ratelimit.LIMITER.rate, 5)
+        self.assertEqual(ratelimit.LIMITER.max_rate, 8)
+
+
+if __name__ == '__main__':
+    unittest.main()
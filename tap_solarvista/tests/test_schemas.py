@@ -12,6 +12,15 @@ class TestSchemas(unittest.TestCase):
         self.assertEqual('value_with_underscore',
                          schemas.extract_datasource('value_with_underscore_stream'))
 
+    def test_load_schemas_selected(self):
+        """ Test only the requested schemas are loaded, each file parsed once """
+        schemas.SCHEMA_CACHE.clear()
+        loaded = schemas.load_schemas(['site_stream'])
+        self.assertEqual(list(loaded), ['site_stream'])
+        self.assertEqual(list(schemas.SCHEMA_CACHE), ['site_stream'])
+        self.assertIsNot(schemas.load_schema('site_stream'), loaded['site_stream'])
+        self.assertIn('work-item_stream', schemas.list_stream_ids())
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,62 @@
+""" Test session package """
+import unittest
+from tap_solarvista import session
+
+class TestSession(unittest.TestCase):
+    """ Test class for session package """
+
+    def setUp(self):
+        """ Setup the test objects and helpers """
+        session.close_session()
+
+    def tearDown(self):
+        """ Release the pooled session between tests """
+        session.close_session()
+
+    def test_session_reused(self):
+        """ Test the same pooled session is returned for every call """
+        first = session.get_session({})
+        second = session.get_session({'pool_maxsize': 50})
+        self.assertIs(first, second)
+        session.close_session()
+        self.assertIsNot(first, session.get_session({}))
+
+    def test_session_resized(self):
+        """ Test the session is only recreated when a larger pool is needed """
+        first = session.get_session({'max_concurrency': 20})
+        self.assertIs(session.resize_session({'max_concurrency': 5}), first)
+        resized = session.resize_session({'max_concurrency': 40})
+        self.assertIsNot(resized, first)
+        adapter = resized.get_adapter("https://api.solarvista.com")
+        self.assertEqual(adapter._pool_maxsize, 40) # pylint: disable=protected-access
+        self.assertIs(session.get_session({}), resized)
+
+    def test_session_pool_config(self):
+        """ Test the pool size, timeout and retries are configurable """
+        http = session.create_session({
+            'pool_connections': 4,
+            'pool_maxsize': 32,
+            'request_timeout': 60,
+        })
+        adapter = http.get_adapter("https://api.solarvista.com")
+        self.assertEqual(adapter._pool_connections, 4) # pylint: disable=protected-access
+        self.assertEqual(adapter._pool_maxsize, 32) # pylint: disable=protected-access
+        self.assertEqual(adapter.timeout, 60)
+        self.assertEqual(adapter.max_retries.total, 6)
+        self.assertIn(429, adapter.max_retries.status_forcelist)
+        self.assertEqual(http.headers['Connection'], 'keep-alive')
+
+    def test_session_pool_fits_concurrency(self):
+        """ Test the pool is large enough for the configured concurrency """
+        http = session.create_session({'max_concurrency': 24})
+        adapter = http.get_adapter("https://api.solarvista.com")
+        self.assertEqual(adapter._pool_maxsize, 24) # pylint: disable=protected-access
+
+    def test_session_keep_alive_disabled(self):
+        """ Test keep alive can be disabled """
+        http = session.create_session({'keep_alive': 'false'})
+        self.assertEqual(http.headers['Connection'], 'close')
+
+
+if __name__ == '__main__':
+    unittest.main()
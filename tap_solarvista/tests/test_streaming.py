@@ -0,0 +1,59 @@
+""" Test streaming package """
+import io
+import json
+import unittest
+from tap_solarvista import streaming
+
+class MockResponse: # pylint: disable=too-few-public-methods
+    """ Streamed response with a raw body """
+
+    def __init__(self, data):
+        """ Constructor with the json data of the body """
+        self.raw = io.BytesIO(json.dumps(data).encode('utf-8'))
+        self.closed = False
+
+    def close(self):
+        """ Close the response """
+        self.closed = True
+
+@unittest.skipIf(streaming.ijson is None, "streaming requires ijson")
+class TestStreaming(unittest.TestCase):
+    """ Test class for streaming package """
+
+    def test_streamed_page_rows(self):
+        """ Test rows are parsed one at a time and the continuation is read after them """
+        response = MockResponse({
+            'rows': [
+                {'rowData': {'reference': 'mock-1', 'charge': 233.5, 'tags': ['a', 'b'],
+                             'site': {'id': 'GB-1', 'equipment': [{'id': 1}]}}},
+                {'rowData': {'reference': 'mock-2', 'charge': None}, 'lastModified': 'mock'},
+            ],
+            'continuationToken': 'moredata',
+        })
+        page = streaming.StreamedPage(response)
+        self.assertIsNone(page['continuationToken'])
+        rows = page['rows']
+        self.assertEqual(next(rows), {'rowData': {
+            'reference': 'mock-1', 'charge': 233.5, 'tags': ['a', 'b'],
+            'site': {'id': 'GB-1', 'equipment': [{'id': 1}]}}})
+        self.assertFalse(response.closed)
+        self.assertEqual(list(rows), [
+            {'rowData': {'reference': 'mock-2', 'charge': None}, 'lastModified': 'mock'}])
+        self.assertEqual(page['continuationToken'], 'moredata')
+        self.assertTrue(response.closed)
+
+    def test_streamed_page_transform(self):
+        """ Test items of another array are transformed to rows """
+        page = streaming.StreamedPage(MockResponse({
+            'continuationToken': None,
+            'appointments': [{'appointmentId': 'mock-1'}, {'appointmentId': 'mock-2'}],
+        }), 'appointments').with_rows(lambda item: {'rowData': item})
+        self.assertEqual(streaming.materialize(page), {
+            'continuationToken': None,
+            'rows': [{'rowData': {'appointmentId': 'mock-1'}},
+                     {'rowData': {'appointmentId': 'mock-2'}}]
+        })
+
+
+if __name__ == '__main__':
+    unittest.main()
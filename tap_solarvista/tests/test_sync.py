@@ -1,4 +1,4 @@
-# pylint: disable=too-many-lines
+# pylint: disable=too-many-lines,too-many-public-methods
 """ Test sync package """
 import unittest
 try:
@@ -7,28 +7,25 @@ except ImportError:
     #from mock import patch
     from mock import patch
 import json
+import os
+import shutil
+import tempfile
+import time
 from datetime import datetime
 import dateutil.relativedelta
 import dateutil.parser
 import responses
 import singer
 import tap_solarvista
+import tap_solarvista.sync
 import tap_solarvista.tests.utils as test_utils
+from tap_solarvista import auth
 from tap_solarvista import catalog
+from tap_solarvista import context
 
-LOGGER = singer.get_logger()
-
-SINGER_MESSAGES = []
-def accumulate_singer_messages(message):
-    """ function to collect singer library write_message in tests """
-    SINGER_MESSAGES.append(message)
-singer.messages.write_message = accumulate_singer_messages
+from tap_solarvista.tests.utils import SINGER_MESSAGES, SINGER_METRICS
 
-SINGER_METRICS = []
-def accumulate_singer_metrics(_logger, point):
-    """ function to collect singer library metrics in tests """
-    SINGER_METRICS.append(point)
-singer.metrics.log = accumulate_singer_metrics
+LOGGER = singer.get_logger()
 
 
 MOCK_TOKEN = {
@@ -75,8 +72,7 @@ class TestSync(unittest.TestCase):
         self.catalog = test_utils.discover_catalog('site')
         del SINGER_MESSAGES[:]  # prefer SINGER_MESSAGES.clear(), only available on python3
         del SINGER_METRICS[:]
-        tap_solarvista.sync.CONFIG = {}
-        tap_solarvista.sync.STATE = {}
+        context.reset()
         responses.reset()
 
     def test_start_date(self):
@@ -85,14 +81,14 @@ class TestSync(unittest.TestCase):
         mock_start_date_config = {
             'start_date': '2021-07-22T08:00:00Z',
         }
-        tap_solarvista.sync.CONFIG = mock_start_date_config
+        tap_solarvista.sync.CONFIG.update(mock_start_date_config)
         actual_start_date = tap_solarvista.sync.get_start(mock_entity)
         self.assertEqual(actual_start_date, '2021-07-22T08:00:00Z')
         mock_force_start_date_config = {
             'start_date': '2021-07-22T08:00:00Z',
             'force_start_date': '2020-01-01T08:00:00Z',
         }
-        tap_solarvista.sync.CONFIG = mock_force_start_date_config
+        tap_solarvista.sync.CONFIG.update(mock_force_start_date_config)
         actual_start_date = tap_solarvista.sync.get_start(mock_entity)
         self.assertEqual(actual_start_date, '2020-01-01T08:00:00Z')
 
@@ -181,6 +177,102 @@ class TestSync(unittest.TestCase):
         self.assertIsInstance(SINGER_MESSAGES[2], singer.StateMessage)
 
 
+    @responses.activate  # intercept HTTP calls within this method
+    def test_sync_refresh_token_before_expiry(self):
+        """ Test sync refreshes a token about to expire without waiting for a 401 """
+        mock_config = {
+            'account': 'mock-account-id'
+        }
+        token_uri = "https://auth.solarvista.com/connect/token"
+        site_uri = ("https://api.solarvista.com/datagateway/v3/mock-account-id"
+            + "/datasources/ref/site/data/query")
+        responses.add(responses.POST, token_uri, json=dict(MOCK_TOKEN, expires_in=30))
+        responses.add(responses.POST, token_uri,
+                      json=dict(MOCK_TOKEN, access_token="mock-token-2"))
+        responses.add(responses.POST, site_uri, json={'rows': []})
+        responses.add(responses.POST, site_uri, json={'rows': []})
+
+        tap_solarvista.sync.sync_all_data(mock_config, {}, self.catalog)
+        self.assertEqual(tap_solarvista.sync.CONFIG['personal_access_token'],
+                         MOCK_TOKEN['access_token'])
+        # the short lived token is refreshed once it is past half its life
+        auth.EXPIRES_AT[MOCK_TOKEN['access_token']] = time.time() + 10
+        tap_solarvista.sync.sync_all_data(mock_config, {}, self.catalog)
+        self.assertEqual(tap_solarvista.sync.CONFIG['personal_access_token'], "mock-token-2")
+        self.assertEqual([call.response.status_code for call in responses.calls],
+                         [200, 200, 200, 200])
+        self.assertEqual(responses.calls[3].request.headers['Authorization'],
+                         "Bearer mock-token-2")
+
+    @responses.activate  # intercept HTTP calls within this method
+    def test_sync_throttled(self):
+        """ Test a throttled request is retried and reduces the request rate """
+        mock_config = {
+            'account': 'mock-account-id',
+            'personal_access_token': "mock-token", # disables get_access_token call
+        }
+        site_uri = ("https://api.solarvista.com/datagateway/v3/mock-account-id"
+            + "/datasources/ref/site/data/query")
+        responses.add(responses.POST, site_uri, status=429, headers={'Retry-After': "0"})
+        responses.add(responses.POST, site_uri, json={'rows': []})
+
+        tap_solarvista.sync.sync_all_data(mock_config, {}, self.catalog)
+        self.assertEqual(len(responses.calls), 2)
+        rate_metrics = [point.value for point in SINGER_METRICS
+                        if point.metric == 'http_request_rate']
+        self.assertEqual(rate_metrics, [tap_solarvista.ratelimit.DEFAULT_RATE_LIMIT / 2])
+
+    @responses.activate  # intercept HTTP calls within this method
+    def test_sync_http_metrics(self):
+        """ Test each request is timed by endpoint with its retries, then summarised """
+        mock_config = {
+            'account': 'mock-account-id',
+            'personal_access_token': "mock-token", # disables get_access_token call
+        }
+        site_uri = ("https://api.solarvista.com/datagateway/v3/mock-account-id"
+            + "/datasources/ref/site/data/query")
+        responses.add(responses.POST, site_uri, status=503, headers={'Retry-After': "0"})
+        responses.add(responses.POST, site_uri, json={'rows': []})
+
+        tap_solarvista.sync.sync_all_data(mock_config, {}, self.catalog)
+        timers = [point for point in SINGER_METRICS
+                  if point.metric == 'http_request_duration']
+        self.assertEqual(len(timers), 1)
+        self.assertEqual(timers[0].tags['endpoint'], 'datasource_query')
+        self.assertEqual(timers[0].tags['http_status_code'], 200)
+        self.assertEqual(timers[0].tags['status'], 'succeeded')
+        self.assertEqual(timers[0].tags['retries'], 1)
+        self.assertEqual(timers[0].tags['bytes'], len(b'{"rows": []}'))
+        summary = [point for point in SINGER_METRICS if point.metric == 'http_request_latency']
+        self.assertEqual([(point.value, point.tags['endpoint']) for point in summary],
+                         [(1, 'datasource_query')])
+
+    @responses.activate  # intercept HTTP calls within this method
+    def test_sync_profile(self):
+        """ Test the phases of each stream are profiled when a 'profile_dir' is configured """
+        profile_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, profile_dir)
+        self.addCleanup(tap_solarvista.profiling.configure, {})
+        mock_config = {
+            'account': 'mock-account-id',
+            'personal_access_token': "mock-token", # disables get_access_token call
+            'profile_dir': profile_dir,
+        }
+        responses.add(
+            responses.POST,
+            "https://api.solarvista.com/datagateway/v3/mock-account-id"
+                + "/datasources/ref/site/data/query",
+            json={'rows': [{"rowData": {"reference": "GB-83320-S7"}}]},
+        )
+        tap_solarvista.sync.sync_all_data(mock_config, {}, self.catalog)
+
+        with open(os.path.join(profile_dir, 'phases.json'), encoding='utf8') as file:
+            phases = json.load(file)
+        self.assertEqual(sorted(phases['site_stream']),
+                         ['decode', 'fetch', 'flatten', 'state', 'write'])
+        self.assertTrue(os.path.exists(os.path.join(profile_dir, 'site_stream.pstats')))
+        self.assertTrue(os.path.exists(os.path.join(profile_dir, 'wallclock.collapsed')))
+
     @responses.activate  # intercept HTTP calls within this method
     def test_sync_reuse_token(self):
         """ Test sync requests refresh token """
@@ -862,12 +954,6 @@ class TestSync(unittest.TestCase):
                 + "/datasources/ref/users/data/query",
             json=mock_user_data,
         )
-        responses.add(
-            responses.POST,
-            "https://api.solarvista.com/datagateway/v3/mock-account-id"
-                + "/datasources/ref/users/data/query",
-            json=mock_user_data,
-        )
         mock_user_appointment_data = {
             "appointments": [
                 {
@@ -893,8 +979,9 @@ class TestSync(unittest.TestCase):
         )
 
         tap_solarvista.sync.sync_all_data(mock_config, mock_state, self.catalog)
-        self.assertEqual(len(responses.calls), 3,
-                         "Expecting 3 calls 2 to users and 1 to appointments")
+        self.assertEqual(len(responses.calls), 2,
+                         "Expecting 2 calls 1 to users, reused by appointments, "
+                         "and 1 to appointments")
         appointments_response = next((call for call in responses.calls
                     if call.request.url == "https://api.solarvista.com/calendar/v2/mock-account-id"
                          + "/appointments/search/users"), None)
@@ -1123,5 +1210,780 @@ class TestSync(unittest.TestCase):
         self.assertEqual(expected_records, [x.asdict()['record'] for x in record_messages])
 
 
+    @responses.activate  # intercept HTTP calls within this method
+    def test_sync_workitem_children_concurrent(self):
+        """ Test concurrent child requests still write records in work item order """
+        self.catalog = catalog.discover(['work-item', 'work-item-history', 'activity'])
+        mock_config = {
+            'account': 'mock-account-id',
+            'personal_access_token': "mock-token", # disables get_access_token call
+            'start_date': "2020-05-14T14:14:14.455852+00:00",
+            'max_concurrency': 4,
+        }
+        workitem_ids = [f"mock-workitem-id-{i}" for i in range(6)]
+        responses.add(
+            responses.POST,
+            "https://api.solarvista.com/workflow/v4/mock-account-id"
+                + "/workItems/search",
+            json={'items': [{"workItemId": workitem_id,
+                             "lastModified": f"2020-12-01T12:26:2{i}+00:00"}
+                            for i, workitem_id in enumerate(workitem_ids)]},
+        )
+        for workitem_id in workitem_ids:
+            responses.add(
+                responses.GET,
+                "https://api.solarvista.com/workflow/v4/mock-account-id"
+                    + f"/workItems/id/{workitem_id}/history",
+                json={"workItemId": workitem_id, "stages": [{"stageType": "Unassigned"}]},
+            )
+            responses.add(
+                responses.GET,
+                "https://api.solarvista.com/activity/v2/mock-account-id"
+                    + f"/activities/context/{workitem_id}",
+                json=[{"activityId": workitem_id}],
+            )
+
+        tap_solarvista.sync.sync_all_data(mock_config, {}, self.catalog)
+        self.assertEqual(len(responses.calls), 13)
+
+        messages = [m for m in SINGER_MESSAGES if not isinstance(m, singer.SchemaMessage)]
+        self.assertEqual(len(messages), 20)
+        self.assertEqual([m.stream for m in messages[0:6]], ['workitemhistory_stream'] * 6)
+        self.assertEqual([m.record['workItemId'] for m in messages[0:6]], workitem_ids)
+        self.assertEqual([m.record['activityId'] for m in messages[6:12]], workitem_ids)
+        self.assertIsInstance(messages[12], singer.StateMessage)
+        self.assertEqual([m.record['workItemId'] for m in messages[13:19]], workitem_ids)
+        self.assertIsInstance(messages[19], singer.StateMessage)
+        self.assertEqual(messages[19].value,
+                         {'workitem_stream': "2020-12-01T12:26:25+00:00"})
+
+
+    @responses.activate  # intercept HTTP calls within this method
+    def test_sync_workitem_index(self):
+        """ Test the children of work items unchanged since the last run are not fetched """
+        self.catalog = catalog.discover(['work-item', 'work-item-history', 'activity'])
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        mock_config = {
+            'account': 'mock-account-id',
+            'personal_access_token': "mock-token", # disables get_access_token call
+            'start_date': "2020-05-14T14:14:14.455852+00:00",
+            'force_start_date': "2020-05-14T14:14:14.455852+00:00",
+            'workitem_index_path': os.path.join(cache_dir, 'workitems.json'),
+        }
+        search_uri = ("https://api.solarvista.com/workflow/v4/mock-account-id"
+            + "/workItems/search")
+        responses.add(responses.POST, search_uri, json={'items': [
+            {"workItemId": "mock-workitem-1", "lastModified": "2020-12-01T12:26:21+00:00"},
+            {"workItemId": "mock-workitem-2", "lastModified": "2020-12-01T12:26:22+00:00"},
+        ]})
+        responses.add(responses.POST, search_uri, json={'items': [
+            {"workItemId": "mock-workitem-1", "lastModified": "2020-12-01T12:26:21+00:00"},
+            {"workItemId": "mock-workitem-2", "lastModified": "2020-12-02T09:00:00+00:00"},
+        ]})
+        for workitem_id in ["mock-workitem-1", "mock-workitem-2"]:
+            responses.add(
+                responses.GET,
+                "https://api.solarvista.com/workflow/v4/mock-account-id"
+                    + f"/workItems/id/{workitem_id}/history",
+                json={"workItemId": workitem_id, "stages": [{"stageType": "Unassigned"}]},
+            )
+            responses.add(
+                responses.GET,
+                "https://api.solarvista.com/activity/v2/mock-account-id"
+                    + f"/activities/context/{workitem_id}",
+                json=[{"activityId": workitem_id}],
+            )
+
+        tap_solarvista.sync.sync_all_data(mock_config, {}, self.catalog)
+        self.assertEqual(len(responses.calls), 5)
+
+        del SINGER_MESSAGES[:]
+        tap_solarvista.sync.sync_all_data(mock_config, {}, self.catalog)
+        self.assertEqual([call.request.url for call in responses.calls[5:]], [
+            search_uri,
+            "https://api.solarvista.com/workflow/v4/mock-account-id"
+                + "/workItems/id/mock-workitem-2/history",
+            "https://api.solarvista.com/activity/v2/mock-account-id"
+                + "/activities/context/mock-workitem-2",
+        ])
+        records = [(m.stream, m.record.get('workItemId', m.record.get('activityId')))
+                   for m in SINGER_MESSAGES if isinstance(m, singer.RecordMessage)]
+        self.assertEqual(records, [
+            ('workitemhistory_stream', 'mock-workitem-2'),
+            ('activity_stream', 'mock-workitem-2'),
+            ('workitem_stream', 'mock-workitem-1'),
+            ('workitem_stream', 'mock-workitem-2'),
+        ])
+
+    @responses.activate  # intercept HTTP calls within this method
+    def test_sync_workitem_detail_cache(self):
+        """ Test work item detail is only fetched again once the work item changes """
+        self.catalog = catalog.discover(['work-item'])
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        mock_config = {
+            'account': 'mock-account-id',
+            'personal_access_token': "mock-token", # disables get_access_token call
+            'workitem_detail_enabled': True,
+            'workitem_detail_cache_dir': os.path.join(cache_dir, 'details'),
+            'workitem_detail_cache_size': 1,
+        }
+        workitems_uri = ("https://api.solarvista.com/datagateway/v3/mock-account-id"
+            + "/datasources/ref/work-item/data/query")
+        detail_uri = ("https://api.solarvista.com/workflow/v4/mock-account-id"
+            + "/workItems/id/" + MOCK_WORKITEM_DETAIL['workItemId'])
+        responses.add(responses.POST, workitems_uri, json={'rows': [{
+            "lastModified": MOCK_WORKITEM_DETAIL['lastModified'],
+            "rowData": {"workItemId": MOCK_WORKITEM_DETAIL['workItemId']}
+        }]})
+        responses.add(responses.GET, detail_uri, json=MOCK_WORKITEM_DETAIL)
+
+        tap_solarvista.sync.sync_all_data(mock_config, {}, self.catalog)
+        first_records = [m.record for m in SINGER_MESSAGES if isinstance(m, singer.RecordMessage)]
+        del SINGER_MESSAGES[:]
+        tap_solarvista.sync.sync_all_data(mock_config, {}, self.catalog)
+        records = [m.record for m in SINGER_MESSAGES if isinstance(m, singer.RecordMessage)]
+
+        self.assertEqual([call.request.url for call in responses.calls],
+                         [workitems_uri, detail_uri, workitems_uri])
+        self.assertEqual(records, first_records)
+        self.assertEqual(records[0]['reference'], "AP0002")
+        self.assertEqual(len(os.listdir(mock_config['workitem_detail_cache_dir'])), 1)
+
+    @responses.activate  # intercept HTTP calls within this method
+    def test_sync_parallel_streams(self):
+        """ Test independent datasource streams sync concurrently """
+        self.catalog = catalog.discover(['customer', 'equipment', 'site', 'territory'])
+        mock_config = {
+            'account': 'mock-account-id',
+            'personal_access_token': "mock-token", # disables get_access_token call
+            'parallel_streams': 4,
+        }
+        datasources = ['customer', 'equipment', 'site', 'territory']
+        for datasource in datasources:
+            responses.add(
+                responses.POST,
+                "https://api.solarvista.com/datagateway/v3/mock-account-id"
+                    + f"/datasources/ref/{datasource}/data/query",
+                json={'rows': [{"rowData": {"reference": f"{datasource}-{i}"}}
+                               for i in range(3)]},
+            )
+
+        tap_solarvista.sync.sync_all_data(mock_config, {}, self.catalog)
+        self.assertEqual(len(responses.calls), 4)
+        record_messages = [m for m in SINGER_MESSAGES if isinstance(m, singer.RecordMessage)]
+        self.assertEqual(sorted(m.record['reference'] for m in record_messages),
+                         sorted(f"{datasource}-{i}" for datasource in datasources
+                                for i in range(3)))
+        for datasource in datasources:
+            stream_records = [m.record['reference'] for m in record_messages
+                              if m.stream == f"{datasource}_stream"]
+            self.assertEqual(stream_records, [f"{datasource}-{i}" for i in range(3)])
+        state_messages = [m for m in SINGER_MESSAGES if isinstance(m, singer.StateMessage)]
+        self.assertEqual(len(state_messages), 4)
+
+
+    @responses.activate  # intercept HTTP calls within this method
+    def test_sync_streaming_json(self):
+        """ Test pages are parsed incrementally with 'streaming_json' """
+        if tap_solarvista.streaming.ijson is None:
+            self.skipTest("streaming requires ijson")
+        mock_config = {
+            'account': 'mock-account-id',
+            'personal_access_token': "mock-token", # disables get_access_token call
+            'streaming_json': 'true',
+        }
+        responses.add(
+            responses.POST,
+            "https://api.solarvista.com/datagateway/v3/mock-account-id"
+                + "/datasources/ref/site/data/query",
+            json={
+                'rows': [{"rowData": {"reference": "GB-83320-S7",
+                                      "address": {"postCode": "HP11 1AA"}}}],
+                'continuationToken': 'moredata',
+            },
+        )
+        responses.add(
+            responses.POST,
+            "https://api.solarvista.com/datagateway/v3/mock-account-id"
+                + "/datasources/ref/site/data/query",
+            json={'rows': [{"rowData": {"reference": "GB-83321-S7"},
+                            "lastModified": "2021-02-24T08:30:26+00:00"}]},
+        )
+
+        tap_solarvista.sync.sync_all_data(mock_config, {}, self.catalog)
+        self.assertEqual(len(responses.calls), 2)
+        self.assertEqual(json.loads(responses.calls[1].request.body),
+                         {"continuationToken": "moredata"})
+        record_messages = [m for m in SINGER_MESSAGES if isinstance(m, singer.RecordMessage)]
+        self.assertEqual([m.record for m in record_messages], [
+            {'reference': "GB-83320-S7", 'address_postCode': "HP11 1AA"},
+            {'reference': "GB-83321-S7", 'lastModified': "2021-02-24T08:30:26+00:00"},
+        ])
+
+
+    @responses.activate  # intercept HTTP calls within this method
+    def test_sync_appointment_users_fetched_once(self):
+        """ Test users are fetched once for every appointment page, and cached between runs """
+        self.catalog = catalog.discover(['appointment'])
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        users_cache_path = os.path.join(cache_dir, 'users.json')
+        mock_config = {
+            'account': 'mock-account-id',
+            'personal_access_token': "mock-token", # disables get_access_token call
+            'users_cache_path': users_cache_path,
+        }
+        users_uri = ("https://api.solarvista.com/datagateway/v3/mock-account-id"
+            + "/datasources/ref/users/data/query")
+        appointments_uri = ("https://api.solarvista.com/calendar/v2/mock-account-id"
+            + "/appointments/search/users")
+        responses.add(responses.POST, users_uri, json={
+            'continuationToken': 'moreusers',
+            'rows': [{"rowData": {"userId": "mock-user-id"}}]
+        })
+        responses.add(responses.POST, users_uri, json={
+            'rows': [{"rowData": {"userId": "mock-user-id2"}}]
+        })
+        responses.add(responses.POST, appointments_uri, json={
+            'continuationToken': 'moreappointments',
+            'appointments': [{"appointmentId": "mock-appointment-1"}]
+        })
+        responses.add(responses.POST, appointments_uri, json={
+            'appointments': [{"appointmentId": "mock-appointment-2"}]
+        })
+
+        tap_solarvista.sync.sync_all_data(mock_config, {}, self.catalog)
+        self.assertTrue(responses.assert_call_count(users_uri, 2))
+        self.assertTrue(responses.assert_call_count(appointments_uri, 2))
+        appointment_bodies = [json.loads(call.request.body) for call in responses.calls
+                              if call.request.url == appointments_uri]
+        self.assertEqual([body['userIds'] for body in appointment_bodies],
+                         [["mock-user-id", "mock-user-id2"]] * 2)
+
+        # a second run reads the users from the cache file
+        responses.add(responses.POST, appointments_uri, json={
+            'appointments': [{"appointmentId": "mock-appointment-3"}]
+        })
+        tap_solarvista.sync.sync_all_data(mock_config, {}, self.catalog)
+        self.assertTrue(responses.assert_call_count(users_uri, 2))
+        self.assertEqual(json.loads(responses.calls[-1].request.body)['userIds'],
+                         ["mock-user-id", "mock-user-id2"])
+
+    @responses.activate  # intercept HTTP calls within this method
+    def test_sync_appointment_users_incomplete(self):
+        """ Test users are not cached when a page of users could not be fetched """
+        self.catalog = catalog.discover(['appointment'])
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        users_cache_path = os.path.join(cache_dir, 'users.json')
+        mock_config = {
+            'account': 'mock-account-id',
+            'personal_access_token': "mock-token", # disables get_access_token call
+            'users_cache_path': users_cache_path,
+        }
+        users_uri = ("https://api.solarvista.com/datagateway/v3/mock-account-id"
+            + "/datasources/ref/users/data/query")
+        responses.add(responses.POST, users_uri, json={
+            'continuationToken': 'moreusers',
+            'rows': [{"rowData": {"userId": "mock-user-id"}}]
+        })
+        responses.add(responses.POST, users_uri, status=404)
+        responses.add(responses.POST, "https://api.solarvista.com/calendar/v2/mock-account-id"
+                      + "/appointments/search/users", json={'appointments': []})
+
+        tap_solarvista.sync.sync_all_data(mock_config, {}, self.catalog)
+        self.assertTrue(responses.assert_call_count(users_uri, 2))
+        self.assertNotIn('userIds', tap_solarvista.sync.RUN_CACHE)
+        self.assertFalse(os.path.exists(users_cache_path))
+
+    @responses.activate  # intercept HTTP calls within this method
+    def test_sync_appointment_no_users(self):
+        """ Test no users are not cached, so they are fetched again """
+        self.catalog = catalog.discover(['appointment'])
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        users_cache_path = os.path.join(cache_dir, 'users.json')
+        mock_config = {
+            'account': 'mock-account-id',
+            'personal_access_token': "mock-token", # disables get_access_token call
+            'users_cache_path': users_cache_path,
+        }
+        users_uri = ("https://api.solarvista.com/datagateway/v3/mock-account-id"
+            + "/datasources/ref/users/data/query")
+        responses.add(responses.POST, users_uri, json={'rows': []})
+
+        tap_solarvista.sync.sync_all_data(mock_config, {}, self.catalog)
+        self.assertFalse(os.path.exists(users_cache_path))
+        tap_solarvista.sync.sync_all_data(mock_config, {}, self.catalog)
+        self.assertTrue(responses.assert_call_count(users_uri, 2))
+
+    @responses.activate  # intercept HTTP calls within this method
+    def test_sync_shared_datasource(self):
+        """ Test the users datasource is paged once for the users and appointment streams
+            syncing concurrently """
+        self.catalog = catalog.discover(['users', 'appointment'])
+        mock_config = {
+            'account': 'mock-account-id',
+            'personal_access_token': "mock-token", # disables get_access_token call
+            'parallel_streams': 2,
+        }
+        users_uri = ("https://api.solarvista.com/datagateway/v3/mock-account-id"
+            + "/datasources/ref/users/data/query")
+        appointments_uri = ("https://api.solarvista.com/calendar/v2/mock-account-id"
+            + "/appointments/search/users")
+        responses.add(responses.POST, users_uri, json={
+            'continuationToken': 'moreusers',
+            'rows': [{"rowData": {"userId": "mock-user-id"}}]
+        })
+        responses.add(responses.POST, users_uri, json={
+            'rows': [{"rowData": {"userId": "mock-user-id2"}}]
+        })
+        responses.add(responses.POST, appointments_uri, json={
+            'appointments': [{"appointmentId": "mock-appointment-1"}]
+        })
+
+        tap_solarvista.sync.sync_all_data(mock_config, {}, self.catalog)
+        self.assertTrue(responses.assert_call_count(users_uri, 2))
+        self.assertEqual(json.loads(responses.calls[-1].request.body)['userIds'],
+                         ["mock-user-id", "mock-user-id2"])
+        records = [message.asdict() for message in SINGER_MESSAGES
+                   if isinstance(message, singer.RecordMessage)]
+        self.assertEqual([record['record'] for record in records
+                          if record['stream'] == 'users_stream'],
+                         [{'userId': "mock-user-id"}, {'userId': "mock-user-id2"}])
+        self.assertEqual(len(records), 3)
+
+
+    @responses.activate  # intercept HTTP calls within this method
+    def test_sync_appointment_windows(self):
+        """ Test appointments are searched in time slices and user chunks, bookmarking the
+            window so the next run only searches from the bookmark """
+        self.catalog = catalog.discover(['appointment'])
+        mock_config = {
+            'account': 'mock-account-id',
+            'personal_access_token': "mock-token", # disables get_access_token call
+            'appointment_window_days': 400,
+            'appointment_user_chunk_size': 1,
+            'max_concurrency': 2,
+        }
+        responses.add(
+            responses.POST,
+            "https://api.solarvista.com/datagateway/v3/mock-account-id"
+                + "/datasources/ref/users/data/query",
+            json={'rows': [{"rowData": {"userId": "mock-user-id"}},
+                           {"rowData": {"userId": "mock-user-id2"}}]},
+        )
+
+        def mock_appointments(request):
+            query = json.loads(request.body)
+            appointments = [{"appointmentId": "mock-unassigned"}]
+            appointments += [{"appointmentId": f"{user_id}-{query['from'][:10]}",
+                              "userId": user_id} for user_id in query['userIds']]
+            return (200, {}, json.dumps({'appointments': appointments}))
+
+        appointments_uri = ("https://api.solarvista.com/calendar/v2/mock-account-id"
+            + "/appointments/search/users")
+        responses.add_callback(responses.POST, appointments_uri, callback=mock_appointments)
+
+        tap_solarvista.sync.sync_all_data(mock_config, {}, self.catalog)
+        queries = [json.loads(call.request.body) for call in responses.calls
+                   if call.request.url == appointments_uri]
+        self.assertEqual(len(queries), 4, "Expecting 2 windows of 2 user chunks")
+        self.assertEqual(sorted(query['userIds'] for query in queries),
+                         [["mock-user-id"], ["mock-user-id"],
+                          ["mock-user-id2"], ["mock-user-id2"]])
+        one_year_past = datetime.now() - dateutil.relativedelta.relativedelta(years=1)
+        self.assertEqual(min(dateutil.parser.isoparse(query['from']) for query in queries)
+                         .replace(second=0, microsecond=0),
+                         one_year_past.replace(second=0, microsecond=0))
+
+        records = [m.record for m in SINGER_MESSAGES if isinstance(m, singer.RecordMessage)]
+        appointment_ids = [record['appointmentId'] for record in records]
+        self.assertEqual(len(appointment_ids), 5)
+        self.assertEqual(len(set(appointment_ids)), 5)
+        self.assertEqual(appointment_ids.count("mock-unassigned"), 1)
+
+        bookmark = dateutil.parser.isoparse(tap_solarvista.sync.STATE['appointment_stream'])
+        self.assertLessEqual(bookmark, datetime.now())
+        self.assertGreater(bookmark, datetime.now() - dateutil.relativedelta.relativedelta(
+            minutes=1))
+
+        # the next run starts from the bookmark, a single window to one year future
+        calls = len(responses.calls)
+        tap_solarvista.sync.sync_all_data(mock_config, {}, self.catalog)
+        queries = [json.loads(call.request.body) for call in responses.calls[calls:]
+                   if call.request.url == appointments_uri]
+        self.assertEqual(len(queries), 2)
+        self.assertEqual({query['from'] for query in queries}, {bookmark.isoformat()})
+
+
+    @responses.activate  # intercept HTTP calls within this method
+    def test_sync_multi_account(self):
+        """ Test each account of the 'account' list syncs with its own config and state """
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        mock_config = {
+            'account': ['mock-account-1', {'account': 'mock-account-2',
+                                           'personal_access_token': "mock-token-2"}],
+            'personal_access_token': "mock-token", # disables get_access_token call
+            'users_cache_path': os.path.join(cache_dir, 'users.json'),
+        }
+        for account in ['mock-account-1', 'mock-account-2']:
+            responses.add(responses.POST, "https://api.solarvista.com/datagateway/v3/"
+                          + account + "/datasources/ref/site/data/query", json={
+                'rows': [{"lastModified": "2021-03-01T00:00:00+00:00",
+                          "rowData": {"reference": "mock-site"}}]
+            })
+        state = {'accounts': {'mock-account-2': {'site_stream': "2021-01-01T00:00:00+00:00"}}}
+
+        tap_solarvista.sync.sync_all_data(mock_config, state, self.catalog)
+        self.assertEqual(sorted(call.request.headers['Authorization']
+                                for call in responses.calls),
+                         ["Bearer mock-token", "Bearer mock-token-2"])
+        schema = next(m for m in SINGER_MESSAGES if isinstance(m, singer.SchemaMessage))
+        self.assertEqual(schema.key_properties[-1], 'account')
+        self.assertIn('account', schema.schema['properties'])
+        records = [m.record for m in SINGER_MESSAGES if isinstance(m, singer.RecordMessage)]
+        self.assertEqual(sorted(record['account'] for record in records),
+                         ['mock-account-1', 'mock-account-2'])
+        self.assertEqual(SINGER_MESSAGES[-1].value, {'accounts': {
+            'mock-account-1': {'site_stream': "2021-03-01T00:00:00+00:00"},
+            'mock-account-2': {'site_stream': "2021-03-01T00:00:00+00:00"},
+        }})
+        self.assertEqual(tap_solarvista.sync.account_config(mock_config, 'mock-account-1')
+                         ['users_cache_path'],
+                         os.path.join(cache_dir, 'mock-account-1-users.json'))
+
+    def test_sync_multi_account_without_name(self):
+        """ Test an object of the 'account' list without its 'account' is rejected """
+        mock_config = {
+            'account': ['mock-account-1', {'personal_access_token': "mock-token-2"}],
+            'personal_access_token': "mock-token", # disables get_access_token call
+        }
+        with self.assertRaisesRegex(ValueError, "'account' list"):
+            tap_solarvista.sync.sync_all_data(mock_config, {}, self.catalog)
+
+
+    @responses.activate  # intercept HTTP calls within this method
+    def test_sync_datasource_incremental(self):
+        """ Test datasource rows modified before the bookmark are skipped,
+            and the bookmark moves to the latest row once the stream completes """
+        self.catalog = test_utils.discover_catalog('customer')
+        mock_config = {
+            'account': 'mock-account-id',
+            'personal_access_token': "mock-token", # disables get_access_token call
+        }
+        customers_uri = ("https://api.solarvista.com/datagateway/v3/mock-account-id"
+            + "/datasources/ref/customer/data/query")
+        responses.add(responses.POST, customers_uri, json={
+            'continuationToken': 'moredata',
+            'rows': [
+                {"lastModified": "2021-03-01T00:00:00+00:00",
+                 "rowData": {"reference": "mock-customer-1"}},
+                {"lastModified": "2021-01-01T00:00:00Z",
+                 "rowData": {"reference": "mock-customer-2"}},
+            ]
+        })
+        responses.add(responses.POST, customers_uri, json={
+            'rows': [
+                {"lastModified": "2021-02-01T00:00:00+00:00",
+                 "rowData": {"reference": "mock-customer-3"}},
+            ]
+        })
+        mock_state = {'customer_stream': "2021-01-15T00:00:00+00:00"}
+
+        tap_solarvista.sync.sync_all_data(mock_config, mock_state, self.catalog)
+        self.assertEqual([json.loads(call.request.body) for call in responses.calls],
+                         [{}, {'continuationToken': 'moredata'}])
+
+        records = [m.record['reference'] for m in SINGER_MESSAGES
+                   if isinstance(m, singer.RecordMessage)]
+        self.assertEqual(records, ['mock-customer-1', 'mock-customer-3'])
+        self.assertIsInstance(SINGER_MESSAGES[-1], singer.StateMessage)
+        self.assertEqual(SINGER_MESSAGES[-1].value,
+                         {'customer_stream': "2021-03-01T00:00:00+00:00"})
+
+    @responses.activate  # intercept HTTP calls within this method
+    def test_sync_datasource_incremental_unmodified(self):
+        """ Test datasource rows without lastModified are written, logged once per stream """
+        self.catalog = test_utils.discover_catalog('customer')
+        mock_config = {
+            'account': 'mock-account-id',
+            'personal_access_token': "mock-token", # disables get_access_token call
+        }
+        customers_uri = ("https://api.solarvista.com/datagateway/v3/mock-account-id"
+            + "/datasources/ref/customer/data/query")
+        responses.add(responses.POST, customers_uri, json={
+            'continuationToken': 'moredata',
+            'rows': [{"rowData": {"reference": "mock-customer-1"}},
+                     {"rowData": {"reference": "mock-customer-2"}}]
+        })
+        responses.add(responses.POST, customers_uri, json={
+            'rows': [{"rowData": {"reference": "mock-customer-3"}}]
+        })
+
+        # singer reconfigures the root logger as the metrics are recorded
+        with patch.object(tap_solarvista.sync, 'LOGGER') as mock_logger:
+            tap_solarvista.sync.sync_all_data(mock_config, {}, self.catalog)
+        self.assertEqual(mock_logger.warning.call_count, 1)
+        mock_logger.error.assert_not_called()
+        records = [m.record['reference'] for m in SINGER_MESSAGES
+                   if isinstance(m, singer.RecordMessage)]
+        self.assertEqual(records, ['mock-customer-1', 'mock-customer-2', 'mock-customer-3'])
+
+    @responses.activate  # intercept HTTP calls within this method
+    def test_sync_datasource_filter(self):
+        """ Test the datasource query is filtered by the bookmark when enabled """
+        self.catalog = test_utils.discover_catalog('site')
+        mock_config = {
+            'account': 'mock-account-id',
+            'personal_access_token': "mock-token", # disables get_access_token call
+            'datasource_filter_enabled': True,
+        }
+        responses.add(
+            responses.POST,
+            "https://api.solarvista.com/datagateway/v3/mock-account-id"
+                + "/datasources/ref/site/data/query",
+            json={'rows': []},
+        )
+        mock_state = {'site_stream': "2021-01-15T00:00:00+00:00"}
+
+        tap_solarvista.sync.sync_all_data(mock_config, mock_state, self.catalog)
+        self.assertEqual(json.loads(responses.calls[0].request.body), {
+            'filterGroups': [{
+                'filters': [{
+                    'comparison': "greaterThan",
+                    'fieldName': "lastModified",
+                    'value': "2021-01-15T00:00:00+00:00"
+                }]
+            }]
+        })
+        self.assertEqual(tap_solarvista.sync.STATE,
+                         {'site_stream': "2021-01-15T00:00:00+00:00"})
+
+
+    @responses.activate  # intercept HTTP calls within this method
+    def test_sync_field_selection(self):
+        """ Test properties deselected in the catalog are left out of schema and records """
+        self.catalog = catalog.discover(['site'])
+        for field_metadata in self.catalog.get_stream('site_stream').metadata:
+            if field_metadata['breadcrumb'] in [('properties', 'nickname'),
+                                                ('properties', 'lastModified')]:
+                field_metadata['metadata']['selected'] = False
+        mock_config = {
+            'account': 'mock-account-id',
+            'personal_access_token': "mock-token", # disables get_access_token call
+        }
+        responses.add(
+            responses.POST,
+            "https://api.solarvista.com/datagateway/v3/mock-account-id"
+                + "/datasources/ref/site/data/query",
+            json={'rows': [{
+                "rowData": {
+                    "reference": "GB-83320-S7",
+                    "nickname": "Hamill-Lueilwitz/High Wycombe",
+                    "lastModified": "2021-01-01T00:00:00+00:00",
+                }
+            }]},
+        )
+        tap_solarvista.sync.sync_all_data(mock_config, {}, self.catalog)
+
+        schema = SINGER_MESSAGES[0].schema
+        self.assertNotIn('nickname', schema['properties'])
+        self.assertIn('lastModified', schema['properties'])
+        self.assertEqual(SINGER_MESSAGES[1].record, {
+            'reference': "GB-83320-S7",
+            'lastModified': "2021-01-01T00:00:00+00:00",
+        })
+
+
+    @responses.activate  # intercept HTTP calls within this method
+    def test_sync_field_selection_history(self):
+        """ Test work item history fields deselected in the catalog are left out of records """
+        self.catalog = catalog.discover(['work-item', 'work-item-history'])
+        for field_metadata in self.catalog.get_stream('workitemhistory_stream').metadata:
+            if field_metadata['breadcrumb'] in [('properties', 'workflowId'),
+                                                ('properties', 'stage_stageDisplayName')]:
+                field_metadata['metadata']['selected'] = False
+        mock_config = {
+            'account': 'mock-account-id',
+            'personal_access_token': "mock-token", # disables get_access_token call
+            'start_date': "2020-05-14T14:14:14.455852+00:00"
+        }
+        responses.add(responses.POST, "https://api.solarvista.com/workflow/v4/mock-account-id"
+                      + "/workItems/search", json={'items': [{
+                          "workItemId": "mock-workitem-id",
+                          "lastModified": "2020-12-01T12:26:21.1250844+00:00"}]})
+        responses.add(responses.GET, "https://api.solarvista.com/workflow/v4/mock-account-id"
+                      + "/workItems/id/mock-workitem-id/history", json={
+                          "workItemId": "mock-workitem-id",
+                          "workflowId": "mock-workflow-id",
+                          "stages": [{"stageDisplayName": "Unassigned",
+                                      "stageType": "Unassigned"}]})
+        tap_solarvista.sync.sync_all_data(mock_config, {}, self.catalog)
+
+        schema = next(m.schema for m in SINGER_MESSAGES if isinstance(m, singer.SchemaMessage)
+                      and m.stream == 'workitemhistory_stream')
+        self.assertNotIn('workflowId', schema['properties'])
+        records = [m.record for m in SINGER_MESSAGES if isinstance(m, singer.RecordMessage)
+                   and m.stream == 'workitemhistory_stream']
+        self.assertEqual(records, [{
+            'workItemHistoryId': "mock-workitem-id_0",
+            'workItemId': "mock-workitem-id",
+            'stage_stageType': "Unassigned",
+            'lastModified': "2020-12-01T12:26:21.1250844+00:00",
+        }])
+
+
+    @responses.activate  # intercept HTTP calls within this method
+    def test_sync_continuation_checkpoint(self):
+        """ Test an interrupted datasource sync resumes from the last completed page """
+        self.catalog = test_utils.discover_catalog('site')
+        mock_config = {
+            'account': 'mock-account-id',
+            'personal_access_token': "mock-token", # disables get_access_token call
+        }
+        site_uri = ("https://api.solarvista.com/datagateway/v3/mock-account-id"
+            + "/datasources/ref/site/data/query")
+        responses.add(responses.POST, site_uri, json={
+            'continuationToken': 'mock-page-2',
+            'rows': [{"lastModified": "2021-03-01T00:00:00+00:00",
+                      "rowData": {"reference": "mock-site-1"}}]
+        })
+        responses.add(responses.POST, site_uri, status=404)
+
+        tap_solarvista.sync.sync_all_data(mock_config, {}, self.catalog)
+        state = SINGER_MESSAGES[-1].value
+        checkpoint = state['continuations']['site_stream']
+        self.assertEqual(checkpoint['continuationToken'], 'mock-page-2')
+        self.assertEqual(checkpoint['page'], 1)
+        self.assertEqual(checkpoint['bookmark'], "2021-03-01T00:00:00+00:00")
+        self.assertNotIn('site_stream', state)
+
+        responses.add(responses.POST, site_uri, json={
+            'rows': [{"lastModified": "2021-02-01T00:00:00+00:00",
+                      "rowData": {"reference": "mock-site-2"}}]
+        })
+        del SINGER_MESSAGES[:]
+        context.reset()
+        tap_solarvista.sync.sync_all_data(mock_config, state, self.catalog)
+        self.assertEqual(json.loads(responses.calls[-1].request.body),
+                         {'continuationToken': 'mock-page-2'})
+        records = [m.record['reference'] for m in SINGER_MESSAGES
+                   if isinstance(m, singer.RecordMessage)]
+        self.assertEqual(records, ['mock-site-2'])
+        self.assertEqual(SINGER_MESSAGES[-1].value,
+                         {'site_stream': "2021-03-01T00:00:00+00:00"})
+
+    @responses.activate  # intercept HTTP calls within this method
+    def test_sync_continuation_invalid(self):
+        """ Test an expired or rejected continuation restarts the datasource from the top """
+        self.catalog = test_utils.discover_catalog('site')
+        mock_config = {
+            'account': 'mock-account-id',
+            'personal_access_token': "mock-token", # disables get_access_token call
+        }
+        site_uri = ("https://api.solarvista.com/datagateway/v3/mock-account-id"
+            + "/datasources/ref/site/data/query")
+        responses.add(responses.POST, site_uri, status=400)
+        responses.add(responses.POST, site_uri, json={
+            'rows': [{"rowData": {"reference": "mock-site-1"}}]
+        })
+        checkpointed_at = singer.utils.now() - dateutil.relativedelta.relativedelta(minutes=5)
+        mock_state = {'continuations': {'site_stream': {
+            'continuationToken': 'mock-stale',
+            'page': 3,
+            'checkpointedAt': singer.utils.strftime(checkpointed_at)
+        }}}
+
+        tap_solarvista.sync.sync_all_data(mock_config, mock_state, self.catalog)
+        self.assertEqual([json.loads(call.request.body) for call in responses.calls],
+                         [{'continuationToken': 'mock-stale'}, {}])
+        records = [m.record['reference'] for m in SINGER_MESSAGES
+                   if isinstance(m, singer.RecordMessage)]
+        self.assertEqual(records, ['mock-site-1'])
+        self.assertEqual(SINGER_MESSAGES[-1].value, {})
+
+        # a checkpoint older than 'continuation_ttl' is not resumed
+        calls = len(responses.calls)
+        tap_solarvista.sync.sync_all_data(dict(mock_config, continuation_ttl=60),
+                                          mock_state, self.catalog)
+        self.assertEqual([json.loads(call.request.body) for call in responses.calls[calls:]],
+                         [{}])
+        self.assertNotIn('continuations', tap_solarvista.sync.STATE)
+
+
+    @responses.activate  # intercept HTTP calls within this method
+    def test_sync_continuation_users(self):
+        """ Test the ids of users resumed from a checkpoint are not cached, only some
+            pages were read """
+        self.catalog = catalog.discover(['users'])
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        users_cache_path = os.path.join(cache_dir, 'users.json')
+        mock_config = {
+            'account': 'mock-account-id',
+            'personal_access_token': "mock-token", # disables get_access_token call
+            'users_cache_path': users_cache_path,
+        }
+        users_uri = ("https://api.solarvista.com/datagateway/v3/mock-account-id"
+            + "/datasources/ref/users/data/query")
+        responses.add(responses.POST, users_uri, json={
+            'rows': [{"rowData": {"userId": "mock-user-id2"}}]
+        })
+        mock_state = {'continuations': {'users_stream': {
+            'continuationToken': 'mock-page-2',
+            'page': 1,
+            'checkpointedAt': singer.utils.strftime(singer.utils.now())
+        }}}
+
+        tap_solarvista.sync.sync_all_data(mock_config, mock_state, self.catalog)
+        self.assertEqual([json.loads(call.request.body) for call in responses.calls],
+                         [{'continuationToken': 'mock-page-2'}])
+        self.assertFalse(os.path.exists(users_cache_path))
+        self.assertIsNone(tap_solarvista.sync.RUN_CACHE.get('userIds'))
+
+
+    @responses.activate  # intercept HTTP calls within this method
+    def test_sync_workitem_filters(self):
+        """ Test work-items are searched with each predefined filter and its own bookmark """
+        self.catalog = catalog.discover(['work-item'])
+        open_filter = [{'comparison': "equals", 'fieldName': "isCompleted", 'value': False}]
+        completed_filter = {'filterGroups': [
+            {'filters': [{'comparison': "equals", 'fieldName': "isCompleted", 'value': True}]}
+        ]}
+        mock_config = {
+            'account': 'mock-account-id',
+            'personal_access_token': "mock-token", # disables get_access_token call
+            'start_date': "2020-05-14T14:14:14.455852+00:00",
+            'workitem_filters': {'open': open_filter, 'completed': completed_filter},
+        }
+        mock_state = {'workitem_stream_completed': "2021-01-01T00:00:00+00:00"}
+        search_uri = ("https://api.solarvista.com/workflow/v4/mock-account-id"
+            + "/workItems/search")
+        responses.add(responses.POST, search_uri, json={'items': [
+            {"workItemId": "mock-workitem-1", "lastModified": "2021-02-01T00:00:00+00:00"},
+        ]})
+        responses.add(responses.POST, search_uri, json={'items': [
+            {"workItemId": "mock-workitem-2", "lastModified": "2021-03-01T00:00:00+00:00"},
+        ]})
+
+        tap_solarvista.sync.sync_all_data(mock_config, mock_state, self.catalog)
+        queries = [json.loads(call.request.body) for call in responses.calls]
+        self.assertEqual([query['filterGroups'] for query in queries],
+                         [[{'filters': open_filter}], completed_filter['filterGroups']])
+        self.assertEqual([query['lastModifiedAfter'] for query in queries],
+                         ["2020-05-14T14:14:14.455852+00:00", "2021-01-01T00:00:00+00:00"])
+        records = [m.record['workItemId'] for m in SINGER_MESSAGES
+                   if isinstance(m, singer.RecordMessage)]
+        self.assertEqual(records, ['mock-workitem-1', 'mock-workitem-2'])
+        self.assertEqual(SINGER_MESSAGES[-1].value, {
+            'workitem_stream_open': "2021-02-01T00:00:00+00:00",
+            'workitem_stream_completed': "2021-03-01T00:00:00+00:00",
+        })
+
+
 if __name__ == '__main__':
     unittest.main()
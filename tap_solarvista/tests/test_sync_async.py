@@ -0,0 +1,186 @@
+""" Test sync_async package """
+import asyncio
+import unittest
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+import singer
+import tap_solarvista
+import tap_solarvista.sync
+from tap_solarvista import catalog
+from tap_solarvista import context
+from tap_solarvista.tests.utils import SINGER_MESSAGES, SINGER_METRICS
+try:
+    from tap_solarvista import sync_async
+    HAS_AIOHTTP = True
+except ImportError:
+    HAS_AIOHTTP = False
+
+MOCK_DATAGATEWAY = "https://api.solarvista.com/datagateway/v3/mock-account-id/datasources/ref"
+MOCK_WORKFLOW = "https://api.solarvista.com/workflow/v4/mock-account-id/workItems"
+MOCK_APPOINTMENTS = ("https://api.solarvista.com/calendar/v2/mock-account-id"
+                     "/appointments/search/users")
+
+@unittest.skipUnless(HAS_AIOHTTP, "asyncio engine requires aiohttp")
+class TestSyncAsync(unittest.TestCase):
+    """ Test class for sync_async package """
+
+    def setUp(self):
+        """ Setup the test objects and helpers """
+        del SINGER_MESSAGES[:]
+        del SINGER_METRICS[:]
+        context.reset()
+        self.config = {
+            'account': 'mock-account-id',
+            'personal_access_token': "mock-token", # disables get_access_token call
+            'start_date': "2020-05-14T14:14:14.455852+00:00",
+            'sync_engine': 'asyncio',
+        }
+        self.mock_responses = []
+        self.calls = []
+        patcher = patch.object(sync_async.AsyncClient, '_fetch', self.mock_fetch)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def add_response(self, method, uri, status=200, payload=None):
+        """ Queue a mock response, matched in order of the method and uri """
+        self.mock_responses.append((method, uri, status, payload))
+
+    async def mock_fetch(self, method, headers, uri, _body):
+        """ Replacement for the aiohttp fetch, returning the first matching response """
+        self.calls.append((method, uri, headers.get('Authorization')))
+        # yield to the other streams, as a request in flight would
+        await asyncio.sleep(0)
+        for i, (mock_method, mock_uri, status, payload) in enumerate(self.mock_responses):
+            if mock_method == method and mock_uri == uri:
+                del self.mock_responses[i]
+                return status, payload
+        return 404, None
+
+    def test_sync_async_datasources(self):
+        """ Test the asyncio engine pages each selected datasource """
+        local_catalog = catalog.discover(['customer', 'site'])
+        self.add_response("POST", f"{MOCK_DATAGATEWAY}/site/data/query", payload={
+            'continuationToken': 'moredata',
+            'rows': [{"rowData": {"reference": "mock-site-1"}}]
+        })
+        self.add_response("POST", f"{MOCK_DATAGATEWAY}/site/data/query", payload={
+            'rows': [{"rowData": {"reference": "mock-site-2"}}]
+        })
+        self.add_response("POST", f"{MOCK_DATAGATEWAY}/customer/data/query", payload={
+            'rows': [{"rowData": {"reference": "mock-customer-1"}}]
+        })
+        tap_solarvista.sync.sync_all_data(self.config, {}, local_catalog)
+
+        records = [(m.stream, m.record['reference']) for m in SINGER_MESSAGES
+                   if isinstance(m, singer.RecordMessage)]
+        self.assertEqual(sorted(records), [
+            ('customer_stream', 'mock-customer-1'),
+            ('site_stream', 'mock-site-1'),
+            ('site_stream', 'mock-site-2'),
+        ])
+        self.assertEqual(len(SINGER_METRICS), 2)
+
+    def test_sync_async_workitem_children(self):
+        """ Test the asyncio engine writes work item children before the work items """
+        local_catalog = catalog.discover(['work-item', 'work-item-history'])
+        self.add_response("POST", f"{MOCK_WORKFLOW}/search", payload={
+            'items': [
+                {"workItemId": "mock-workitem-1", "lastModified": "2021-01-01T00:00:00Z"},
+                {"workItemId": "mock-workitem-2", "lastModified": "2021-01-02T00:00:00Z"},
+            ]
+        })
+        for workitem_id in ["mock-workitem-1", "mock-workitem-2"]:
+            self.add_response("GET", f"{MOCK_WORKFLOW}/id/{workitem_id}/history", payload={
+                "workItemId": workitem_id,
+                "stages": [{"stageType": "Unassigned"}]
+            })
+        tap_solarvista.sync.sync_all_data(self.config, {}, local_catalog)
+
+        messages = [m for m in SINGER_MESSAGES if not isinstance(m, singer.SchemaMessage)]
+        self.assertEqual([(m.stream, m.record['workItemId']) for m in messages
+                          if isinstance(m, singer.RecordMessage)], [
+            ('workitemhistory_stream', 'mock-workitem-1'),
+            ('workitemhistory_stream', 'mock-workitem-2'),
+            ('workitem_stream', 'mock-workitem-1'),
+            ('workitem_stream', 'mock-workitem-2'),
+        ])
+        self.assertIsInstance(messages[-1], singer.StateMessage)
+        self.assertEqual(messages[-1].value, {'workitem_stream': "2021-01-02T00:00:00Z"})
+
+    def test_sync_async_refresh_token(self):
+        """ Test the asyncio engine requests a new token when the token expires """
+        self.config.pop('personal_access_token')
+        local_catalog = catalog.discover(['site'])
+        self.add_response("POST", "https://auth.solarvista.com/connect/token",
+                    payload={"access_token": "mock-token-1"})
+        self.add_response("POST", f"{MOCK_DATAGATEWAY}/site/data/query", status=401)
+        self.add_response("POST", "https://auth.solarvista.com/connect/token",
+                    payload={"access_token": "mock-token-2"})
+        self.add_response("POST", f"{MOCK_DATAGATEWAY}/site/data/query", payload={
+            'rows': [{"rowData": {"reference": "mock-site-1"}}]
+        })
+        tap_solarvista.sync.sync_all_data(self.config, {}, local_catalog)
+
+        self.assertEqual(tap_solarvista.sync.CONFIG['personal_access_token'], "mock-token-2")
+        self.assertEqual([authorization for _, _, authorization in self.calls], [
+            None, "Bearer mock-token-1", None, "Bearer mock-token-2"])
+        records = [m.record for m in SINGER_MESSAGES if isinstance(m, singer.RecordMessage)]
+        self.assertEqual(records, [{'reference': 'mock-site-1'}])
+
+    def test_sync_async_appointment_windows(self):
+        """ Test the asyncio engine searches appointment windows for each user chunk """
+        self.config.update({'appointment_window_days': 400, 'appointment_user_chunk_size': 1})
+        local_catalog = catalog.discover(['appointment'])
+        self.add_response("POST", f"{MOCK_DATAGATEWAY}/users/data/query", payload={
+            'rows': [{"rowData": {"userId": "mock-user-1"}}, {"rowData": {"userId": "mock-user-2"}}]
+        })
+        for i in range(4):
+            self.add_response("POST", MOCK_APPOINTMENTS, payload={
+                'appointments': [{"appointmentId": f"mock-appointment-{i % 3}"}]
+            })
+        tap_solarvista.sync.sync_all_data(self.config, {}, local_catalog)
+
+        self.assertEqual(len([call for call in self.calls if call[1] == MOCK_APPOINTMENTS]), 4)
+        records = [m.record for m in SINGER_MESSAGES if isinstance(m, singer.RecordMessage)]
+        self.assertEqual(sorted(record['appointmentId'] for record in records),
+                         ['mock-appointment-0', 'mock-appointment-1', 'mock-appointment-2'])
+        self.assertIn('appointment_stream', tap_solarvista.sync.STATE)
+
+    def test_sync_async_shared_datasource(self):
+        """ Test the asyncio engine pages the users once for the users and appointment streams """
+        local_catalog = catalog.discover(['users', 'appointment'])
+        self.add_response("POST", f"{MOCK_DATAGATEWAY}/users/data/query", payload={
+            'continuationToken': 'moreusers', 'rows': [{"rowData": {"userId": "mock-user-1"}}]
+        })
+        self.add_response("POST", f"{MOCK_DATAGATEWAY}/users/data/query", payload={
+            'rows': [{"rowData": {"userId": "mock-user-2"}}]
+        })
+        self.add_response("POST", MOCK_APPOINTMENTS, payload={
+            'appointments': [{"appointmentId": "mock-appointment-1"}]
+        })
+        tap_solarvista.sync.sync_all_data(self.config, {}, local_catalog)
+
+        self.assertEqual([call[1] for call in self.calls].count(
+            f"{MOCK_DATAGATEWAY}/users/data/query"), 2)
+        records = [m.record for m in SINGER_MESSAGES if isinstance(m, singer.RecordMessage)]
+        self.assertEqual(sorted(record.get('userId', '') for record in records),
+                         ['', 'mock-user-1', 'mock-user-2'])
+
+    def test_sync_async_users_incomplete(self):
+        """ Test the asyncio engine does not keep the users when a page could not be fetched """
+        local_catalog = catalog.discover(['appointment'])
+        self.add_response("POST", f"{MOCK_DATAGATEWAY}/users/data/query", payload={
+            'continuationToken': 'moreusers', 'rows': [{"rowData": {"userId": "mock-user-1"}}]
+        })
+        self.add_response("POST", MOCK_APPOINTMENTS, payload={'appointments': []})
+        tap_solarvista.sync.sync_all_data(self.config, {}, local_catalog)
+
+        self.assertEqual([call[1] for call in self.calls].count(
+            f"{MOCK_DATAGATEWAY}/users/data/query"), 2)
+        self.assertNotIn('userIds', tap_solarvista.sync.RUN_CACHE)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+""" Test writer package """
+import io
+import json
+import unittest
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+import singer
+from tap_solarvista import writer
+from tap_solarvista.tests.utils import SINGER_MESSAGES
+
+class TestWriter(unittest.TestCase):
+    """ Test class for writer package """
+
+    def setUp(self):
+        """ Setup the test objects and helpers """
+        del SINGER_MESSAGES[:]
+        self.stdout = io.StringIO()
+        patcher = patch('sys.stdout', self.stdout)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        """ Restore unbuffered output """
+        writer.configure({})
+
+    def output_messages(self):
+        """ Return the messages written to stdout """
+        return [json.loads(line) for line in self.stdout.getvalue().splitlines()]
+
+    def test_unbuffered_writes_through_singer(self):
+        """ Test messages are written straight through singer without a buffer size """
+        writer.configure({})
+        writer.write_record('site_stream', {'reference': 'mock-site-1'})
+        writer.write_state({'site_stream': 'mock-state'})
+        self.assertEqual(len(SINGER_MESSAGES), 2)
+        self.assertIsInstance(SINGER_MESSAGES[0], singer.RecordMessage)
+        self.assertIsInstance(SINGER_MESSAGES[1], singer.StateMessage)
+        self.assertEqual(self.stdout.getvalue(), '')
+
+    def test_buffered_records_flush_with_state(self):
+        """ Test records are buffered until a state message flushes them in order """
+        writer.configure({'output_buffer_size': 1024 * 1024})
+        writer.write_record('site_stream', {'reference': 'mock-site-1'})
+        writer.write_record('site_stream', {'reference': 'mock-site-2'})
+        self.assertEqual(self.stdout.getvalue(), '')
+
+        writer.write_state({'site_stream': 'mock-state'})
+        self.assertEqual(SINGER_MESSAGES, [])
+        self.assertEqual(self.output_messages(), [
+            {'type': 'RECORD', 'stream': 'site_stream', 'record': {'reference': 'mock-site-1'}},
+            {'type': 'RECORD', 'stream': 'site_stream', 'record': {'reference': 'mock-site-2'}},
+            {'type': 'STATE', 'value': {'site_stream': 'mock-state'}},
+        ])
+
+    def test_buffered_flush_on_size(self):
+        """ Test the buffer is flushed once it reaches the configured size """
+        writer.configure({'output_buffer_size': 100})
+        for i in range(5):
+            writer.write_record('site_stream', {'reference': f"mock-site-{i}"})
+        written = self.output_messages()
+        self.assertGreater(len(written), 0)
+        self.assertLess(len(written), 5)
+        writer.flush()
+        self.assertEqual([m['record']['reference'] for m in self.output_messages()],
+                         [f"mock-site-{i}" for i in range(5)])
+
+    def test_encode_message_matches_singer(self):
+        """ Test the fast encoder produces the same message as singer """
+        message = singer.RecordMessage(stream='site_stream', record={
+            'reference': 'mock-site-1', 'nickname': 'Café', 'charge': 233.5,
+            'isCompleted': False, 'tags': ['a', 'b'], 'site': None})
+        self.assertEqual(json.loads(writer.encode_message(message)),
+                         json.loads(singer.format_message(message)))
+        self.assertTrue(writer.encode_message(message).endswith(b'\n'))
+
+    def test_state_coalesced_by_records(self):
+        """ Test state messages are only written once 'state_records' records have passed """
+        writer.configure({'state_records': 3})
+        for i in range(1, 4):
+            writer.write_record('site_stream', {'reference': f'mock-site-{i}'})
+            writer.write_state({'site_stream': f'mock-state-{i}'})
+        writer.write_record('site_stream', {'reference': 'mock-site-4'})
+        state = {'site_stream': 'mock-state-4'}
+        writer.write_state(state)
+        # the pending state is a copy of the state when it was written
+        state['site_stream'] = 'mock-state-changed'
+        writer.flush_state()
+        writer.flush_state()
+        self.assertEqual([(type(m).__name__, getattr(m, 'value', None)) for m in SINGER_MESSAGES], [
+            ('RecordMessage', None),
+            ('RecordMessage', None),
+            ('RecordMessage', None),
+            ('StateMessage', {'site_stream': 'mock-state-3'}),
+            ('RecordMessage', None),
+            ('StateMessage', {'site_stream': 'mock-state-4'}),
+        ])
+
+    def test_state_coalesced_by_interval(self):
+        """ Test state messages are only written once 'state_interval' seconds have passed """
+        writer.configure({'state_interval': 60})
+        writer.write_state({'site_stream': 'mock-state-1'})
+        writer.write_state({'site_stream': 'mock-state-2'})
+        self.assertEqual(SINGER_MESSAGES, [])
+        writer.PENDING_STATE['written_at'] -= 60
+        writer.write_state({'site_stream': 'mock-state-3'})
+        self.assertEqual([m.value for m in SINGER_MESSAGES], [{'site_stream': 'mock-state-3'}])
+        writer.flush_state()
+        self.assertEqual(len(SINGER_MESSAGES), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
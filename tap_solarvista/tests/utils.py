@@ -1,7 +1,20 @@
 """ Utilities used in this module """
+import singer
 import tap_solarvista
 from tap_solarvista import schemas
 
+SINGER_MESSAGES = []
+def accumulate_singer_messages(message):
+    """ function to collect singer library write_message in tests """
+    SINGER_MESSAGES.append(message)
+singer.messages.write_message = accumulate_singer_messages
+
+SINGER_METRICS = []
+def accumulate_singer_metrics(_logger, point):
+    """ function to collect singer library metrics in tests """
+    SINGER_METRICS.append(point)
+singer.metrics.log = accumulate_singer_metrics
+
 def discover_catalog(datasource):
     """ Return a catalog with the supplied datasources updated with singer 'selected' metadata """
     catalog = tap_solarvista.catalog.discover({})
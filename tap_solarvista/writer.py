@@ -0,0 +1,113 @@
+""" writer is responsible for writing singer messages to stdout, optionally buffered """
+import copy
+import sys
+import threading
+import time
+import singer
+from tap_solarvista import profiling
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+LOGGER = singer.get_logger()
+DEFAULT_OUTPUT_BUFFER_SIZE = 0 # bytes, 0 writes every message straight through singer
+DEFAULT_STATE_INTERVAL = 0 # seconds between state messages, 0 writes every state
+DEFAULT_STATE_RECORDS = 0 # records between state messages, 0 writes every state
+
+BUFFER = bytearray()
+BUFFER_LOCK = threading.RLock()
+OUTPUT_BUFFER_SIZE = DEFAULT_OUTPUT_BUFFER_SIZE
+STATE_INTERVAL = DEFAULT_STATE_INTERVAL
+STATE_RECORDS = DEFAULT_STATE_RECORDS
+PENDING_STATE = {'value': None, 'records': 0, 'written_at': 0.0}
+
+def configure(config):
+    """ Configure the output buffer size and state interval from config,
+        flushing anything already buffered """
+    global OUTPUT_BUFFER_SIZE, STATE_INTERVAL, STATE_RECORDS # pylint: disable=global-statement
+    with BUFFER_LOCK:
+        flush_state()
+        flush()
+        OUTPUT_BUFFER_SIZE = int(config.get('output_buffer_size', DEFAULT_OUTPUT_BUFFER_SIZE))
+        STATE_INTERVAL = float(config.get('state_interval', DEFAULT_STATE_INTERVAL))
+        STATE_RECORDS = int(config.get('state_records', DEFAULT_STATE_RECORDS))
+        PENDING_STATE.update({'value': None, 'records': 0, 'written_at': time.monotonic()})
+
+def encode_message(message):
+    """ Serialize a singer message to a line of json bytes, with orjson when installed """
+    if orjson is not None:
+        try:
+            return orjson.dumps(message.asdict(), # pylint: disable=no-member
+                                option=orjson.OPT_APPEND_NEWLINE) # pylint: disable=no-member
+        except TypeError:
+            # e.g. Decimal or integers beyond 64 bits, fall back to singer's encoder
+            pass
+    return (singer.format_message(message) + '\n').encode('utf-8')
+
+def write_message(message):
+    """ Write a singer message, buffered when an 'output_buffer_size' is configured """
+    with BUFFER_LOCK:
+        if OUTPUT_BUFFER_SIZE <= 0:
+            singer.messages.write_message(message)
+            return
+        BUFFER.extend(encode_message(message))
+        if len(BUFFER) >= OUTPUT_BUFFER_SIZE:
+            flush()
+
+def write_record(stream_name, record):
+    """ Write a record message """
+    with BUFFER_LOCK, profiling.phase('write'):
+        write_message(singer.RecordMessage(stream=stream_name, record=record))
+        PENDING_STATE['records'] += 1
+
+def write_schema(stream_name, schema, key_properties):
+    """ Write a schema message """
+    write_message(singer.SchemaMessage(stream=stream_name, schema=schema,
+                                       key_properties=key_properties))
+
+def write_state(value):
+    """ Write a state message, flushed immediately along with every record before it,
+        once 'state_interval' seconds or 'state_records' records have passed since the
+        last state, otherwise the latest state is kept until then or flush_state """
+    with BUFFER_LOCK, profiling.phase('state'):
+        if is_state_due():
+            emit_state(value)
+        else:
+            # copied, the state changes as later records are written
+            PENDING_STATE['value'] = copy.deepcopy(value)
+
+def is_state_due():
+    """ Returns True when a state message is due """
+    if STATE_INTERVAL <= 0 and STATE_RECORDS <= 0:
+        return True
+    elapsed = time.monotonic() - PENDING_STATE['written_at']
+    return 0 < STATE_RECORDS <= PENDING_STATE['records'] or 0 < STATE_INTERVAL <= elapsed
+
+def flush_state():
+    """ Write the pending state message, if any """
+    with BUFFER_LOCK, profiling.phase('state'):
+        if PENDING_STATE['value'] is not None:
+            emit_state(PENDING_STATE['value'])
+
+def emit_state(value):
+    """ Write a state message now """
+    LOGGER.debug("Writing state [%s]", value)
+    write_message(singer.StateMessage(value=value))
+    flush()
+    PENDING_STATE.update({'value': None, 'records': 0, 'written_at': time.monotonic()})
+
+def flush():
+    """ Flush buffered messages to stdout """
+    with BUFFER_LOCK:
+        if not BUFFER:
+            return
+        output = getattr(sys.stdout, 'buffer', None)
+        if output is not None:
+            sys.stdout.flush()
+            output.write(BUFFER)
+            output.flush()
+        else:
+            sys.stdout.write(BUFFER.decode('utf-8'))
+            sys.stdout.flush()
+        BUFFER.clear()